@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Parallel segmented analysis of long tester recordings
+
+The recording is split into segments that are analysed in a process pool,
+each worker seeking to its segment. A worker starts a warm-up overlap before
+its segment so that the previous frame and the popup / alert state are
+settled when the segment starts; events of the warm-up are dropped.
+
+At every segment boundary the state the worker reached after warm-up is
+compared with the state the previous segment ended in. If they differ the
+segment is analysed again starting from the exact state, so the merged event
+timeline is identical to a sequential run. The re-runs go to the pool in
+rounds until all boundaries agree. Alerts are acknowledged after --ack seconds
+as an operator would, otherwise the alert never clears and every segment after
+the first alert needs a re-run. Exactness needs the previous
+frame to be the preceding video frame, so the static-frame fast path and
+tiled diff are not used here.
+'''
+import sys
+import json
+import time
+import logging
+import pathlib
+import importlib
+import multiprocessing as mp
+import cv2
+
+scriptPath = pathlib.Path(__file__).parent.resolve()
+sys.path.append(str(scriptPath))
+sys.path.append(str(scriptPath / 'common'))
+import argsutils as au
+from final_algo import TesterDetection
+from frame_source import open_source
+
+
+def analyse_segment (source, args, start, end, warm, state=None):
+    ''' analyse frames [start, end) of %source (end None: up to the end of the video)
+        warm: number of frames before %start analysed only to warm up previous frame and state
+        state: exact state at %start (TesterDetection.get_state()), replaces the warm-up
+        return dict with the state at start and end, events and number of frames
+    '''
+    replay = importlib.import_module('algo-replay')
+    rec = replay.ReplayRecorder()
+    det = TesterDetection(source, rec, args.id, detectionType=args.det_type, scale=args.scale,
+        staticTol=None, realtime=False, timingSample=0, metricsPeriod=0,
+        alertAck=args.ack if args.ack >= 0 else None)
+    rec.clock = lambda: det.frame_time
+    det.load_configuration()
+
+    _first = max(0, start - 1) if state is not None else max(0, start - 1 - warm)
+    _src = open_source(source, gray=args.gray_capture)
+    if _first:
+        _src.set(cv2.CAP_PROP_POS_FRAMES, _first)
+    ret, frame = _src.read()
+    if not ret:
+        return {'start': start, 'end': end, 'state_in': None, 'state_out': None, 'events': [], 'frames': 0}
+    det.reset_state(frame)
+    if state is not None:
+        det.set_state(state)
+
+    _idx, _frames, state_in, buf = _first + 1, 0, None, None
+    while end is None or _idx < end:
+        if state_in is None and _idx >= start:
+            # segment starts here, warm-up events are dropped
+            state_in = det.get_state()
+            rec.events = []
+        ret, buf = _src.read(buf)
+        if not ret:
+            break
+        det.analyse_frame(buf, _src.timestamp)
+        if _idx >= start: _frames += 1
+        _idx += 1
+    _src.release()
+    return {
+        'start': start,
+        'end': end,
+        'state_in': state_in if state_in is not None else det.get_state(),
+        'state_out': det.get_state(),
+        'events': rec.events,
+        'frames': _frames,
+    }
+
+
+def analyse_parallel (source, args):
+    ''' analyse %source in segments on a process pool and merge into the sequential result '''
+    _src = open_source(source)
+    _count, _fps = _src.count, _src.fps or 30.0
+    _src.release()
+
+    _segments = max(1, args.segments or args.jobs)
+    _len = max(1, -(-_count // _segments)) if _count > 0 else None
+    _warm = int(args.overlap * _fps)
+    if _len is None:
+        _bounds = [(0, None)]
+    else:
+        _bounds = [(s, s + _len) for s in range(0, _count, _len)]
+        # last segment runs to the real end, the frame count of a video is an estimate
+        _bounds[-1] = (_bounds[-1][0], None)
+
+    fixups = 0
+    with mp.Pool(args.jobs) as pool:
+        results = pool.starmap(analyse_segment, [(source, args, s, e, _warm) for s, e in _bounds])
+        while True:
+            # segments whose warm-up did not reach the state the previous segment ended in, analysed
+            # again from that state; each round makes at least the first of them exact
+            _redo = [i for i in range(1, len(results)) if results[i]['state_in'] != results[i - 1]['state_out']]
+            if not _redo:
+                break
+            for i in _redo:
+                logging.debug('Segment at frame {} starts in {} instead of {}, re-running'.format(
+                    results[i]['start'], results[i]['state_in'], results[i - 1]['state_out']))
+            _rerun = pool.starmap(analyse_segment, [(source, args, results[i]['start'], results[i]['end'], 0,
+                results[i - 1]['state_out']) for i in _redo])
+            for i, res in zip(_redo, _rerun):
+                results[i] = res
+            fixups += len(_redo)
+
+    return {
+        'frames': sum(r['frames'] for r in results),
+        'segments': len(results),
+        'fixups': fixups,
+        'events': [e for r in results for e in r['events']],
+    }
+
+
+if __name__ == "__main__":
+    parser = au.init_parser('Algo Batch Analysis')
+    au.add_arg(parser, 'sources', n='+', h='recorded videos to analyse')
+    au.add_arg(parser, '--id', t=str, h='tester id used in the channel names {D}', d='batch', m='ID')
+    au.add_arg(parser, '--det-type', t=int, h='tester UI detection type (index of DET_TYPE) {D}', d=2, m='TYPE')
+    au.add_arg(parser, '--scale', t=float, h='analysis scale, e.g. 0.5 or 0.25 {D}', d=1.0, m='SCALE')
+    au.add_arg(parser, '--gray-capture', a=True, h='analyse luminance only frames')
+    au.add_arg(parser, '--jobs', t=int, h='worker processes {D}', d=mp.cpu_count(), m='N')
+    au.add_arg(parser, '--segments', t=int, h='number of segments, 0 for one per worker {D}', d=0, m='N')
+    au.add_arg(parser, '--overlap', t=float, h='warm-up before each segment in seconds {D}', d=120.0, m='SEC')
+    au.add_arg(parser, '--ack', t=float, h='seconds until an alert is acknowledged and reset, negative: never {D}', d=5.0, m='SEC')
+    au.add_arg(parser, '--verify', a=True, h='also run sequentially and check the merged timeline is identical')
+    au.add_arg(parser, '--output', t=str, h='write JSON report to file instead of stdout {D}', d=None, m='FILE')
+    args = au.parse_args(parser)
+
+    # the detection prints its state changes (in the workers too), keep stdout for the JSON report
+    _stdout = sys.stdout
+    if not args.output:
+        sys.stdout = sys.stderr
+
+    report = []
+    for src in args.sources:
+        _start = time.perf_counter()
+        res = analyse_parallel(src, args)
+        _elapsed = time.perf_counter() - _start
+        res.update({
+            'source': str(src),
+            'elapsed-seconds': round(_elapsed, 3),
+            'fps': round(res['frames'] / _elapsed, 2) if _elapsed > 0 else 0.0,
+        })
+        logging.info('{}: {} frames in {}s ({} fps) on {} segments, {} re-run'.format(
+            src, res['frames'], res['elapsed-seconds'], res['fps'], res['segments'], res['fixups']))
+        if args.verify:
+            _seq = analyse_segment(src, args, 0, None, 0)
+            res['identical'] = _seq['events'] == res['events'] and _seq['frames'] == res['frames']
+            logging.info('{}: merged timeline {} sequential run'.format(
+                src, 'identical to' if res['identical'] else 'DIFFERS from'))
+        report.append(res)
+
+    if args.output:
+        with open(args.output, 'wt') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2), file=_stdout)
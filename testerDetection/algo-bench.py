@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Microbenchmarks of the detection pipeline stages
+
+Every stage of the masking pipeline is timed on its own on synthetic tester
+screens of screen_synth (a popup appearing between two frames, over the
+scrolling log and the cursor of the UI type) at the requested resolutions: grayscale conversion, absdiff, threshold,
+countNonZero, findContours + contourArea, the HSV inRange of popup_detection
+and the multi-scale edge matchTemplate of mouse_detection.
+
+The report is JSON with the commit, OpenCV build and host it was taken on.
+Given a previous report as baseline, the stages that got slower than the
+regression factor are listed, so results can be compared between commits.
+'''
+import sys
+import json
+import time
+import socket
+import logging
+import pathlib
+import platform
+import subprocess
+import numpy as np
+import cv2
+
+scriptPath = pathlib.Path(__file__).parent.resolve()
+sys.path.append(str(scriptPath))
+sys.path.append(str(scriptPath / 'common'))
+import argsutils as au
+import mouse_detection as md
+from popup_detection import BLUE_FIRST, BLUE_SECOND
+from cursor_detector import SCALES
+from screen_synth import TesterScreen, Popup
+
+RESOLUTIONS = {
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '1440p': (2560, 1440),
+}
+THRESHOLD = 100
+
+
+def screen_pair (width, height, det_type=2):
+    ''' two consecutive synthetic tester screens of UI type %det_type, the popup appears on the second '''
+    popup = Popup(2.0, 4.0)
+    screen = TesterScreen(det_type, width, height, popups=[popup])
+    return screen.render(popup.start - 1.0 / screen.fps), screen.render(popup.start)
+
+
+def make_stages (prev, frame):
+    ''' dict of stage name to callable, each running one pipeline step with preallocated buffers '''
+    _prev_gray = cv2.cvtColor(prev, cv2.COLOR_BGR2GRAY)
+    _gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    _diff = cv2.absdiff(_gray, _prev_gray)
+    _, _mask = cv2.threshold(_diff, THRESHOLD, 255, cv2.THRESH_BINARY)
+    _hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    _hsv_mask = np.empty(_gray.shape, np.uint8)
+    _edges = md.GetEdgesfromImage(_gray)
+    _template = md.GetEdgesfromImage(cv2.imread(md.templatePath, 0))
+    _templates = [cv2.resize(_template, (0, 0), fx=s, fy=s) for s in SCALES]
+    _buf = {'gray': np.empty_like(_gray), 'diff': np.empty_like(_gray), 'mask': np.empty_like(_gray)}
+
+    def contours():
+        cnts, _ = cv2.findContours(_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return max((cv2.contourArea(c) for c in cnts), default=0)
+
+    def in_range():
+        for lower, upper in (BLUE_FIRST, BLUE_SECOND):
+            cv2.inRange(_hsv, lower, upper, dst=_hsv_mask)
+
+    def match_template():
+        for t in _templates:
+            cv2.matchTemplate(_edges, t, md.method)
+
+    return {
+        'cvtColor-gray': lambda: cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=_buf['gray']),
+        'absdiff': lambda: cv2.absdiff(_gray, _prev_gray, dst=_buf['diff']),
+        'threshold': lambda: cv2.threshold(_diff, THRESHOLD, 255, cv2.THRESH_BINARY, dst=_buf['mask']),
+        'countNonZero': lambda: cv2.countNonZero(_mask),
+        'findContours-contourArea': contours,
+        'cvtColor-hsv': lambda: cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=_hsv),
+        'inRange-hsv': in_range,
+        'edges': lambda: md.GetEdgesfromImage(_gray),
+        'matchTemplate-multiscale': match_template,
+    }
+
+
+def time_stage (func, repeat, warmup=3, budget=None):
+    ''' per call times of %func in ms, at most %budget seconds after the first %repeat calls '''
+    for _ in range(warmup):
+        func()
+    times = []
+    _start = time.perf_counter()
+    while len(times) < repeat:
+        _t = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - _t) * 1000.0)
+        if budget is not None and len(times) >= 5 and time.perf_counter() - _start > budget:
+            break
+    _t = np.asarray(times)
+    return {
+        'runs': len(times),
+        'min-ms': round(float(_t.min()), 4),
+        'median-ms': round(float(np.median(_t)), 4),
+        'p90-ms': round(float(np.percentile(_t, 90)), 4),
+        'mean-ms': round(float(_t.mean()), 4),
+    }
+
+
+def environment ():
+    ''' commit, OpenCV build and host the results were taken on '''
+    try:
+        _commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=str(scriptPath),
+            capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        _commit = None
+    return {
+        'commit': _commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': socket.gethostname(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'cv-threads': cv2.getNumThreads(),
+        'cv-optimized': cv2.useOptimized(),
+    }
+
+
+def compare (report, baseline, factor):
+    ''' stages slower than %factor times the baseline median '''
+    slower = []
+    for res, stages in report['results'].items():
+        for name, stat in stages.items():
+            _base = baseline.get('results', {}).get(res, {}).get(name, None)
+            if _base is None or _base['median-ms'] <= 0:
+                continue
+            _ratio = stat['median-ms'] / _base['median-ms']
+            if _ratio > factor:
+                slower.append({'resolution': res, 'stage': name, 'ratio': round(_ratio, 3),
+                    'median-ms': stat['median-ms'], 'baseline-ms': _base['median-ms']})
+    return slower
+
+
+if __name__ == "__main__":
+    parser = au.init_parser('Algo Benchmark')
+    au.add_arg(parser, '--resolutions', t=str, n='+', h='resolutions to benchmark {D}', d=list(RESOLUTIONS), m='RES')
+    au.add_arg(parser, '--det-type', t=int, h='UI type of the synthetic screens (index of DET_TYPE) {D}', d=2, m='TYPE')
+    au.add_arg(parser, '--stages', t=str, n='+', h='only benchmark these stages {D}', d=None, m='STAGE')
+    au.add_arg(parser, '--repeat', t=int, h='timed runs per stage {D}', d=50, m='N')
+    au.add_arg(parser, '--budget', t=float, h='maximum seconds per stage and resolution {D}', d=5.0, m='SEC')
+    au.add_arg(parser, '--threads', t=int, h='OpenCV threads, -1 for the OpenCV default {D}', d=-1, m='N')
+    au.add_arg(parser, '--baseline', t=str, h='previous report to compare against {D}', d=None, m='FILE')
+    au.add_arg(parser, '--regression', t=float, h='median slowdown factor reported as regression {D}', d=1.2, m='FACTOR')
+    au.add_arg(parser, '--output', t=str, h='write JSON report to file instead of stdout {D}', d=None, m='FILE')
+    args = au.parse_args(parser)
+
+    if args.threads >= 0:
+        cv2.setNumThreads(args.threads)
+    report = {'environment': environment(), 'threshold': THRESHOLD, 'det-type': args.det_type, 'results': {}}
+    for res in args.resolutions:
+        if res not in RESOLUTIONS:
+            logging.error('Unknown resolution {}, choose from {}'.format(res, list(RESOLUTIONS)))
+            continue
+        stages = make_stages(*screen_pair(*RESOLUTIONS[res], args.det_type))
+        report['results'][res] = {}
+        for name, func in stages.items():
+            if args.stages and name not in args.stages:
+                continue
+            stat = time_stage(func, args.repeat, budget=args.budget)
+            report['results'][res][name] = stat
+            logging.info('{} {}: median {} ms, p90 {} ms'.format(res, name, stat['median-ms'], stat['p90-ms']))
+
+    if args.baseline:
+        with open(args.baseline, 'rt') as f:
+            report['regressions'] = compare(report, json.load(f), args.regression)
+        for r in report['regressions']:
+            logging.warning('{} {}: {}x slower than baseline ({} ms vs {} ms)'.format(
+                r['resolution'], r['stage'], r['ratio'], r['median-ms'], r['baseline-ms']))
+
+    if args.output:
+        with open(args.output, 'wt') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Build the popup signature index of a tester type from screenshots
+
+The popups in saved frames (e.g. the frame_N_popup_detected.jpg screenshots
+of popup_detection) are found by a full-frame blue rectangle search and
+added to the signature index of the DET_TYPE, which the detection uses with
+--popup-index to recognise known dialogs at once. Labels default to
+'popup-N' and can be renamed in the index file. Popups added with --label
+after the first get a numbered suffix (NAME-2, NAME-3 ...), entries are
+keyed by label and are never replaced by another popup.
+'''
+import os
+import sys
+import logging
+import pathlib
+import cv2
+
+scriptPath = pathlib.Path(__file__).parent.resolve()
+sys.path.append(str(scriptPath))
+sys.path.append(str(scriptPath / 'common'))
+import argsutils as au
+from popup_detector import PopupDetector
+from popup_index import PopupIndex, index_file, DEFAULT_DIR
+
+IMAGE_EXT = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def image_files (paths):
+    ''' image files of %paths, directories are listed in name order '''
+    for p in paths:
+        if os.path.isdir(p):
+            for name in sorted(os.listdir(p)):
+                if name.lower().endswith(IMAGE_EXT):
+                    yield os.path.join(p, name)
+        else:
+            yield p
+
+
+def unused_label (index, label):
+    ''' %label, or %label-N with the lowest N from 2 not in %index, None stays None '''
+    if label is None or label not in index.entries:
+        return label
+    n = 2
+    while '{}-{}'.format(label, n) in index.entries:
+        n += 1
+    return '{}-{}'.format(label, n)
+
+
+if __name__ == "__main__":
+    parser = au.init_parser('Algo Popup Index')
+    au.add_arg(parser, 'images', n='*', h='popup screenshots or directories of them')
+    au.add_arg(parser, '--det-type', t=int, h='tester UI type (index of DET_TYPE) {D}', d=2, m='TYPE')
+    au.add_arg(parser, '--index-dir', t=str, h='directory of the per tester type index files {D}', d=DEFAULT_DIR, m='DIR')
+    au.add_arg(parser, '--label', t=str, h='label of the new popups, numbered NAME-2, NAME-3 ... after the first {D}', d=None, m='NAME')
+    au.add_arg(parser, '--capacity', t=int, h='maximum number of popups kept in the index {D}', d=64, m='N')
+    args = au.parse_args(parser)
+
+    index = PopupIndex(index_file(args.det_type, args.index_dir), capacity=args.capacity)
+    detector = PopupDetector()
+    for path in image_files(args.images):
+        frame = cv2.imread(path, cv2.IMREAD_COLOR)
+        if frame is None:
+            logging.error('Cannot read image {}'.format(path))
+            continue
+        for rect in detector.find(frame):
+            entry = index.lookup(frame, rect)
+            if entry is None:
+                entry = index.add(frame, rect, unused_label(index, args.label))
+                logging.info('{}: new popup {} at {}'.format(path, entry['label'], rect))
+            else:
+                logging.info('{}: known popup {} at {}'.format(path, entry['label'], rect))
+    index.save()
+
+    for entry in index.entries.values():
+        print('{label}: box {box}, {hits} hits'.format(**entry))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Replay recorded tester videos through the detection flat-out
+
+Every frame of each recording is read synchronously and analysed as fast as
+possible. The state machine is clocked by the video timestamps, so popUp,
+alert-reset and alert events come out at the same video times as in a live
+run. Published messages are recorded instead of being sent to redis and the
+event timeline is reported together with the achieved frame rate.
+'''
+import sys
+import json
+import time
+import logging
+import pathlib
+
+scriptPath = pathlib.Path(__file__).parent.resolve()
+sys.path.append(str(scriptPath))
+sys.path.append(str(scriptPath / 'common'))
+import argsutils as au
+from final_algo import TesterDetection
+
+
+class ReplayRecorder(object):
+    ''' stands in for the redis connection, records published messages with the video time '''
+    def __init__ (self):
+        self.events = []
+        self.clock = lambda: None
+
+    def publish (self, channel, msg):
+        _msg = json.loads(msg)
+        _time = self.clock()
+        self.events.append({
+            'time': round(_time, 3) if _time is not None else None,
+            'channel': channel,
+            'stage': _msg.get('stage', None),
+            'status': _msg.get('status', None),
+        })
+        if 'label' in _msg:
+            self.events[-1]['label'] = _msg['label']
+        logging.debug('{} {}: {}'.format(self.events[-1]['time'], channel, msg))
+        return 0
+
+
+def replay (source, args):
+    ''' replay single recording, return dict with event timeline and frame rate '''
+    rec = ReplayRecorder()
+    det = TesterDetection(source, rec, args.id,
+        detectionType=args.det_type, startSec=args.start_sec, scale=args.scale, tile=args.tile,
+        staticTol=args.static_tol if args.static_tol >= 0 else None, grayCapture=args.gray_capture,
+        realtime=False, stride=args.stride, timingSample=args.timing_sample, metricsPeriod=0,
+        cursorDetect=args.cursor, popupColor=args.popup_color, popupIndex=args.popup_index,
+        alertAck=args.ack if args.ack >= 0 else None)
+    rec.clock = lambda: det.frame_time
+
+    _start = time.perf_counter()
+    det.load_configuration()
+    if args.test_screen:
+        det.capture_test_screen()
+    det.start_mask_compare()
+    det.th.join()
+    _elapsed = time.perf_counter() - _start
+    det.close()
+
+    _info = det.get_info()
+    _duration = (det.frame_time or 0.0) - args.start_sec
+    return {
+        'source': str(source),
+        'frames': _info['frames'],
+        'static-frames': _info['static-frames'],
+        'video-seconds': round(_duration, 3),
+        'elapsed-seconds': round(_elapsed, 3),
+        'fps': round(_info['frames'] / _elapsed, 2) if _elapsed > 0 else 0.0,
+        'speedup': round(_duration / _elapsed, 2) if _elapsed > 0 else 0.0,
+        'events': rec.events,
+        'timing': _info['timing']['masking'],
+        'popup-index': _info['popup-index'],
+    }
+
+
+if __name__ == "__main__":
+    parser = au.init_parser('Algo Replay')
+    au.add_arg(parser, 'sources', n='+', h='recorded videos (or any frame source) to replay')
+    au.add_arg(parser, '--id', t=str, h='tester id used in the channel names {D}', d='replay', m='ID')
+    au.add_arg(parser, '--det-type', t=int, h='tester UI detection type (index of DET_TYPE) {D}', d=2, m='TYPE')
+    au.add_arg(parser, '--start-sec', t=float, h='start position in seconds {D}', d=0.0, m='SEC')
+    au.add_arg(parser, '--scale', t=float, h='analysis scale, e.g. 0.5 or 0.25 {D}', d=1.0, m='SCALE')
+    au.add_arg(parser, '--tile', t=int, h='tile size for coarse-to-fine change detection, 0 to disable {D}', d=0, m='PX')
+    au.add_arg(parser, '--static-tol', t=float, h='fingerprint tolerance of the static-frame fast path, negative to disable {D}', d=0.5, m='LEVEL')
+    au.add_arg(parser, '--gray-capture', a=True, h='analyse luminance only frames')
+    au.add_arg(parser, '--stride', t=int, h='analyse every N-th frame only, for screening long recordings {D}', d=1, m='N')
+    au.add_arg(parser, '--timing-sample', t=int, h='time the pipeline stages of every N-th frame, 0 to disable {D}', d=10, m='N')
+    au.add_arg(parser, '--cursor', a=True, h='confirm user interaction by finding the moving mouse cursor in the changed region')
+    au.add_arg(parser, '--popup-color', a=True, h='confirm a popup by a blue rectangle in the changed regions')
+    au.add_arg(parser, '--popup-index', t=str, h='directory of the per tester type popup signature index {D}', d=None, m='DIR')
+    au.add_arg(parser, '--ack', t=float, h='seconds until an alert is acknowledged and reset, negative: never {D}', d=-1.0, m='SEC')
+    au.add_arg(parser, '--no-test-screen', dest='test_screen', a=False, h='start masking stage at once instead of waiting for the test screen')
+    au.add_arg(parser, '--output', t=str, h='write JSON report to file instead of stdout {D}', d=None, m='FILE')
+    args = au.parse_args(parser)
+
+    # the detection prints its state changes, keep stdout for the JSON report
+    _stdout = sys.stdout
+    if not args.output:
+        sys.stdout = sys.stderr
+
+    report = []
+    for src in args.sources:
+        res = replay(src, args)
+        logging.info('{}: {} frames in {}s ({} fps, {}x real time), {} events'.format(
+            src, res['frames'], res['elapsed-seconds'], res['fps'], res['speedup'], len(res['events'])))
+        report.append(res)
+
+    if args.output:
+        with open(args.output, 'wt') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2), file=_stdout)
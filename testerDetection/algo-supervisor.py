@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Supervisor for multi-camera tester detection
+
+Starts one algo wrapper process per tester camera so that OpenCV work of
+each camera runs outside the GIL of the others. Each worker is pinned to a
+CPU core and limited to its own OpenCV thread count. Crashed workers, and
+workers whose detection stopped (end of stream, failed capture), are
+restarted and the analysed frame rate of each worker is published on
+tester.<id>.status. A restarted worker reruns the init / beginCapture /
+testScreen handshake stages its camera had reached, the backend does not
+send them again.
+
+With --batch all cameras run in a single worker process instead, their frame
+differences are computed together in one pass (see BatchDetection), which
+suits low-power hosts with several identical-resolution cameras.
+'''
+import os
+import sys
+import ast
+import argparse
+import logging
+import pathlib
+import threading
+import importlib
+import datetime as dt
+import multiprocessing as mp
+
+scriptPath = pathlib.Path(__file__).parent.resolve()
+sys.path.append(str(scriptPath))
+sys.path.append(str(scriptPath / 'common'))
+import argsutils as au
+from jsonutils import json2str
+
+
+def run_worker (args, core, frameCounter, handshake):
+    ''' worker process: pin to CPU core, limit OpenCV threads and run algo wrapper
+        handshake: shared number of handshake stages the camera reached
+    '''
+    if core is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {core})
+    wrapper = importlib.import_module('algo-wrapper')
+    import cv2
+    cv2.setNumThreads(args.cv_threads)
+    logging.debug('Worker vid{} started on core {} with {} OpenCV threads'.format(args.id, core, args.cv_threads))
+
+    alw = wrapper.AlgoWrapper(args=args, frameCounter=frameCounter, handshake=handshake)
+    alw.start()
+    _code = 0
+    try:
+        while not alw.is_quit(1):
+            if alw.detection_ended():
+                # end of stream or dead masking thread: exit so that the supervisor restarts the worker
+                logging.error('Detection of vid{} stopped, worker exits'.format(args.id))
+                _code = 1
+                break
+    finally:
+        alw.algo_close()
+        alw.close()
+    sys.exit(_code)
+
+
+def run_batch_worker (args_list, core, frameCounters, handshakes):
+    ''' worker process running the algo wrappers of all cameras on one shared BatchDetection '''
+    if core is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {core})
+    wrapper = importlib.import_module('algo-wrapper')
+    from final_algo import BatchDetection
+    import cv2
+    cv2.setNumThreads(args_list[0].cv_threads)
+    logging.debug('Batch worker for {} cameras started on core {}'.format(len(args_list), core))
+
+    batch = BatchDetection(len(args_list), timingSample=args_list[0].timing_sample)
+    wrappers = [wrapper.AlgoWrapper(args=a, frameCounter=c, handshake=h, batch=batch)
+        for a, c, h in zip(args_list, frameCounters, handshakes)]
+    for alw in wrappers:
+        alw.start()
+    _code = 0
+    try:
+        while not wrappers[0].is_quit(1):
+            if any(alw.detection_ended() for alw in wrappers):
+                logging.error('Detection of a batch camera stopped, batch worker exits')
+                _code = 1
+                break
+    finally:
+        for alw in wrappers:
+            alw.algo_close()
+            alw.close()
+        batch.close()
+    sys.exit(_code)
+
+
+class AlgoSupervisor(object):
+    def __init__ (self, args, cameras) -> None:
+        ''' init supervisor
+            cameras: list of dict with keys 'id', 'source' and optional 'type'
+        '''
+        self.args = args
+        self.cameras = cameras
+        self.redis_conn = au.connect_redis_with_args(args)
+        self.workers = {}
+        self.th_quit = threading.Event()
+
+        _cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+        self.cores = _cores[args.core_offset:] or _cores
+        logging.debug('Supervisor init with {} cameras on cores {}'.format(len(cameras), self.cores))
+
+    def _worker_args (self, cam):
+        ''' build argument namespace for single worker '''
+        _args = vars(self.args).copy()
+        _args.update({
+            'id': cam['id'],
+            'source': cam['source'],
+            'det_type': cam.get('type', self.args.det_type),
+        })
+        return argparse.Namespace(**_args)
+
+    def _spawn (self, idx, cam, restarts=0):
+        ''' start worker process of a camera '''
+        _w = self.workers.get(cam['id'], None)
+        _counter = _w['counter'] if _w else mp.Value('Q', 0, lock=False)
+        _handshake = _w['handshake'] if _w else mp.Value('i', 0, lock=False)
+        _core = self.cores[idx % len(self.cores)] if self.args.pin else None
+        _proc = mp.Process(
+            target=run_worker,
+            args=(self._worker_args(cam), _core, _counter, _handshake),
+            name='vid{}'.format(cam['id']),
+            daemon=True,
+        )
+        _proc.start()
+        self.workers[cam['id']] = {
+            'idx': idx,
+            'camera': cam,
+            'process': _proc,
+            'core': _core,
+            'counter': _counter,
+            'handshake': _handshake,
+            'restarts': restarts,
+            'started': dt.datetime.now(),
+            'last_frames': _counter.value,
+            'last_time': dt.datetime.now(),
+            'fps': 0.0,
+        }
+        logging.info('Worker vid{} ({}) started with pid {} on core {}'.format(cam['id'], cam['source'], _proc.pid, _core))
+
+    def _spawn_batch (self, restarts=0):
+        ''' start single worker process analysing all cameras in batch '''
+        _counters = [self.workers[c['id']]['counter'] if c['id'] in self.workers else mp.Value('Q', 0, lock=False)
+            for c in self.cameras]
+        _handshakes = [self.workers[c['id']]['handshake'] if c['id'] in self.workers else mp.Value('i', 0, lock=False)
+            for c in self.cameras]
+        _core = self.cores[0] if self.args.pin else None
+        _proc = mp.Process(
+            target=run_batch_worker,
+            args=([self._worker_args(c) for c in self.cameras], _core, _counters, _handshakes),
+            name='vid-batch',
+            daemon=True,
+        )
+        _proc.start()
+        for idx, (cam, _counter, _handshake) in enumerate(zip(self.cameras, _counters, _handshakes)):
+            self.workers[cam['id']] = {
+                'idx': idx,
+                'camera': cam,
+                'process': _proc,
+                'core': _core,
+                'counter': _counter,
+                'handshake': _handshake,
+                'restarts': restarts,
+                'started': dt.datetime.now(),
+                'last_frames': _counter.value,
+                'last_time': dt.datetime.now(),
+                'fps': 0.0,
+            }
+        logging.info('Batch worker for {} cameras started with pid {} on core {}'.format(len(self.cameras), _proc.pid, _core))
+
+    def start (self):
+        ''' start all workers and the monitor thread '''
+        if self.args.batch:
+            self._spawn_batch()
+        else:
+            for idx, cam in enumerate(self.cameras):
+                self._spawn(idx, cam)
+        self.th = threading.Thread(target=self.monitor)
+        self.th.start()
+
+    def _check_worker (self, w):
+        ''' restart crashed worker '''
+        _proc = w['process']
+        if _proc.is_alive():
+            return
+        _uptime = (dt.datetime.now() - w['started']).total_seconds()
+        if _uptime < self.args.restart_delay:
+            # avoid busy restarting a worker that crashes at start up
+            return
+        logging.error('Worker vid{} exited with code {}, restarting ...'.format(w['camera']['id'], _proc.exitcode))
+        if self.args.batch:
+            self._spawn_batch(restarts=w['restarts'] + 1)
+        else:
+            self._spawn(w['idx'], w['camera'], restarts=w['restarts'] + 1)
+
+    def _publish_status (self, w):
+        ''' compute worker frame rate and publish it on tester.<id>.status '''
+        _now = dt.datetime.now()
+        _frames = w['counter'].value
+        _elapsed = (_now - w['last_time']).total_seconds()
+        if _elapsed > 0:
+            w['fps'] = (_frames - w['last_frames']) / _elapsed
+        w['last_frames'], w['last_time'] = _frames, _now
+        self.redis_conn.publish(
+            'tester.vid{}.status'.format(w['camera']['id']),
+            json2str({
+                'stage': 'status',
+                'status': 'running' if w['process'].is_alive() else 'restarting',
+                'fps': round(w['fps'], 2),
+                'frames': int(_frames),
+                'pid': w['process'].pid,
+                'core': w['core'],
+                'restarts': w['restarts'],
+                'timestamp': _now,
+            })
+        )
+
+    def monitor (self):
+        ''' monitor thread: restart crashed workers and publish status periodically '''
+        while not self.th_quit.wait(self.args.status_period):
+            for _id in list(self.workers):
+                # re-read the entry: a batch restart replaces the entries of all cameras at once
+                self._check_worker(self.workers[_id])
+                w = self.workers[_id]
+                try:
+                    self._publish_status(w)
+                except Exception:
+                    logging.error('Failed to publish status of vid{}'.format(w['camera']['id']))
+        logging.debug('Supervisor monitor stopped')
+
+    def close (self):
+        ''' stop monitor and all workers '''
+        self.th_quit.set()
+        for w in self.workers.values():
+            if w['process'].is_alive():
+                w['process'].terminate()
+        for w in self.workers.values():
+            w['process'].join(5)
+        self.redis_conn.close()
+
+
+def load_cameras (args):
+    ''' load camera list from --cameras (ID=SOURCE[:TYPE]) or config file (list of dict literal) '''
+    cameras = []
+    if args.camera_config:
+        with open(args.camera_config, 'rt') as f:
+            cameras = ast.literal_eval(f.read())
+    for c in args.cameras or []:
+        _id, _src = c.split('=', 1)
+        _cam = {'id': _id, 'source': _src}
+        if ':' in _src and _src.rsplit(':', 1)[1].isdigit():
+            _cam['source'], _cam['type'] = _src.rsplit(':', 1)[0], int(_src.rsplit(':', 1)[1])
+        cameras.append(_cam)
+    return cameras
+
+
+if __name__ == "__main__":
+    from adaptor import add_common_adaptor_args
+    parser = au.init_parser('Algo Supervisor')
+    add_common_adaptor_args(
+        parser,
+        id=1,
+        status_period=10,
+    )
+    au.add_arg(parser, '--cameras', n='*', h='cameras to supervise as ID=SOURCE[:TYPE], e.g. 1=/dev/video0:2', m='CAM')
+    au.add_arg(parser, '--camera-config', t=str, h='file with list of camera dicts {D}', d=None, m='FILE')
+    au.add_arg(parser, '--det-type', t=int, h='default tester UI detection type (index of DET_TYPE) {D}', d=2, m='TYPE')
+    au.add_arg(parser, '--scale', t=float, h='analysis scale of all workers, e.g. 0.5 or 0.25 {D}', d=1.0, m='SCALE')
+    au.add_arg(parser, '--tile', t=int, h='tile size for coarse-to-fine change detection, 0 to disable {D}', d=0, m='PX')
+    au.add_arg(parser, '--static-tol', t=float, h='fingerprint tolerance of the static-frame fast path, negative to disable {D}', d=0.5, m='LEVEL')
+    au.add_arg(parser, '--gray-capture', a=True, h='capture luminance only (YUYV Y plane or reduced grayscale MJPEG decode)')
+    au.add_arg(parser, '--timing-sample', t=int, h='time the pipeline stages of every N-th frame, 0 to disable {D}', d=10, m='N')
+    au.add_arg(parser, '--metrics-period', t=float, h='seconds between stage timing summaries on tester.<id>.metrics, 0 to disable {D}', d=10.0, m='SEC')
+    au.add_arg(parser, '--cursor', a=True, h='confirm user interaction by finding the moving mouse cursor in the changed region')
+    au.add_arg(parser, '--popup-color', a=True, h='confirm a popup by a blue rectangle in the changed regions')
+    au.add_arg(parser, '--popup-index', t=str, h='directory of the per tester type popup signature index {D}', d=None, m='DIR')
+    au.add_arg(parser, '--cv-threads', t=int, h='OpenCV threads per worker {D}', d=1, m='N')
+    au.add_arg(parser, '--core-offset', t=int, h='first CPU core used for workers {D}', d=0, m='N')
+    au.add_arg(parser, '--no-pin', dest='pin', a=False, h='do not pin workers to CPU cores')
+    au.add_arg(parser, '--batch', a=True, h='analyse all cameras in one process with a batched frame diff (identical resolutions only)')
+    au.add_arg(parser, '--restart-delay', t=int, h='minimum seconds between restarts of a worker {D}', d=5, m='SEC')
+    args = au.parse_args(parser)
+
+    cameras = load_cameras(args)
+    if not cameras:
+        logging.error('No camera configured, use --cameras or --camera-config')
+        sys.exit(1)
+
+    sup = AlgoSupervisor(args, cameras)
+    sup.start()
+
+    try:
+        while not sup.th_quit.wait(1):
+            pass
+    except KeyboardInterrupt:
+        logging.info('Ctrl-C received -- terminating ...')
+        sup.close()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Parameter sweep for the detection thresholds
+
+Each recording is decoded once. Per frame the histogram of the absdiff to the
+previous frame gives the changed pixel count of every candidate threshold by
+a cumulative sum, and the largest changed region is measured for the
+candidate thresholds where it can matter. All combinations of
+(threshold, significant/minor/mouse fraction, frame_threshold) are then run
+through the popup / alert state machine of TesterDetection in one vectorised
+pass and ranked against labelled alert times.
+'''
+import os
+import sys
+import json
+import time
+import logging
+import pathlib
+import itertools
+import numpy as np
+import cv2
+
+scriptPath = pathlib.Path(__file__).parent.resolve()
+sys.path.append(str(scriptPath))
+sys.path.append(str(scriptPath / 'common'))
+import argsutils as au
+from final_algo import DET_TYPE
+from frame_diff import FrameDiff
+from frame_source import open_source
+from frame_cache import FrameCache
+
+IDLE, PRE_ALERT, ALERT, RESET = 0, 1, 2, 3
+
+
+def extract_features (source, thresholds, min_area, min_fraction, det_type=2, scale=1.0, start_sec=0.0, cache=None):
+    ''' decode %source once and return per frame timestamps, changed pixel counts and largest region areas
+        thresholds: candidate thresholds, counts are taken as pixels with absdiff > threshold
+        min_area / min_fraction: region areas are only measured where the count of a
+                threshold exceeds both, below that no frame can count as significant
+        cache: FrameCache, frames are decoded and downscaled only on the first run
+    '''
+    _min_area = min_area * scale * scale
+    if cache is not None:
+        _src, scale = cache.open(source, scale), 1.0
+    else:
+        _src = open_source(source, gray=True)
+    if start_sec:
+        _src.set(cv2.CAP_PROP_POS_MSEC, start_sec * 1000)
+    engine = FrameDiff(0, roi=DET_TYPE[det_type].get('roi', None),
+        exclude=DET_TYPE[det_type].get('exclude', []), scale=scale)
+    _thr = np.asarray(thresholds, np.int32)
+
+    ret, frame = _src.read()
+    if not ret:
+        return None
+    engine.reset(frame)
+    _labels = None
+    times, counts, blobs = [], [], []
+    while True:
+        ret, frame = _src.read(frame)
+        if not ret:
+            break
+        engine.update(frame)
+        _hist = cv2.calcHist([engine.diff], [0], None, [256], [0, 256]).ravel()
+        # pixels with diff > t for every t: reversed cumulative sum of the histogram
+        _above = np.concatenate((np.cumsum(_hist[::-1])[::-1][1:], [0]))
+        _counts = _above[_thr].astype(np.int32)
+        _blobs = np.zeros(len(_thr), np.int32)
+        for i in np.nonzero((_counts > _min_area) & (_counts > min_fraction * engine.area))[0]:
+            _mask = cv2.compare(engine.diff, int(_thr[i]), cv2.CMP_GT)
+            _, _labels, stats, _ = cv2.connectedComponentsWithStats(_mask, labels=_labels, connectivity=8)
+            _blobs[i] = stats[1:, cv2.CC_STAT_AREA].max() if len(stats) > 1 else 0
+        times.append(_src.timestamp)
+        counts.append(_counts)
+        blobs.append(_blobs)
+    _src.release()
+    return {
+        'source': str(source),
+        'area': engine.area,
+        'min_area': _min_area,
+        'times': np.asarray(times, np.float64),
+        'counts': np.asarray(counts, np.int32).reshape(-1, len(_thr)),
+        'blobs': np.asarray(blobs, np.int32).reshape(-1, len(_thr)),
+    }
+
+
+def build_grid (args):
+    ''' all parameter combinations as dict of equally long arrays '''
+    _combos = list(itertools.product(range(len(args.thresholds)), args.significant, args.minor, args.mouse, args.frame_thresholds))
+    _grid = np.asarray(_combos, np.float64).reshape(-1, 5)
+    return {
+        'threshold_idx': _grid[:, 0].astype(np.int32),
+        'significant': _grid[:, 1],
+        'minor': _grid[:, 2],
+        'mouse': _grid[:, 3],
+        'frame_threshold': _grid[:, 4],
+    }
+
+
+def simulate (feat, grid, ack=0.0):
+    ''' run the TesterDetection state machine for all combinations at once
+        ack: seconds until an activated alert is acknowledged (alert-response reset)
+        return list of alert times and number of popUp events per combination
+    '''
+    _n = len(grid['threshold_idx'])
+    _ti = grid['threshold_idx']
+    _sig = grid['significant'] * feat['area']
+    _minor = grid['minor'] * feat['area']
+    _mouse = grid['mouse'] * feat['area']
+    _fthr = grid['frame_threshold']
+
+    stage = np.full(_n, IDLE, np.int8)
+    popup = np.zeros(_n, bool)
+    alert_time = np.zeros(_n)
+    fired_time = np.zeros(_n)
+    popups = np.zeros(_n, np.int32)
+    alerts = [[] for _ in range(_n)]
+
+    for now, counts, blobs in zip(feat['times'], feat['counts'], feat['blobs']):
+        nz = counts[_ti]
+        _reset = stage == RESET
+        popup[_reset] = False
+        stage[_reset] = IDLE
+
+        popup |= (nz > _sig) & (blobs[_ti] > feat['min_area'])
+        _idle = popup & (stage == IDLE)
+        _pre = popup & (stage == PRE_ALERT)
+        _inter = _pre & (nz > _minor) & (nz < _mouse)
+        _alert = _pre & ~_inter & (now - alert_time > _fthr)
+
+        popups += _idle
+        alert_time[_idle] = now
+        stage[_idle] = PRE_ALERT
+        stage[_inter] = RESET
+        stage[_alert] = ALERT
+        fired_time[_alert] = now
+        for c in np.nonzero(_alert)[0]:
+            alerts[c].append(now)
+        stage[(stage == ALERT) & ~_alert & (now - fired_time >= ack)] = RESET
+    return alerts, popups
+
+
+def match_alerts (predicted, labelled, tolerance):
+    ''' greedy match of predicted to labelled alert times, return (matched, sum of abs time error) '''
+    _used, _tp, _err = set(), 0, 0.0
+    for t in labelled:
+        _best = None
+        for i, p in enumerate(predicted):
+            if i not in _used and abs(p - t) <= tolerance and (_best is None or abs(p - t) < abs(predicted[_best] - t)):
+                _best = i
+        if _best is not None:
+            _used.add(_best)
+            _tp += 1
+            _err += abs(predicted[_best] - t)
+    return _tp, _err
+
+
+def load_labels (path):
+    ''' labelled alert times: JSON dict of recording file name to list of seconds '''
+    with open(path, 'rt') as f:
+        _labels = json.load(f)
+    return {os.path.basename(k): sorted(v) for k, v in _labels.items()}
+
+
+if __name__ == "__main__":
+    parser = au.init_parser('Algo Parameter Sweep')
+    au.add_arg(parser, 'sources', n='+', h='recorded videos (or any frame source) to evaluate')
+    au.add_arg(parser, '--labels', t=str, h='JSON file mapping recording file name to labelled alert times (s)', r=True, m='FILE')
+    au.add_arg(parser, '--det-type', t=int, h='tester UI detection type for roi / exclude regions {D}', d=2, m='TYPE')
+    au.add_arg(parser, '--scale', t=float, h='analysis scale {D}', d=1.0, m='SCALE')
+    au.add_arg(parser, '--start-sec', t=float, h='start position in seconds {D}', d=0.0, m='SEC')
+    au.add_arg(parser, '--thresholds', t=int, n='+', h='candidate pixel thresholds {D}', d=[50, 75, 100, 125, 150, 175, 200], m='T')
+    au.add_arg(parser, '--significant', t=float, n='+', h='candidate significant change fractions {D}', d=[0.0005, 0.001, 0.002, 0.005], m='F')
+    au.add_arg(parser, '--minor', t=float, n='+', h='candidate minor change fractions {D}', d=[0.00005, 0.0001, 0.0002], m='F')
+    au.add_arg(parser, '--mouse', t=float, n='+', h='candidate mouse change fractions {D}', d=[0.0005, 0.0009, 0.002], m='F')
+    au.add_arg(parser, '--frame-thresholds', t=float, n='+', h='candidate alert delays in seconds {D}', d=[10, 20, 30, 45, 60], m='SEC')
+    au.add_arg(parser, '--min-area', t=int, h='minimum changed region area of a significant change (native pixels) {D}', d=1000, m='PX')
+    au.add_arg(parser, '--ack', t=float, h='seconds until an alert is acknowledged and reset {D}', d=0.0, m='SEC')
+    au.add_arg(parser, '--tolerance', t=float, h='maximum difference between predicted and labelled alert time {D}', d=5.0, m='SEC')
+    au.add_arg(parser, '--top', t=int, h='number of ranked combinations to report {D}', d=20, m='N')
+    au.add_arg(parser, '--output', t=str, h='write JSON ranking to file {D}', d=None, m='FILE')
+    au.add_arg(parser, '--cache-dir', t=str, h='decoded frame cache directory, decode every run if not given {D}', d=None, m='DIR')
+    au.add_arg(parser, '--cache-size', t=float, h='size cap of the frame cache in GB {D}', d=50.0, m='GB')
+    args = au.parse_args(parser)
+
+    labels = load_labels(args.labels)
+    cache = FrameCache(args.cache_dir, max_bytes=int(args.cache_size * (1 << 30))) if args.cache_dir else None
+    grid = build_grid(args)
+    _n = len(grid['threshold_idx'])
+    tp, fp, fn, err = np.zeros(_n), np.zeros(_n), np.zeros(_n), np.zeros(_n)
+
+    for src in args.sources:
+        _start = time.perf_counter()
+        feat = extract_features(src, args.thresholds, args.min_area, min(args.significant),
+            det_type=args.det_type, scale=args.scale, start_sec=args.start_sec, cache=cache)
+        if feat is None:
+            logging.error('No frames read from {}'.format(src))
+            continue
+        _decoded = time.perf_counter()
+        alerts, _ = simulate(feat, grid, ack=args.ack)
+        _label = labels.get(os.path.basename(str(src)), [])
+        for c in range(_n):
+            _tp, _err = match_alerts(alerts[c], _label, args.tolerance)
+            tp[c] += _tp
+            fp[c] += len(alerts[c]) - _tp
+            fn[c] += len(_label) - _tp
+            err[c] += _err
+        logging.info('{}: {} frames decoded in {:.1f}s, {} combinations simulated in {:.1f}s'.format(
+            src, len(feat['times']), _decoded - _start, _n, time.perf_counter() - _decoded))
+
+    precision = np.divide(tp, tp + fp, out=np.zeros(_n), where=(tp + fp) > 0)
+    recall = np.divide(tp, tp + fn, out=np.zeros(_n), where=(tp + fn) > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(_n), where=(precision + recall) > 0)
+    mean_err = np.divide(err, tp, out=np.zeros(_n), where=tp > 0)
+    # best F1 first, then fewer false alerts, then smaller timing error
+    order = np.lexsort((mean_err, fp, -f1))
+
+    ranking = []
+    for c in order[:args.top]:
+        ranking.append({
+            'threshold': args.thresholds[grid['threshold_idx'][c]],
+            'significant': grid['significant'][c],
+            'minor': grid['minor'][c],
+            'mouse': grid['mouse'][c],
+            'frame_threshold': grid['frame_threshold'][c],
+            'f1': round(float(f1[c]), 4),
+            'precision': round(float(precision[c]), 4),
+            'recall': round(float(recall[c]), 4),
+            'false-alerts': int(fp[c]),
+            'missed-alerts': int(fn[c]),
+            'mean-time-error': round(float(mean_err[c]), 3),
+        })
+    if args.output:
+        with open(args.output, 'wt') as f:
+            json.dump(ranking, f, indent=2)
+    print(json.dumps(ranking, indent=2))
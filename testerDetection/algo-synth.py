@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Render synthetic tester recordings with ground-truth labels
+
+Writes videos of tester-like screens (see screen_synth) for the chosen
+DET_TYPE UI type with a random popup schedule, a scrolling log and cursor
+motion. The expected alert times are merged into a labels file in the format
+of algo-sweep, the full event timeline (popups with bounding box, mouse
+interactions, dismissals, alerts) is written next to each video.
+
+Without writing files the same screens are available to every script as
+frame source 'tester:T[:WxH]'.
+'''
+import os
+import sys
+import json
+import time
+import logging
+import pathlib
+
+scriptPath = pathlib.Path(__file__).parent.resolve()
+sys.path.append(str(scriptPath))
+sys.path.append(str(scriptPath / 'common'))
+import argsutils as au
+from final_algo import DET_TYPE
+from screen_synth import TesterScreen, random_popups
+
+
+if __name__ == "__main__":
+    parser = au.init_parser('Algo Synthetic Recordings')
+    au.add_arg(parser, 'outputs', n='+', h='video files to write (.avi: MJPG, .mp4: mp4v), one scenario each')
+    au.add_arg(parser, '--det-type', t=int, h='tester UI type (index of DET_TYPE) {D}', d=2, m='TYPE')
+    au.add_arg(parser, '--width', t=int, h='screen width {D}', d=1280, m='PX')
+    au.add_arg(parser, '--height', t=int, h='screen height {D}', d=720, m='PX')
+    au.add_arg(parser, '--fps', t=float, h='frame rate {D}', d=30.0, m='FPS')
+    au.add_arg(parser, '--duration', t=float, h='length of each recording in seconds {D}', d=300.0, m='SEC')
+    au.add_arg(parser, '--seed', t=int, h='random seed of the first recording, incremented per recording {D}', d=0, m='N')
+    au.add_arg(parser, '--mouse', t=float, h='fraction of popups dismissed with the mouse, the rest with the keyboard {D}', d=0.5, m='F')
+    au.add_arg(parser, '--min-len', t=float, h='shortest popup in seconds {D}', d=5.0, m='SEC')
+    au.add_arg(parser, '--max-len', t=float, h='longest popup in seconds {D}', d=60.0, m='SEC')
+    au.add_arg(parser, '--log-rate', t=float, h='log lines per second, 0 for a static log {D}', d=0.5, m='N')
+    au.add_arg(parser, '--wander', t=float, h='seconds between cursor moves while no popup is shown, 0 for a still cursor {D}', d=4.0, m='SEC')
+    au.add_arg(parser, '--labels', t=str, h='labels file (algo-sweep format) the expected alert times are merged into {D}', d=None, m='FILE')
+    args = au.parse_args(parser)
+
+    _fthr = DET_TYPE[args.det_type]['frame_threshold']
+    labels = {}
+    if args.labels and os.path.exists(args.labels):
+        with open(args.labels, 'rt') as f:
+            labels = json.load(f)
+
+    for i, out in enumerate(args.outputs):
+        _seed = args.seed + i
+        screen = TesterScreen(args.det_type, width=args.width, height=args.height, fps=args.fps,
+            popups=random_popups(args.duration, args.det_type, _seed, min_len=args.min_len, max_len=args.max_len, mouse=args.mouse),
+            log_rate=args.log_rate, wander=args.wander, seed=_seed)
+        _start = time.perf_counter()
+        frames = screen.write(out, args.duration)
+        events = screen.labels(args.duration, _fthr)
+        with open(os.path.splitext(out)[0] + '.events.json', 'wt') as f:
+            json.dump(events, f, indent=2)
+        labels[os.path.basename(out)] = screen.alert_times(args.duration, _fthr)
+        logging.info('{}: {} frames in {:.1f}s, {} popups, {} expected alerts'.format(out, frames,
+            time.perf_counter() - _start, sum(e['event'] == 'popup' for e in events), len(labels[os.path.basename(out)])))
+
+    if args.labels:
+        with open(args.labels, 'wt') as f:
+            json.dump(labels, f, indent=2)
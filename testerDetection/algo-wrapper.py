@@ -8,6 +8,7 @@ import sys
 import logging
 import pathlib
 import threading
+import multiprocessing as mp
 import serial
 
 from plugin_module import PluginModule
@@ -18,10 +19,30 @@ sys.path.append(str(scriptPath.parent / 'common'))
 import argsutils as au
 from jsonutils import json2str
 
+# backend handshake stages in order, a worker resumes after the last one reached
+HANDSHAKE = ('init', 'beginCapture', 'testScreen')
+
 class AlgoWrapper(PluginModule):
     def __init__ (self, args, **kw) -> None:
         ''' init module'''
         self.id = 'vid{}'.format(args.id)
+        self.source = getattr(args, 'source', '/dev/video0')
+        self.det_type = getattr(args, 'det_type', 2)
+        self.scale = getattr(args, 'scale', 1.0)
+        self.tile = getattr(args, 'tile', 0)
+        self.static_tol = getattr(args, 'static_tol', 0.5)
+        self.gray_capture = getattr(args, 'gray_capture', False)
+        self.timing_sample = getattr(args, 'timing_sample', 10)
+        self.metrics_period = getattr(args, 'metrics_period', 10.0)
+        self.cursor = getattr(args, 'cursor', False)
+        self.popup_color = getattr(args, 'popup_color', False)
+        self.popup_index = getattr(args, 'popup_index', None)
+        self.frame_counter = kw.get('frameCounter', None)
+        self.batch = kw.get('batch', None)
+        # number of handshake stages reached, shared with the supervisor so it survives worker restarts
+        self.handshake = kw.get('handshake', None)
+        if self.handshake is None:
+            self.handshake = mp.Value('i', 0, lock=False)
         self.algo = None
         self.subscribe_channels = [
             'tester.{}.response'.format(self.id),
@@ -49,17 +70,18 @@ class AlgoWrapper(PluginModule):
     
     def wrapper (self):
         ''' wrapper to start algo code in thread'''
-        while True:
-            if self.algo is None:
-
-                # self.algo = TesterDetection('/Users/juneyoungseo/Documents/Panasonic/test_videos/2023-12-29 08-08-11 SDU CT Tester.mp4', self.redis_conn, self.id)
-                self.algo = TesterDetection("/dev/video0", self.redis_conn, self.id)
-                #self.algo = TesterDetection(read_from_usb, self.redis_conn, self.id)))
-
-            if self.th_quit.is_set():
-
-                self.algo.close()
-                break
+        # self.algo = TesterDetection('/Users/juneyoungseo/Documents/Panasonic/test_videos/2023-12-29 08-08-11 SDU CT Tester.mp4', self.redis_conn, self.id)
+        self.algo = TesterDetection(self.source, self.redis_conn, self.id,
+            detectionType=self.det_type, frameCounter=self.frame_counter, scale=self.scale, tile=self.tile,
+            staticTol=self.static_tol if self.static_tol >= 0 else None, grayCapture=self.gray_capture,
+            timingSample=self.timing_sample, metricsPeriod=self.metrics_period, batch=self.batch,
+            cursorDetect=self.cursor, popupColor=self.popup_color, popupIndex=self.popup_index)
+        #self.algo = TesterDetection(read_from_usb, self.redis_conn, self.id)))
+        self._resume()
+
+        # block until close requested instead of spinning on the flag
+        self.th_quit.wait()
+        self.algo.close()
 
     # def start_algo(self):
     #     self.algo = TesterDetection('/Users/juneyoungseo/Documents/Panasonic/test_videos/2023-12-26 10-36-47-ex2 SDU CT Tester.mp4', self.redis_conn, self.id)
@@ -74,6 +96,30 @@ class AlgoWrapper(PluginModule):
             if ch == 'tester.{}.alert-response'.format(self.id):
                 self._process_alert_response_msg(msg)
     
+    def _resume (self):
+        ''' rerun the handshake stages a previous worker of this camera reached,
+            the backend does not send them again to a restarted worker
+        '''
+        _reached = self.handshake.value
+        if not _reached:
+            return
+        logging.info('{} resumes after the {} stage'.format(self.id, HANDSHAKE[_reached - 1]))
+        self.algo.load_configuration()
+        if _reached >= HANDSHAKE.index('testScreen') + 1:
+            # test screen was confirmed before the restart and is not shown any more
+            self.algo.start_mask_compare()
+        elif _reached >= HANDSHAKE.index('beginCapture') + 1:
+            self.algo.capture_test_screen()
+
+    def _reach (self, stage):
+        ''' record handshake %stage as reached, False if it was reached already (response to a resumed stage) '''
+        _n = HANDSHAKE.index(stage) + 1
+        if stage != 'init' and self.handshake.value >= _n:
+            logging.debug('{} already passed the {} stage'.format(self.id, stage))
+            return False
+        self.handshake.value = _n
+        return True
+
     def _process_response_msg (self, msg):
         ''' process normal response msg '''
         _stage = msg.get('stage', 'error')
@@ -97,6 +143,7 @@ class AlgoWrapper(PluginModule):
         _status = msg.get('status', 'failed')
 
         if _status == 'success':
+            self._reach('init')
             self.algo.load_configuration()
         else:
             logging.error("Initialization Process Failed...")
@@ -106,7 +153,8 @@ class AlgoWrapper(PluginModule):
         _status = msg.get('status', 'failed')
 
         if _status == 'success':
-            self.algo.capture_test_screen()
+            if self._reach('beginCapture'):
+                self.algo.capture_test_screen()
         else:
             logging.error("Capturing Process Failed...")
 
@@ -114,7 +162,8 @@ class AlgoWrapper(PluginModule):
         _status = msg.get('status', 'failed')
 
         if _status == 'success':
-            self.algo.start_mask_compare()
+            if self._reach('testScreen'):
+                self.algo.start_mask_compare()
         else:
             logging.error("Test Screen Process Failed...")
 
@@ -132,6 +181,17 @@ class AlgoWrapper(PluginModule):
         else:
             logging.error('Alert setting failed ...')
 
+    def get_info (self):
+        ''' return a dict containing description of this module and detection statistics '''
+        ret = PluginModule.get_info(self)
+        if self.algo is not None:
+            ret['detection'] = self.algo.get_info()
+        return ret
+
+    def detection_ended (self):
+        ''' True if the detection stopped by itself, the worker should exit to be restarted '''
+        return self.algo is not None and self.algo.ended()
+
     # def close_algo(self):
     #     self.algo.close()
     def algo_close (self):
@@ -148,6 +208,17 @@ if __name__ == "__main__":
         parser,
         id=1
     )
+    au.add_arg(parser, '--source', h='camera device or video file to analyse {D}', d='/dev/video0', m='SRC')
+    au.add_arg(parser, '--det-type', t=int, h='tester UI detection type (index of DET_TYPE) {D}', d=2, m='TYPE')
+    au.add_arg(parser, '--scale', t=float, h='analysis scale, e.g. 0.5 or 0.25 {D}', d=1.0, m='SCALE')
+    au.add_arg(parser, '--tile', t=int, h='tile size for coarse-to-fine change detection, 0 to disable {D}', d=0, m='PX')
+    au.add_arg(parser, '--static-tol', t=float, h='fingerprint tolerance of the static-frame fast path, negative to disable {D}', d=0.5, m='LEVEL')
+    au.add_arg(parser, '--gray-capture', a=True, h='capture luminance only (YUYV Y plane or reduced grayscale MJPEG decode)')
+    au.add_arg(parser, '--timing-sample', t=int, h='time the pipeline stages of every N-th frame, 0 to disable {D}', d=10, m='N')
+    au.add_arg(parser, '--metrics-period', t=float, h='seconds between stage timing summaries on tester.<id>.metrics, 0 to disable {D}', d=10.0, m='SEC')
+    au.add_arg(parser, '--cursor', a=True, h='confirm user interaction by finding the moving mouse cursor in the changed region')
+    au.add_arg(parser, '--popup-color', a=True, h='confirm a popup by a blue rectangle in the changed regions')
+    au.add_arg(parser, '--popup-index', t=str, h='directory of the per tester type popup signature index {D}', d=None, m='DIR')
     args = au.parse_args(parser)
 
     alw = AlgoWrapper(args=args)
@@ -0,0 +1,202 @@
+'''
+cursor_detector.py
+Multi-scale mouse cursor detection for the live detection loop.
+
+The edge template pyramid of mouse_detection (GetEdgesfromImage of the
+cursor template, resized to every scale) is built once at load time. Frame
+edges are only computed inside the changed-pixel region reported by the
+frame difference, grown by a margin, and the per-scale matchTemplate calls
+run on a thread pool (OpenCV releases the GIL), so a search costs a
+fraction of the full-frame search of mouse_detection.processVideo.
+
+CursorTracker keeps the lock between frames and searches a small window at
+the matched scale only, so the cursor position and velocity are available
+every frame at the cost of a single small matchTemplate.
+'''
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+import mouse_detection as md
+
+SCALES = [1, 0.95, 0.9, 0.85, 0.8, 0.75, 0.7, 0.65, 0.6, 0.55, 0.5]
+
+
+class CursorDetector(object):
+    ''' cursor search with a precomputed edge template pyramid
+
+        template: cursor template image file (or gray image)
+        scales: template scales searched
+        threshold: minimum normalised correlation of a match
+        frame_scale: analysis scale of the searched frames, the pyramid is scaled to match
+        workers: threads for the per-scale matches, 0 or 1 to match sequentially
+        margin: pixels added around the searched region
+    '''
+    def __init__(self, template=md.templatePath, scales=SCALES, threshold=md.threshold, frame_scale=1.0, workers=4, margin=8):
+        _tmpl = cv2.imread(template, cv2.IMREAD_GRAYSCALE) if isinstance(template, str) else template
+        if _tmpl is None:
+            raise FileNotFoundError('Cannot read cursor template {}'.format(template))
+        _edges = md.GetEdgesfromImage(_tmpl)
+        self.threshold = threshold
+        self.margin = margin
+        self.pyramid = []
+        self.outlines = {}
+        for s in scales:
+            _s = s * frame_scale
+            _t = cv2.resize(_edges, (0, 0), fx=_s, fy=_s, interpolation=cv2.INTER_AREA if _s < 1 else cv2.INTER_LINEAR)
+            if min(_t.shape) >= 3:
+                self.pyramid.append((s, _t))
+                self.outlines[s] = cv2.compare(_t, 127, cv2.CMP_GT)
+        self.max_size = (max(t.shape[0] for _, t in self.pyramid), max(t.shape[1] for _, t in self.pyramid)) \
+            if self.pyramid else (0, 0)
+        self.pool = ThreadPoolExecutor(workers) if workers > 1 else None
+        self.searches = 0
+
+    def _region(self, shape, bbox):
+        ''' searched (x0, y0, x1, y1): %bbox grown by the margin and to at least the largest template '''
+        H, W = shape[:2]
+        if bbox is None:
+            return 0, 0, W, H
+        x, y, w, h = bbox
+        _mx = self.margin + max(0, self.max_size[1] - w) // 2 + 1
+        _my = self.margin + max(0, self.max_size[0] - h) // 2 + 1
+        return max(0, x - _mx), max(0, y - _my), min(W, x + w + _mx), min(H, y + h + _my)
+
+    @staticmethod
+    def _match(edges, scale, tmpl):
+        if edges.shape[0] < tmpl.shape[0] or edges.shape[1] < tmpl.shape[1]:
+            return -1.0, None, scale, tmpl.shape
+        _, score, _, loc = cv2.minMaxLoc(cv2.matchTemplate(edges, tmpl, md.method))
+        return score, loc, scale, tmpl.shape
+
+    def match_edges(self, edges, scales=None):
+        ''' best (score, loc, scale, template shape) over the pyramid in edge image %edges
+            scales: restrict the search to these pyramid scales
+        '''
+        _pyr = self.pyramid if scales is None else [(s, t) for s, t in self.pyramid if s in scales]
+        if self.pool is not None and len(_pyr) > 1:
+            results = list(self.pool.map(lambda p: self._match(edges, *p), _pyr))
+        else:
+            results = [self._match(edges, s, t) for s, t in _pyr]
+        return max(results, key=lambda r: r[0]) if results else (-1.0, None, None, None)
+
+    def detect(self, gray, bbox=None, scales=None):
+        ''' find the cursor in gray frame %gray, only inside %bbox (x, y, w, h) if given
+            return (x, y, w, h, scale, score) of the best match, (x, y, w, h) the matched template
+            rectangle, or None
+        '''
+        if not self.pyramid:
+            return None
+        x0, y0, x1, y1 = self._region(gray.shape, bbox)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        self.searches += 1
+        edges = md.GetEdgesfromImage(gray[y0:y1, x0:x1])
+        score, loc, scale, shape = self.match_edges(edges, scales)
+        if loc is None or score < self.threshold:
+            return None
+        return x0 + loc[0], y0 + loc[1], shape[1], shape[0], scale, score
+
+    def coverage(self, mask, match):
+        ''' fraction of the cursor outline of %match (detect() result) covered by nonzero %mask pixels
+            a moving cursor changes its own outline, a still one next to other changes does not
+        '''
+        x, y, w, h, scale, _ = match
+        _m = mask[y:y + h, x:x + w]
+        _o = self.outlines[scale][:_m.shape[0], :_m.shape[1]]
+        _total = cv2.countNonZero(_o)
+        return cv2.countNonZero(cv2.bitwise_and(_m, _m, mask=_o)) / _total if _total else 0.0
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+
+
+class CursorTracker(object):
+    ''' cursor tracking, windowed search after the first lock
+
+        Once locked, the cursor is searched only in a small window around its
+        last position at the matched scale. When nothing changed in that
+        window the cursor did not move and no search runs at all. After
+        %lost_after windowed misses the lock is dropped and the next update
+        falls back to the global multi-scale search in the changed region.
+
+        detector: CursorDetector
+        window: pixels searched around the last position
+        min_move: displacement (pixels) that counts as cursor motion
+        min_coverage: changed fraction of the cursor outline required for a new lock
+    '''
+    def __init__(self, detector, window=24, lost_after=2, min_move=1, min_coverage=0.15):
+        self.detector = detector
+        self.window = window
+        self.lost_after = lost_after
+        self.min_move = min_move
+        self.min_coverage = min_coverage
+        self.match = None
+        self.time = None
+        self.velocity = (0.0, 0.0)
+        self.moved = False
+        self.misses = 0
+        self.window_searches = 0
+        self.global_searches = 0
+
+    @property
+    def locked(self):
+        return self.match is not None
+
+    @property
+    def position(self):
+        ''' (x, y) of the cursor, top-left of the matched template '''
+        return self.match[:2] if self.match is not None else None
+
+    @staticmethod
+    def _overlap(a, b):
+        return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+    def _lock(self, match, now):
+        ''' take %match as the new cursor position and update the velocity '''
+        if self.match is not None and self.time is not None:
+            dx, dy = match[0] - self.match[0], match[1] - self.match[1]
+            dt = now - self.time
+            self.moved = max(abs(dx), abs(dy)) >= self.min_move
+            self.velocity = (dx / dt, dy / dt) if dt > 0 else (0.0, 0.0)
+        self.match, self.time, self.misses = match, now, 0
+
+    def still(self, now):
+        ''' nothing changed in the frame at %now, the cursor stayed put '''
+        self.moved = False
+        if self.match is not None:
+            self.velocity, self.time = (0.0, 0.0), now
+
+    def update(self, gray, now, bbox=None, mask=None):
+        ''' track the cursor in gray frame %gray at time %now (seconds)
+            bbox: changed region (x, y, w, h), mask: changed pixels of the frame
+            return the current match (x, y, w, h, scale, score) or None, self.moved tells
+            whether the cursor moved since the last update
+        '''
+        self.moved = False
+        if self.match is not None:
+            x, y, w, h, scale, _ = self.match
+            _win = (x - self.window, y - self.window, w + 2 * self.window, h + 2 * self.window)
+            if bbox is not None and not self._overlap(_win, bbox):
+                # nothing changed around the cursor, it stayed put
+                self.velocity, self.time = (0.0, 0.0), now
+                return self.match
+            self.window_searches += 1
+            _m = self.detector.detect(gray, _win, scales=[scale])
+            if _m is not None:
+                self._lock(_m, now)
+                return self.match
+            self.misses += 1
+            if self.misses <= self.lost_after:
+                return None
+            self.match, self.velocity = None, (0.0, 0.0)
+
+        self.global_searches += 1
+        _m = self.detector.detect(gray, bbox)
+        if _m is None or (mask is not None and self.detector.coverage(mask, _m) < self.min_coverage):
+            return None
+        # a new lock is only taken on a changed cursor outline, i.e. a cursor that moved here
+        self.match, self.time, self.misses = _m, now, 0
+        self.velocity, self.moved = (0.0, 0.0), True
+        return self.match
@@ -4,6 +4,7 @@ import datetime as dt
 
 import threading
 import sys
+import time
 import logging
 import pathlib
 
@@ -11,31 +12,87 @@ import pathlib
 scriptPath = pathlib.Path(__file__).parent.resolve()
 sys.path.append(str(scriptPath.parent / 'common'))
 from jsonutils import json2str
-
+from frame_capture import CaptureThread, SyncCapture
+from frame_source import open_source
+from frame_diff import FrameDiff, TiledFrameDiff, FrameFingerprint, BatchFrameDiff
+from stage_timer import StageTimer
+from cursor_detector import CursorDetector, CursorTracker
+from popup_detector import PopupDetector
+from popup_index import PopupIndex, index_file
+
+# roi: analysed region, exclude: regions never analysed (status bars, logo, scrolling log)
+# both given as (x0, y0, x1, y1) fractions of the frame size
 DET_TYPE = [
-    {'frame_threshold': 30, 'threshold': 150},
-    {'frame_threshold': 30, 'threshold': 150},
-    {'frame_threshold': 30, 'threshold': 100},
+    {'frame_threshold': 30, 'threshold': 150, 'roi': (0.0, 0.0, 1.0, 1.0), 'exclude': []},
+    {'frame_threshold': 30, 'threshold': 150, 'roi': (0.0, 0.0, 1.0, 1.0), 'exclude': []},
+    {'frame_threshold': 30, 'threshold': 100, 'roi': (0.0, 0.0, 1.0, 1.0), 'exclude': []},
 ]
 
+# timed stages of the test screen and masking loops, see stage_timer.py
+TEST_STAGES = ('capture', 'convert', 'diff')
+MASK_STAGES = ('capture', 'fingerprint', 'tiles', 'convert', 'diff', 'regions', 'index', 'color', 'cursor', 'state')
+BATCH_STAGES = ('capture', 'convert', 'diff', 'index', 'color', 'state')
+
 
 class TesterDetection(object):
-    def __init__(self, file, redis_conn, id, detectionType=2, displayVid=False) -> None:
-        ''' init tester detection module'''
+    def __init__(self, file, redis_conn, id, detectionType=2, displayVid=False, frameCounter=None, ringSize=3, startSec=0, roi=None, exclude=None, idleFps=3, scale=1.0, tile=0, staticTol=0.5, grayCapture=False, realtime=True, stride=1, timingSample=10, metricsPeriod=10.0, batch=None, cursorDetect=False, popupColor=False, popupIndex=None, alertAck=None) -> None:
+        ''' init tester detection module
+            frameCounter: optional shared counter (multiprocessing.Value) incremented per analysed frame
+            ringSize: number of frame slots between capture thread and analysis
+            startSec: position (seconds) to start from when the source is a video file
+            roi, exclude: override the region of interest / exclusion regions of the DET_TYPE preset
+            idleFps: analysed frame rate while the screen is idle, 0 to always analyse at full rate
+            scale: analysis scale (1/2, 1/4 ...), pixel and area thresholds are rescaled to match,
+                   the diff threshold and the change bands too (thin text and cursor strokes are
+                   averaged with the background by the downsampling)
+            tile: tile size for coarse-to-fine change detection, 0 to diff the full frame
+            staticTol: fingerprint tolerance (gray levels) of the static-frame fast path, None to disable
+            grayCapture: capture luminance only (Y plane of YUYV, reduced grayscale decode of MJPEG)
+            realtime: False to replay a recording flat-out, every frame is read synchronously and analysed
+            stride: analyse every stride-th frame only, skipped frames are grabbed but not decoded
+            timingSample: time the stages of every timingSample-th frame, 0 to disable timing
+            metricsPeriod: seconds between timing summaries on tester.<id>.metrics, 0 to disable
+            batch: BatchDetection running the masking stage of this camera together with others,
+                   the frame diff of all its cameras is computed in one pass (no tiles, static-frame
+                   fast path or idle sampling)
+            cursorDetect: count a change as user interaction only if the tracked mouse cursor
+                   moved, instead of by its changed pixel count
+            popupColor: confirm a popup by a blue rectangle in the changed regions (HSV check on
+                   the changed region boxes only), needs color frames
+            popupIndex: directory of the popup signature index (one file per DET_TYPE), known popups
+                   are recognised by their signature without color check and labelled in the popUp
+                   message, new popups are added when confirmed by the color check
+            alertAck: seconds until an activated alert is acknowledged, as by an alert-response
+                   reset, for offline runs without an operator; None to wait for alert-response
+        '''
         self.redis_conn = redis_conn
         self.detType = detectionType
         self.display_video = displayVid
         self.id = id
         self.stage = 'idle'
+        self.th_quit = threading.Event()
+        self.th = None
+        self.masking = False
 
         #inits
         self.file = file
         self.new_frame_width = None
         self.frame_width = None
         self.frame_height = None
+        self.frame_area = None
+        self.roi = roi
+        self.exclude = exclude
+        self.scale = scale
+        self.tile = tile if batch is None else 0
+        self.batch = batch
+        self.gray_capture = grayCapture
+        self.source_reduce = 1
 
         self.frame_threshold = None
         self.threshold = None
+        self.significant_change_threshold = None
+        self.minor_change_threshold = None
+        self.mouse_change_threshold = None
 
         self.fps = 0
         self.fps_stop = 0
@@ -47,7 +104,64 @@ class TesterDetection(object):
         self.min_area = 1000
 
 
-        self.prev_frame_gray = None
+        self.frame_diff = None
+        self.cursor_detect = cursorDetect
+        self.cursor_detector = None
+        self.cursor_tracker = None
+        self.cursor = None
+        self.popup_color = popupColor
+        self.popup_detector = PopupDetector() if popupColor or popupIndex else None
+        self.popup_index = PopupIndex(index_file(detectionType, popupIndex)) if popupIndex else None
+        self.popup_rect = None
+        self.popup_label = None
+        self.popup_known = False
+
+        #capture thread
+        self.capture = None
+        self.ring_size = ringSize
+        self.start_sec = startSec
+        self.realtime = realtime
+        self.stride = max(1, int(stride))
+
+        #detection state, clocked by frame timestamps (seconds)
+        self.popup = False
+        self.alert_time = None
+        self.alert_ack = alertAck
+        self.alert_fired = None
+        self.frame_time = None
+
+        #frame statistics
+        self.frames = 0
+        self.frame_counter_shared = frameCounter
+        self.dropped_frames = 0
+        self.frame_stamp = None
+        self.latency = 0.0
+        self.latency_avg = 0.0
+        self.latency_max = 0.0
+        self.idle_skipped_frames = 0
+        self.analysed_fps = 0.0
+        self._interval_avg = 0.0
+        self._last_analysed = None
+
+        #adaptive sampling
+        self.idle_fps = idleFps if realtime and batch is None else 0
+        self.idle_after = 2.0
+        self.idle_mode = False
+        self._quiet_since = None
+        self._next_sample = 0.0
+
+        #static-frame fast path
+        self.fingerprint = FrameFingerprint(staticTol) if staticTol is not None and batch is None else None
+        self.static_frames = 0
+
+        #stage timing
+        self.timing = {
+            'test-screen': StageTimer(TEST_STAGES, sample=timingSample),
+            'masking': StageTimer(MASK_STAGES, sample=timingSample),
+        }
+        self.timer = self.timing['test-screen']
+        self.metrics_period = metricsPeriod
+        self._next_metrics = 0.0
 
         logging.debug('Tester Detection Module start and wait for initialization command')
 
@@ -57,6 +171,7 @@ class TesterDetection(object):
         CAPTURE_DONE = False
         self.frame_threshold = DET_TYPE[self.detType]['frame_threshold']
         self.threshold = DET_TYPE[self.detType]['threshold']
+        self._make_frame_diff()
 
         if self.frame_threshold and self.threshold:
             #print(self.frame_threshold)
@@ -72,23 +187,178 @@ class TesterDetection(object):
             })
         )
 
+    def _make_frame_diff(self):
+        ''' create frame difference engine, frames already reduced by the source are analysed at a smaller scale '''
+        _kw = {
+            'roi': self.roi if self.roi is not None else DET_TYPE[self.detType].get('roi', None),
+            'exclude': self.exclude if self.exclude is not None else DET_TYPE[self.detType].get('exclude', []),
+            'scale': min(1.0, self.scale * self.source_reduce),
+        }
+        # a one pixel stroke changes an analysis pixel by about the analysis scale times its own change
+        _threshold = self.threshold * _kw['scale'] / self.source_reduce
+        self.frame_diff = TiledFrameDiff(_threshold, tile=self.tile, **_kw) if self.tile else \
+            FrameDiff(_threshold, **_kw)
+        self.frame_diff.timer = self.timer
+        if self.cursor_detect:
+            if self.cursor_detector is not None:
+                self.cursor_detector.close()
+            self.cursor_detector = CursorDetector(frame_scale=self.analysis_scale)
+            self.cursor_tracker = CursorTracker(self.cursor_detector)
+
+    @property
+    def analysis_scale(self):
+        ''' scale of the analysed frames relative to the native frames '''
+        return self.frame_diff.scale / self.source_reduce if self.frame_diff is not None else self.scale
+
+    def _use_timer(self, name):
+        ''' charge the stage timing of the following frames to timer %name '''
+        self.timer = self.timing[name]
+        if self.frame_diff is not None:
+            self.frame_diff.timer = self.timer
+
+    def _open_capture(self):
+        ''' open video capture, in gray mode MJPEG cameras decode at the largest reduction within the analysis scale '''
+        _reduce = 1
+        while _reduce < 8 and self.scale * _reduce * 2 <= 1.0:
+            _reduce *= 2
+        _cap = open_source(self.file, gray=self.gray_capture, reduce=_reduce, stride=self.stride)
+        if getattr(_cap, 'reduce', 1) != self.source_reduce:
+            self.source_reduce = getattr(_cap, 'reduce', 1)
+            self._make_frame_diff()
+        return _cap
+
+    def _start_capture(self):
+        ''' open source and start capture thread, reused by test screen and masking stages '''
+        if self.capture is None or not self.capture.is_alive():
+            _cap = self._open_capture()
+            if self.start_sec:
+                _cap.set(cv2.CAP_PROP_POS_MSEC, self.start_sec * 1000)
+            # effective analysed frame rate
+            self.fps = _cap.get(cv2.CAP_PROP_FPS) / self.stride
+            self.capture = CaptureThread(_cap, size=self.ring_size).start() if self.realtime else \
+                SyncCapture(_cap).start()
+        return self.capture
+
+    def _stop_capture(self):
+        ''' stop capture thread and release source '''
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+    def _read_frame(self, timeout=1.0):
+        ''' return freshest captured frame (None on timeout) and update dropped frame count '''
+        _frame, _stamp, _skipped = self.capture.read(timeout)
+        if _frame is not None:
+            if self.idle_mode:
+                self.idle_skipped_frames += _skipped
+            else:
+                self.dropped_frames += _skipped
+            self.frame_stamp = _stamp
+            self.frame_time = self.capture.pts
+        return _frame
+
+    def _update_latency(self):
+        ''' update capture-to-analysis latency of the last analysed frame '''
+        self.latency = time.monotonic() - self.frame_stamp
+        self.latency_avg = self.latency if not self.latency_avg else 0.95 * self.latency_avg + 0.05 * self.latency
+        self.latency_max = max(self.latency_max, self.latency)
+
+    def get_info(self):
+        ''' return a dict containing detection statistics '''
+        return {
+            'stage': self.stage,
+            'frames': self.frames,
+            'dropped-frames': self.dropped_frames,
+            'idle-skipped-frames': self.idle_skipped_frames,
+            'analysed-fps': round(self.analysed_fps, 2),
+            'sampling': 'idle' if self.idle_mode else 'full',
+            'static-frames': self.static_frames,
+            'static-skip-ratio': round(self.static_frames / self.frames, 3) if self.frames else 0.0,
+            'cursor': self.get_cursor(),
+            'cursor-searches': self.cursor_detector.searches if self.cursor_detector is not None else 0,
+            'popup-rect': self.popup_rect,
+            'popup-label': self.popup_label,
+            'popup-color-checks': self.popup_detector.checks if self.popup_detector is not None else 0,
+            'popup-index': {'size': len(self.popup_index.entries), 'hits': self.popup_index.hits,
+                'misses': self.popup_index.misses} if self.popup_index is not None else None,
+            'capture-latency': round(self.latency, 4),
+            'capture-latency-avg': round(self.latency_avg, 4),
+            'capture-latency-max': round(self.latency_max, 4),
+            'timing': {k: t.summary() for k, t in self.timing.items()},
+        }
+
+    def _publish_metrics(self):
+        ''' publish the stage timing summary of the masking loop on tester.<id>.metrics,
+            a batched camera adds the timing of the shared loop
+        '''
+        self._next_metrics = time.monotonic() + self.metrics_period
+        self.redis_conn.publish(
+            'tester.{}.metrics'.format(self.id),
+            json2str({
+                'stage': 'metrics',
+                'frames': self.frames,
+                'analysed-fps': round(self.analysed_fps, 2),
+                'timing': self.timing['masking'].summary(mark=True),
+                'batch-timing': self.batch.timer.summary() if self.batch is not None else None,
+            })
+        )
+
+    def _periodic(self):
+        ''' work due once per metrics period: timing summary and the popups learned since the last
+            period written to the index file, both kept out of the per-frame work
+        '''
+        if not self.metrics_period or time.monotonic() < self._next_metrics:
+            return
+        self._publish_metrics()
+        if self.popup_index is not None and self.popup_index.dirty:
+            self.popup_index.save()
+
+    def _count_frame(self):
+        ''' update analysed frame counters '''
+        self.frames += 1
+        if self.frame_counter_shared is not None:
+            self.frame_counter_shared.value += 1
+        _now = time.monotonic()
+        if self._last_analysed is not None:
+            _dt = _now - self._last_analysed
+            self._interval_avg = _dt if not self._interval_avg else 0.9 * self._interval_avg + 0.1 * _dt
+            self.analysed_fps = 1.0 / self._interval_avg if self._interval_avg > 0 else 0.0
+        self._last_analysed = _now
+
+    def _update_sampling(self, nonzero_pixels, minor_change_threshold, popUp):
+        ''' switch between idle sampling and full rate analysis
+            full rate as soon as the screen changes and for as long as a popup is handled,
+            idle sampling once the screen stayed quiet for idle_after seconds
+        '''
+        if not self.idle_fps:
+            return
+        _now = time.monotonic()
+        if popUp or self.stage != 'idle' or nonzero_pixels > minor_change_threshold:
+            if self.idle_mode:
+                logging.debug('Screen changed, analysing at full rate')
+            self.idle_mode = False
+            self._quiet_since = None
+        elif not self.idle_mode:
+            if self._quiet_since is None:
+                self._quiet_since = _now
+            elif _now - self._quiet_since >= self.idle_after:
+                logging.debug('Screen idle, analysing at {} fps'.format(self.idle_fps))
+                self.idle_mode = True
+                self._next_sample = _now + 1.0 / self.idle_fps
+
     # FIXME: test screen detection
     def __test_screen_detection(self, frame):
 
         ''' detect test screen, return True if test screen detected, false otherwise'''
-        current_frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        frame_diff = cv2.absdiff(current_frame_gray, self.prev_frame_gray)
-        _, thresh_diff = cv2.threshold(frame_diff, self.threshold, 255, cv2.THRESH_BINARY)
-
-        nonzero_pixels = cv2.countNonZero(thresh_diff)
+        nonzero_pixels = self.frame_diff.compare(frame)
 
-        full_screen_change = (self.frame_width * self.frame_height) * 0.5
+        full_screen_change = self.frame_area * 0.5
 
         if nonzero_pixels > full_screen_change:
             self.current_state = 0
             return True
 
-        self.prev_frame_gray = current_frame_gray
+        self.frame_diff.advance()
 
         return True
 
@@ -96,11 +366,11 @@ class TesterDetection(object):
         ''' capture test screen '''
         TEST_READY = False
 
-        _cap = cv2.VideoCapture(self.file)
-        _cap.open(0, apiPreference=cv2.CAP_V4L2)
+        self._start_capture()
+        self._use_timer('test-screen')
 
-        ret, prev_frame = _cap.read()
-        self.prev_frame_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY) if ret else None
+        prev_frame = self._read_frame()
+        self.frame_diff.reset(prev_frame)
 
         ###???###
         # currTime = dt.datetime.now()
@@ -108,23 +378,29 @@ class TesterDetection(object):
 
         #frame dimensions
         #self.new_frame_width = int(_cap.get(cv2.CAP_PROP_FRAME_WIDTH) * 2)
-        self.frame_width = int(self.prev_frame_gray.shape[1])
-        self.frame_height = int(self.prev_frame_gray.shape[0])
+        self.frame_width = self.frame_diff.frame_width
+        self.frame_height = self.frame_diff.frame_height
+        self.frame_area = self.frame_diff.area
         self.new_frame_width = int(self.frame_width * 2)
         #logging.info(self.frame_width, self.frame_height)
 
         #fps threshold
-        self.fps = _cap.get(cv2.CAP_PROP_FPS)
         self.fps_stop = int(self.fps * self.frame_threshold)
 
         while not TEST_READY:
-            _, _frame = _cap.read()
+            self.timer.begin()
+            _frame = self._read_frame()
+            if _frame is None:
+                if self.capture.eos: break
+                continue
+            self.timer.lap('capture')
             TEST_READY = self.__test_screen_detection(_frame)
+            self.timer.end()
             print(TEST_READY)
             if self.display_video: cv2.imshow('testScreen', _frame)
             # _now = dt.datetime.now()
             # if _now > stopTime: break
-        _cap.release()
+        # capture keeps running for the masking stage
         if self.display_video: cv2.destroyAllWindows()
 
         logging.debug('Configuration setting successed: {}'.format(TEST_READY))
@@ -136,6 +412,23 @@ class TesterDetection(object):
             })
         )
 
+    def _known_popup(self, frame, boxes):
+        ''' look up the changed region %boxes (x0, y0, x1, y1) of %frame in the popup index,
+            True if one of them is a known popup
+        '''
+        for x0, y0, x1, y1 in boxes:
+            entry = self.popup_index.lookup(frame, (x0, y0, x1 - x0, y1 - y0))
+            if entry is not None:
+                self.popup_rect, self.popup_label = (x0, y0, x1 - x0, y1 - y0), entry['label']
+                return True
+        return False
+
+    def _learn_popup(self, frame, boxes):
+        ''' add the largest changed region of a new popup to the index, under the box looked up later '''
+        x0, y0, x1, y1 = max(boxes, key=lambda b: (b[2] - b[0]) * (b[3] - b[1]))
+        self.popup_label = self.popup_index.add(frame, (x0, y0, x1 - x0, y1 - y0))['label']
+        logging.debug('New popup {} at {} added to the signature index'.format(self.popup_label, (x0, y0, x1, y1)))
+
     # FIXME: pop up detection
     def __popup_detection(self, nonzero_pixels, significant_change_detected, significant_change_threshold):
         ''' detect pop up, True if pop up detected, False otherwise '''
@@ -148,10 +441,43 @@ class TesterDetection(object):
         return False
 
 
+    def _track_cursor(self, nonzero_pixels):
+        ''' track the mouse cursor in every analysed frame, so its position stays current and the
+            lock is kept; cursor_tracker.moved tells whether it moved in this frame
+        '''
+        self.timer.lap('state')
+        if not nonzero_pixels:
+            self.cursor_tracker.still(self.frame_time)
+        elif self.cursor_tracker.locked or nonzero_pixels <= self.significant_change_threshold:
+            # the global search for a new lock is skipped on popup-size changes
+            # after update() the previous plane holds the gray plane of the last frame
+            self.cursor = self.cursor_tracker.update(self.frame_diff.prev, self.frame_time,
+                self.frame_diff.bbox(), self.frame_diff.mask)
+        else:
+            self.cursor_tracker.still(self.frame_time)
+        self.timer.lap('cursor')
+
+    def get_cursor(self):
+        ''' tracked cursor position (x, y) and velocity (vx, vy) per second in frame pixels, None if not locked '''
+        if self.cursor_tracker is None or not self.cursor_tracker.locked:
+            return None
+        _s = self.analysis_scale
+        (x, y), (vx, vy) = self.cursor_tracker.position, self.cursor_tracker.velocity
+        return {'x': round(x / _s, 1), 'y': round(y / _s, 1), 'vx': round(vx / _s, 1), 'vy': round(vy / _s, 1)}
+
     # FIXME: user interaction detection
     def __interaction_detection(self, nonzero_pixels, minor_change_threshold, mouse_change_threshold):
         ''' detect user interfaction, True if detected, False otherwise '''
 
+        if self.cursor_detector is not None:
+            # cursor based: any change short of a popup-size change, confirmed by cursor motion
+            # (a moving cursor alone changes fewer pixels than the minor change threshold)
+            if nonzero_pixels > 0 and nonzero_pixels <= self.significant_change_threshold \
+                    and self.cursor_tracker.moved:
+                print('interaction detected')
+                return True
+            return False
+
         if nonzero_pixels > minor_change_threshold and nonzero_pixels < mouse_change_threshold:
             print('interaction detected')
             return True
@@ -159,104 +485,211 @@ class TesterDetection(object):
         return False
 
 
+    def _update_state(self, nonzero_pixels, now, frame=None):
+        ''' advance popup / alert state machine with the changed pixel count of a frame
+            now: frame timestamp in seconds, alert timing follows the video clock so replays can run flat-out
+            frame: the diffed frame, for the popup color check
+            return True while a popup is shown
+        '''
+        if self.stage == 'reset':
+            self.popup = False
+            self.popup_rect = None
+            self.popup_label = None
+            self.stage = 'idle'
+            print ('******* popUp: {}, stage: {}'.format(self.popup, self.stage))
+
+        if self.cursor_tracker is not None:
+            self._track_cursor(nonzero_pixels)
+
+        if not self.popup:
+            # region analysis only when the pixel count alone could raise a popup
+            self.timer.lap('state')
+            # one connected-components pass serves the region size, index and color checks
+            _stats = self.frame_diff.blob_stats() if nonzero_pixels > self.significant_change_threshold else None
+            significant_change_detected = _stats is not None and \
+                self.frame_diff.significant_change(self.min_area / self.source_reduce ** 2, _stats)
+            self.timer.lap('regions')
+            _boxes = self.popup_detector.candidates(self.frame_diff, self.popup_detector.min_area / self.source_reduce ** 2, _stats) \
+                if significant_change_detected and self.popup_detector is not None and frame is not None else []
+            self.popup_known = self.popup_index is not None and self._known_popup(frame, _boxes)
+            self.timer.lap('index')
+            if significant_change_detected and not self.popup_known and self.popup_color and frame is not None and frame.ndim == 3:
+                # a large change only counts as a popup if it is a blue rectangle
+                self.popup_rect = self.popup_detector.detect(frame, self.frame_diff, self.source_reduce, _boxes)
+                significant_change_detected = self.popup_rect is not None
+                self.timer.lap('color')
+            self.popup = self.__popup_detection(nonzero_pixels, significant_change_detected, self.significant_change_threshold)
+            if self.popup and self.popup_index is not None and not self.popup_known and self.popup_rect is not None:
+                # only color confirmed popups are learned
+                self._learn_popup(frame, _boxes)
+            #print('no popup')
+        if self.popup:
+            #print('yes popup')
+            if self.stage == 'idle':
+                _msg = {
+                    'stage': 'popUp',
+                    'status': 'success'
+                }
+                if self.popup_index is not None:
+                    _msg.update({'label': self.popup_label, 'known': self.popup_known})
+                self.redis_conn.publish(
+                    'tester.{}.result'.format(self.id),
+                    json2str(_msg)
+                )
+                self.alert_time = now
+                self.stage = 'preAlert'
+            elif self.stage == 'preAlert':
+                interaction = self.__interaction_detection(nonzero_pixels, self.minor_change_threshold, self.mouse_change_threshold)
+                # print(f'interaction:{interaction}')
+                if interaction:
+                    self.stage = 'reset'
+                    self.redis_conn.publish(
+                        'tester.{}.result'.format(self.id),
+                        json2str({
+                            'stage': 'alert-reset',
+                            'status': 'success'
+                        })
+                    )
+                elif now - self.alert_time > self.frame_threshold:
+                    self.stage = 'alert'
+                    self.alert_fired = now
+                    self.redis_conn.publish(
+                        'tester.{}.alert'.format(self.id),
+                        json2str({
+                            'stage': 'alert',
+                            'status': 'activated'
+                        })
+                    )
+            elif self.stage == 'alert' and self.alert_ack is not None and now - self.alert_fired >= self.alert_ack:
+                # offline run, acknowledge the alert as the operator would
+                self.set_alert_stage('alert-msg', True)
+        return self.popup
+
+    def reset_state(self, frame):
+        ''' seed the frame difference with %frame, set the change thresholds and clear the popup / alert state '''
+        self.frame_diff.reset(frame)
+        if self.fingerprint is not None:
+            self.fingerprint.reset()
+            self.fingerprint.match(frame)
+
+        self.frame_area = self.frame_diff.area
+        # thin strokes (text, cursor) cover up to 1/scale more of the frame at a reduced analysis
+        # scale, popups are filled regions well above the threshold either way
+        self.significant_change_threshold = self.frame_area * 0.001 / self.analysis_scale
+        self.minor_change_threshold = self.frame_area * 0.0001
+        # the cursor moves further between strided frames, widen the interaction band
+        # up to the significant change threshold
+        self.mouse_change_threshold = min(self.frame_area * 0.0009 * self.stride / self.analysis_scale,
+            self.significant_change_threshold)
+        self.popup = False
+        self.popup_rect = None
+        self.popup_label = None
+        self.alert_time = None
+        self.alert_fired = None
+
+    def analyse_frame(self, frame, now):
+        ''' diff %frame against the previous one and advance the state machine
+            now: frame timestamp in seconds
+            return (changed pixels, popup shown)
+        '''
+        _static = self.fingerprint is not None and self.fingerprint.match(frame)
+        self.timer.lap('fingerprint')
+        if _static:
+            # same as the last analysed frame: skip the diff, the stages below still run on no change
+            self.static_frames += 1
+            nonzero_pixels = 0
+        else:
+            nonzero_pixels = self.frame_diff.update(frame)
+        return nonzero_pixels, self.analyse_diff(nonzero_pixels, now, frame)
+
+    def analyse_diff(self, nonzero_pixels, now, frame=None):
+        ''' advance the state machine with the changed pixel count of a frame diffed already
+            (by analyse_frame or a BatchDetection), return True while a popup is shown
+            frame: the diffed frame, for the popup color check
+        '''
+        self._count_frame()
+
+        #print(self.stage)
+
+        self.frame_time = now
+        return self._update_state(nonzero_pixels, now, frame)
+
+    def get_state(self):
+        ''' snapshot of the popup / alert state, the alert start time only matters before the alert,
+            the alert time only while an alert waits for its acknowledgement
+        '''
+        return {
+            'stage': self.stage,
+            'popup': self.popup,
+            'alert_time': self.alert_time if self.stage == 'preAlert' else None,
+            'alert_fired': self.alert_fired if self.stage == 'alert' and self.alert_ack is not None else None,
+        }
+
+    def set_state(self, state):
+        ''' restore popup / alert state from get_state() snapshot '''
+        self.stage = state['stage']
+        self.popup = state['popup']
+        self.alert_time = state['alert_time']
+        self.alert_fired = state.get('alert_fired', None)
+
     def _mask_compare(self):
         ''' masking and comparison thread '''
 
-        _cap = cv2.VideoCapture(self.file)
-        _cap.open(0, apiPreference=cv2.CAP_V4L2)
-
-
-
-        fps = _cap.get(cv2.CAP_PROP_FPS)
-        start_frame = int(fps * 1410)  # 180 seconds for 3 minutes
-        _cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
-
-
-        ret, prev_frame = _cap.read()
-        self.prev_frame_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY) if ret else None
-
-        popUp = False
-        alertTime = None
-
-        while True:
-            _, _frame = _cap.read()
+        self._start_capture()
+        self._use_timer('masking')
+
+        prev_frame = self._read_frame()
+        self.reset_state(prev_frame)
+
+        while not self.th_quit.is_set():
+            if self.idle_mode:
+                # idle screen: wait for the next sample time, the ring keeps the freshest frame
+                _wait = self._next_sample - time.monotonic()
+                if _wait > 0:
+                    self.th_quit.wait(_wait)
+                    continue
+                self._next_sample = time.monotonic() + 1.0 / self.idle_fps
+
+            # always analyse the freshest frame, stale frames are dropped by the capture ring
+            self.timer.begin()
+            _frame = self._read_frame()
+            if _frame is None:
+                if self.capture.eos: break
+                continue
+            self.timer.lap('capture')
             #logging.info(_frame.shape)
 
 
             #process frame and thresholds
-            current_frame_gray = cv2.cvtColor(_frame, cv2.COLOR_BGR2GRAY)
-            frame_diff = cv2.absdiff(current_frame_gray, self.prev_frame_gray)
-            _, thresh_diff = cv2.threshold(frame_diff, self.threshold, 255, cv2.THRESH_BINARY)
-
-            nonzero_pixels = cv2.countNonZero(thresh_diff)
-            significant_change_threshold = (self.frame_width * self.frame_height) * 0.001
-            minor_change_threshold = (self.frame_width * self.frame_height) * 0.0001
-            mouse_change_threshold = (self.frame_width * self.frame_height) * 0.0009
-
-            contours, _ = cv2.findContours(thresh_diff, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            significant_change_detected = any(cv2.contourArea(contour) > self.min_area for contour in contours)
-
-            self.prev_frame_gray = current_frame_gray
-
-            #print(self.stage)
-
-            if self.stage == 'reset':
-                popUp = False
-                self.stage = 'idle'
-                print ('******* popUp: {}, stage: {}'.format(popUp, self.stage))
-
-            if not popUp:
-                popUp = self.__popup_detection(nonzero_pixels, significant_change_detected, significant_change_threshold)
-                #print('no popup')
-            if popUp:
-                #print('yes popup')
-                if self.stage == 'idle':
-                    self.redis_conn.publish(
-                        'tester.{}.result'.format(self.id),
-                        json2str({
-                            'stage': 'popUp',
-                            'status': 'success'
-                        })
-                    )
-                    alertTime = dt.datetime.now()
-                    self.stage = 'preAlert'
-                elif self.stage == 'preAlert':
-                    interaction = self.__interaction_detection(nonzero_pixels, minor_change_threshold, mouse_change_threshold)
-                    # print(f'interaction:{interaction}')
-                    if interaction:
-                        self.stage = 'reset'
-                        self.redis_conn.publish(
-                            'tester.{}.result'.format(self.id),
-                            json2str({
-                                'stage': 'alert-reset',
-                                'status': 'success'
-                            })
-                        )
-                    else:
-                        _now = dt.datetime.now()
-                        _diff = _now - alertTime
-                        if _diff.total_seconds() > self.frame_threshold:
-                            self.stage = 'alert'
-                            self.redis_conn.publish(
-                                'tester.{}.alert'.format(self.id),
-                                json2str({
-                                    'stage': 'alert',
-                                    'status': 'activated'
-                                })
-                            )
+            nonzero_pixels, popUp = self.analyse_frame(_frame, self.frame_time)
+            self._update_sampling(nonzero_pixels, self.minor_change_threshold, popUp)
+            self._update_latency()
+            self.timer.lap('state')
+            self.timer.end()
+            self._periodic()
             if self.display_video: cv2.imshow('Masking', _frame)
-            if self.th_quit.is_set():
-                break
-        _cap.release()
+        self._stop_capture()
         if self.display_video: cv2.destroyAllWindows()
         logging.debug('Masking & Comparison stopped')
 
     def start_mask_compare(self):
         ''' start masking and compare '''
-        self.th_quit = threading.Event()
+        self.masking = True
+        if self.batch is not None:
+            self.batch.add(self)
+            return
+        self.th_quit.clear()
         self.th = threading.Thread(target=self._mask_compare)
         self.th.start()
 
+    def ended(self):
+        ''' True if the masking loop stopped by itself (end of stream, capture failure or error) '''
+        if not self.masking or self.th_quit.is_set():
+            return False
+        if self.batch is not None:
+            return self not in self.batch.detections
+        return self.th is not None and not self.th.is_alive()
+
     def set_alert_stage(self, stage, status=False):
         ''' setting of alert stage '''
         if status:  
@@ -266,6 +699,120 @@ class TesterDetection(object):
 
     def close(self):
         self.th_quit.set()
+        if self.batch is not None:
+            self.batch.remove(self)
+        elif self.th is None or not self.th.is_alive():
+            self._stop_capture()
+        if self.cursor_detector is not None:
+            self.cursor_detector.close()
+        if self.popup_index is not None and self.popup_index.dirty:
+            self.popup_index.save()
+
+
+class BatchDetection(object):
+    ''' shared masking loop for several same-resolution cameras in one process
+
+        Each TesterDetection keeps its own capture thread and state machine.
+        The loop collects the freshest frame of every camera, diffs all of
+        them in one BatchFrameDiff pass and hands each camera its own changed
+        pixel count. An alternative to one process per camera on low-power hosts.
+
+        slots: maximum number of cameras
+        timeout: seconds to wait for the frame of a camera
+    '''
+    def __init__(self, slots, timeout=0.1, timingSample=10):
+        self.diff = BatchFrameDiff(slots)
+        self.detections = [None] * slots
+        self.timeout = timeout
+        self.timer = StageTimer(BATCH_STAGES, sample=timingSample)
+        self.diff.timer = self.timer
+        self.lock = threading.Lock()
+        self.th_quit = threading.Event()
+        self.th = None
+
+    def add(self, det):
+        ''' start capture of %det and add it to the next free slot '''
+        det._start_capture()
+        det._use_timer('masking')
+        _frame = det._read_frame()
+        with self.lock:
+            if det in self.detections:
+                return
+            if None not in self.detections:
+                logging.error('No free batch slot for tester {}'.format(det.id))
+                det._stop_capture()
+                return
+            _slot = self.detections.index(None)
+            det.reset_state(_frame)
+            self.diff.attach(_slot, det.frame_diff, _frame)
+            self.detections[_slot] = det
+        logging.debug('Tester {} added to batch slot {}'.format(det.id, _slot))
+        if self.th is None or not self.th.is_alive():
+            self.th_quit.clear()
+            self.th = threading.Thread(target=self._run)
+            self.th.start()
+
+    def remove(self, det):
+        ''' free the slot of %det and stop its capture '''
+        with self.lock:
+            if det in self.detections:
+                _slot = self.detections.index(det)
+                self.detections[_slot] = None
+                self.diff.detach(_slot)
+        det._stop_capture()
+
+    def _run(self):
+        ''' batched masking and comparison thread '''
+        frames = [None] * len(self.detections)
+        while not self.th_quit.is_set():
+            with self.lock:
+                dets = list(self.detections)
+            if not any(dets):
+                self.th_quit.wait(self.timeout)
+                continue
+
+            self.timer.begin()
+            for i, det in enumerate(dets):
+                frames[i] = det._read_frame(self.timeout) if det is not None else None
+            self.timer.lap('capture')
+            with self.lock:
+                counts = self.diff.update(frames)
+                for i, det in enumerate(dets):
+                    if det is None or frames[i] is None or self.detections[i] is not det:
+                        continue
+                    det.timer.begin()
+                    det.analyse_diff(int(counts[i]), det.frame_time, frames[i])
+                    det._update_latency()
+                    det.timer.lap('state')
+                    det.timer.end()
+            self.timer.lap('state')
+            self.timer.end()
+
+            # per camera metrics period, outside the lock as it may write the popup index file
+            for det in dets:
+                if det is not None:
+                    det._periodic()
+
+            for i, det in enumerate(dets):
+                if det is not None and frames[i] is None and det.capture is not None and det.capture.eos:
+                    self.remove(det)
+        logging.debug('Batch masking & comparison stopped')
+
+    def get_info(self):
+        ''' cameras per slot and timing of the shared loop '''
+        return {
+            'slots': [d.id if d is not None else None for d in self.detections],
+            'timing': self.timer.summary(),
+        }
+
+    def close(self):
+        ''' stop the loop and the capture of all cameras '''
+        self.th_quit.set()
+        if self.th is not None:
+            self.th.join()
+        for det in list(self.detections):
+            if det is not None:
+                self.remove(det)
 
 #
 # def video_capture(file):
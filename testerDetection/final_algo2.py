@@ -5,7 +5,11 @@ import pathlib
 import sys
 
 import datetime as dt
+from argparse import ArgumentParser
 
+from frame_diff import FrameDiff
+from frame_source import open_source
+from frame_cache import FrameCache
 
 class detection:
     def __init__(self, file):
@@ -35,9 +39,15 @@ class detection:
         self.current_state = 0
 
         #detection variables
-        self.prev_frame_gray = None
+        self.frame_diff = None
         self.frame_threshold = None
         self.threshold = None
+        self.roi = None
+        self.exclude = []
+        self.scale = 1.0
+        self.gray = False
+        self.cache = None
+        self.stride = 1
 
         #video
         self.display_text = None
@@ -59,11 +69,23 @@ class detection:
         self.frame_threshold = int(30)
         self.threshold = int(100)
 
+        # analysed region and excluded regions as (x0, y0, x1, y1) fractions of the frame,
+        # e.g. exclude the scrolling log so it does not count as user interaction
+        # self.exclude = [(0.0, 0.6, 1.0, 0.95)]
+        # analysis scale, thresholds follow the analysed area
+        # self.scale = 0.5
+        # capture luminance only, skips the BGR decode and conversion
+        # self.gray = True
+        # decoded gray frame cache directory, repeated runs on a recording skip decoding
+        # self.cache = str(pathlib.Path.home() / '.cache' / 'testerDetection' / 'frames')
+        # analyse every N-th frame only, skipped frames are grabbed without decoding
+        # self.stride = 10
+
 
 
     def video_capture(self):
         # video capture
-        self.cap = cv2.VideoCapture(self.file)
+        self.cap = open_source(FrameCache(self.cache).open(self.file) if self.cache else self.file, gray=self.gray, stride=self.stride)
 
         fps = self.cap.get(cv2.CAP_PROP_FPS)
         # start_frame = int(fps*13311)  # 180 seconds for 3 minutes
@@ -79,7 +101,7 @@ class detection:
         self.frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
         # fps processing
-        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) / self.stride
         self.fps_stop = int(self.fps * self.frame_threshold)
 
 
@@ -116,7 +138,8 @@ class detection:
 
         # save previous frame and convert to grayscale
         ret, prev_frame = self.cap.read()
-        self.prev_frame_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY) if ret else None
+        self.frame_diff = FrameDiff(self.threshold, roi=self.roi, exclude=self.exclude, scale=self.scale)
+        if ret: self.frame_diff.reset(prev_frame)
         self.min_area = 2000
         stage = 'idle'
         popUp = False
@@ -127,18 +150,12 @@ class detection:
             if not ret:
                 break
 
-            current_frame_gray = cv2.cvtColor(current_frame, cv2.COLOR_BGR2GRAY)
-            frame_diff = cv2.absdiff(current_frame_gray, self.prev_frame_gray)
-            _, thresh_diff = cv2.threshold(frame_diff, self.threshold, 255, cv2.THRESH_BINARY)
-
-            nonzero_pixels = cv2.countNonZero(thresh_diff)
-            significant_change_threshold = (self.frame_width * self.frame_height) * 0.01
-            # full_screen_change = (self.frame_width * self.frame_height) * 0.5
-            minor_change_threshold = (self.frame_width * self.frame_height) * 0.0001
-            mouse_change_threshold = (self.frame_width * self.frame_height) * 0.009
+            nonzero_pixels = self.frame_diff.update(current_frame)
+            significant_change_threshold = self.frame_diff.area * 0.01
+            # full_screen_change = self.frame_diff.area * 0.5
+            minor_change_threshold = self.frame_diff.area * 0.0001
+            mouse_change_threshold = min(self.frame_diff.area * 0.009 * self.stride, significant_change_threshold)
 
-            contours, _ = cv2.findContours(thresh_diff, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            significant_change_detected = any(cv2.contourArea(contour) > self.min_area for contour in contours)
 
 
 
@@ -150,6 +167,9 @@ class detection:
                 stage = 'idle'
 
             if not popUp:
+                # region analysis only when the pixel count alone could raise or clear a popup
+                significant_change_detected = nonzero_pixels > significant_change_threshold and \
+                    self.frame_diff.significant_change(self.min_area)
                 if self.popup_visible == False:
                     popUp = self.alarm(nonzero_pixels, significant_change_detected, significant_change_threshold)
                 else:
@@ -157,7 +177,7 @@ class detection:
 
             if popUp:
                 if stage == 'idle':
-                    alertTime = dt.datetime.now()
+                    alertTime = self.cap.timestamp
                     stage = 'preAlert'
                 elif stage == 'preAlert':
                     interaction = self.alarm_reset(nonzero_pixels, minor_change_threshold, mouse_change_threshold)
@@ -166,9 +186,8 @@ class detection:
                         print("interaction detected")
                         stage = 'reset'
                     else:
-                        _now = dt.datetime.now()
-                        _diff = _now - alertTime
-                        if _diff.total_seconds() > self.frame_threshold:
+                        # video time, so strided and faster than real time runs alert at the right frame
+                        if self.cap.timestamp - alertTime > self.frame_threshold:
                             stage = 'alert'
                         # elif _diff.total_seconds() > 3:
                         #     stage = 'reset'
@@ -182,7 +201,12 @@ class detection:
                 self.text_color = (0, 255, 0)
 
 
-            thresh_diff_bgr = cv2.cvtColor(thresh_diff, cv2.COLOR_GRAY2BGR)
+            thresh_diff_bgr = cv2.cvtColor(self.frame_diff.mask, cv2.COLOR_GRAY2BGR)
+            # the mask is at analysis scale, shown at the size of the frame
+            if thresh_diff_bgr.shape[:2] != current_frame.shape[:2]:
+                thresh_diff_bgr = cv2.resize(thresh_diff_bgr, (current_frame.shape[1], current_frame.shape[0]),
+                    interpolation=cv2.INTER_NEAREST)
+            if current_frame.ndim == 2: current_frame = cv2.cvtColor(current_frame, cv2.COLOR_GRAY2BGR)
             cv2.putText(current_frame, self.display_text, (400, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, self.text_color, 2)
             # cv2.putText(current_frame, frame_time_text, (800, 70), cv2.FONT_HERSHEY_SIMPLEX, 1.8, (255, 165, 0), 2)
             concatenated_frame = cv2.hconcat([current_frame, thresh_diff_bgr])
@@ -190,8 +214,6 @@ class detection:
             # Show the frame
             cv2.imshow('Original and Significant Changes', concatenated_frame)
 
-            self.prev_frame_gray = current_frame_gray
-
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 break
 
@@ -232,7 +254,10 @@ if __name__ == "__main__":
 #     # change_detection(type_2) #Type 2
 #     # change_detection(type_3_1) #type 3
 #     # change_detection(type_3_3) #type 3
-    detection_instance = detection(vid_1)
+    parser = ArgumentParser()
+    parser.add_argument("source", type=str, help="video file, camera device, screenshot directory or 'synthetic'")
+    args = parser.parse_args()
+    detection_instance = detection(args.source)
     detection_instance.main()
 
 
@@ -0,0 +1,139 @@
+'''
+frame_cache.py
+Decoded-frame cache for repeated offline analysis.
+
+Recordings are decoded once to (optionally downscaled) grayscale frames and
+stored as headerless raw files, keyed by a hash of the video content and
+the scale. Later runs open them as RawMemmapSource and read zero-copy views
+instead of decoding again. The cache has a size cap, the least recently
+used recordings are evicted first.
+'''
+import os
+import cv2
+import json
+import time
+import hashlib
+import logging
+
+from frame_source import open_source, RawMemmapSource
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'testerDetection', 'frames')
+
+
+def content_key(path, chunk=1 << 20):
+    ''' hash of file size and sampled chunks (start, middle, end) of %path '''
+    _size = os.path.getsize(path)
+    h = hashlib.sha1(str(_size).encode())
+    with open(path, 'rb') as f:
+        for pos in (0, max(0, _size // 2 - chunk // 2), max(0, _size - chunk)):
+            f.seek(pos)
+            h.update(f.read(chunk))
+    return h.hexdigest()[:20]
+
+
+class FrameCache(object):
+    ''' memory-mapped grayscale frame cache with LRU eviction
+
+        path: cache directory
+        max_bytes: size cap of all cached frames
+    '''
+    def __init__(self, path=DEFAULT_DIR, max_bytes=50 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok=True)
+        self.index_file = os.path.join(self.path, 'index.json')
+
+    def _load_index(self):
+        try:
+            with open(self.index_file, 'rt') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, index):
+        _tmp = '{}.{}.tmp'.format(self.index_file, os.getpid())
+        with open(_tmp, 'wt') as f:
+            json.dump(index, f, indent=2)
+        os.replace(_tmp, self.index_file)
+
+    @staticmethod
+    def _entry_name(key, scale):
+        return '{}_{:g}'.format(key, scale)
+
+    def get(self, source, scale=1.0):
+        ''' return RawMemmapSource of cached frames of %source, None if not cached '''
+        index = self._load_index()
+        name = self._entry_name(content_key(source), scale)
+        entry = index.get(name, None)
+        if entry is None or not os.path.exists(os.path.join(self.path, entry['file'])):
+            return None
+        entry['last_used'] = time.time()
+        self._save_index(index)
+        return RawMemmapSource(os.path.join(self.path, entry['file']),
+            width=entry['width'], height=entry['height'], fps=entry['fps'])
+
+    def add(self, source, scale=1.0):
+        ''' decode %source to grayscale at %scale into the cache, return RawMemmapSource '''
+        name = self._entry_name(content_key(source), scale)
+        _file = name + '.gray'
+        _tmp = os.path.join(self.path, '{}.{}.tmp'.format(_file, os.getpid()))
+
+        _src = open_source(source, gray=True)
+        _size, _small, _shape, frames = None, None, None, 0
+        with open(_tmp, 'wb') as f:
+            while True:
+                ret, frame = _src.read()
+                if not ret:
+                    break
+                if scale != 1.0:
+                    if _size is None:
+                        _size = (max(1, int(round(frame.shape[1] * scale))), max(1, int(round(frame.shape[0] * scale))))
+                    _small = cv2.resize(frame, _size, dst=_small, interpolation=cv2.INTER_AREA)
+                    frame = _small
+                f.write(frame.data)
+                _shape = frame.shape
+                frames += 1
+        _fps = _src.fps
+        _src.release()
+        if not frames:
+            os.remove(_tmp)
+            return None
+        os.replace(_tmp, os.path.join(self.path, _file))
+
+        index = self._load_index()
+        index[name] = {
+            'file': _file,
+            'source': str(source),
+            'scale': scale,
+            'width': _shape[1],
+            'height': _shape[0],
+            'frames': frames,
+            'fps': _fps,
+            'bytes': _shape[0] * _shape[1] * frames,
+            'last_used': time.time(),
+        }
+        self._evict(index, keep=name)
+        self._save_index(index)
+        logging.debug('Cached {} frames of {} at scale {} as {}'.format(frames, source, scale, _file))
+        return RawMemmapSource(os.path.join(self.path, _file), width=_shape[1], height=_shape[0], fps=_fps)
+
+    def _evict(self, index, keep=None):
+        ''' drop least recently used entries until the cache fits max_bytes '''
+        _total = sum(e['bytes'] for e in index.values())
+        for name, entry in sorted(index.items(), key=lambda x: x[1]['last_used']):
+            if _total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.path, entry['file']))
+            except OSError:
+                pass
+            _total -= entry['bytes']
+            del index[name]
+            logging.debug('Evicted {} from frame cache'.format(entry['source']))
+
+    def open(self, source, scale=1.0):
+        ''' cached frames of %source, decoding them first if needed '''
+        _src = self.get(source, scale)
+        return _src if _src is not None else self.add(source, scale)
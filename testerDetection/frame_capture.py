@@ -0,0 +1,200 @@
+'''
+frame_capture.py
+Capture thread writing into a small preallocated ring buffer where the
+newest frame wins. Analysis always takes the freshest frame, so when it runs
+slower than the camera, old frames are dropped instead of queueing up in the
+driver. Files and generated sources are paced to their timestamps so they
+play like a camera.
+'''
+import time
+import logging
+import threading
+
+
+class FrameRing(object):
+    ''' preallocated ring of frame slots, newest frame wins
+
+        One slot is held by the reader, one holds the latest frame and the
+        writer fills any other slot, so reader and writer never block each other.
+    '''
+    def __init__(self, size=3):
+        self.size = max(3, size)
+        self.slots = [None] * self.size
+        self.seqs = [0] * self.size
+        self.stamps = [0.0] * self.size
+        self.ptss = [0.0] * self.size
+
+        self.cond = threading.Condition()
+        self.latest = -1
+        self.held = -1
+        self.writing = -1
+        self.seq = 0
+        self.read_seq = 0
+        self.dropped = 0
+        self.pts = None
+        self.closed = False
+
+    def acquire(self):
+        ''' return (index, buffer) of a free slot for the writer '''
+        with self.cond:
+            idx = (self.latest + 1) % self.size
+            while idx in (self.latest, self.held):
+                idx = (idx + 1) % self.size
+            self.writing = idx
+            return idx, self.slots[idx]
+
+    def commit(self, idx, frame, stamp, pts=None):
+        ''' publish slot %idx as the latest frame
+            stamp: capture time (time.monotonic), pts: source timestamp of the frame
+        '''
+        with self.cond:
+            self.seq += 1
+            self.slots[idx] = frame
+            self.seqs[idx] = self.seq
+            self.stamps[idx] = stamp
+            self.ptss[idx] = stamp if pts is None else pts
+            self.latest = idx
+            self.writing = -1
+            self.cond.notify_all()
+
+    def get(self, timeout=1.0):
+        ''' check out the freshest unread frame, releasing the previous one
+            return (frame, capture timestamp, frames skipped since last read),
+            frame is None on timeout or when the ring is closed,
+            the source timestamp of the frame is kept in %pts
+        '''
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.seq > self.read_seq or self.closed, timeout):
+                return None, None, 0
+            if self.seq <= self.read_seq:
+                return None, None, 0
+            idx = self.latest
+            skipped = self.seqs[idx] - self.read_seq - 1 if self.read_seq else 0
+            self.dropped += skipped
+            self.read_seq = self.seqs[idx]
+            self.held = idx
+            self.pts = self.ptss[idx]
+            return self.slots[idx], self.stamps[idx], skipped
+
+    def close(self):
+        ''' wake up readers waiting for frames '''
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class CaptureThread(object):
+    ''' read frames from %cap (any object with VideoCapture style read()) into a FrameRing
+
+        pace: commit frames at the rate of their source timestamps, default
+              for sources that are not live (FrameSource.live)
+    '''
+    def __init__(self, cap, size=3, retry=30, pace=None):
+        self.cap = cap
+        self.ring = FrameRing(size)
+        self.retry = retry
+        self.pace = not getattr(cap, 'live', True) if pace is None else pace
+        self.captured = 0
+        self.eos = False
+        self.th_quit = threading.Event()
+        self.th = None
+
+    def start(self):
+        ''' start capture thread '''
+        self.th_quit.clear()
+        self.th = threading.Thread(target=self._capture, daemon=True)
+        self.th.start()
+        return self
+
+    def is_alive(self):
+        return self.th is not None and self.th.is_alive()
+
+    def _capture(self):
+        ''' capture thread '''
+        _fail = 0
+        _start = None
+        while not self.th_quit.is_set():
+            idx, buf = self.ring.acquire()
+            ret, frame = self.cap.read(buf)
+            if not ret:
+                # live devices occasionally fail a read, files end
+                _fail += 1
+                if _fail > self.retry:
+                    self.eos = True
+                    break
+                time.sleep(0.01)
+                continue
+            _fail = 0
+            _pts = getattr(self.cap, 'timestamp', None)
+            if self.pace and _pts is not None:
+                # wait until the source time of the frame has passed since the first frame
+                if _start is None:
+                    _start = (time.monotonic(), _pts)
+                _wait = _start[0] + _pts - _start[1] - time.monotonic()
+                if _wait > 0 and self.th_quit.wait(_wait):
+                    break
+            self.ring.commit(idx, frame, time.monotonic(), _pts)
+            self.captured += 1
+        self.ring.close()
+        logging.debug('Capture thread stopped after {} frames'.format(self.captured))
+
+    def read(self, timeout=1.0):
+        ''' return (frame, capture timestamp, skipped frames) of the freshest frame '''
+        return self.ring.get(timeout)
+
+    @property
+    def dropped(self):
+        return self.ring.dropped
+
+    @property
+    def pts(self):
+        ''' source timestamp of the last read frame '''
+        return self.ring.pts
+
+    def release(self):
+        ''' stop capture thread and release the capture device '''
+        self.th_quit.set()
+        if self.th is not None:
+            self.th.join(2)
+        self.ring.close()
+        self.cap.release()
+
+
+class SyncCapture(object):
+    ''' CaptureThread replacement reading frames synchronously on demand
+
+        Used for replays: every frame of the source is analysed, as fast as
+        the analysis runs, and nothing is dropped.
+    '''
+    def __init__(self, cap):
+        self.cap = cap
+        self.captured = 0
+        self.eos = False
+        self.pts = None
+        self.dropped = 0
+        self._bufs = [None, None]
+
+    def start(self):
+        return self
+
+    def is_alive(self):
+        return not self.eos
+
+    def read(self, timeout=None):
+        ''' return (frame, read timestamp, 0) of the next frame, frame is None at the end '''
+        if self.eos:
+            return None, None, 0
+        _idx = self.captured % 2
+        ret, frame = self.cap.read(self._bufs[_idx])
+        if not ret:
+            self.eos = True
+            return None, None, 0
+        self._bufs[_idx] = frame
+        self.captured += 1
+        _stamp = time.monotonic()
+        self.pts = getattr(self.cap, 'timestamp', _stamp)
+        return frame, _stamp, 0
+
+    def release(self):
+        self.eos = True
+        self.cap.release()
@@ -0,0 +1,497 @@
+'''
+frame_diff.py
+Reusable frame-difference engine shared by the detection scripts.
+
+The engine owns double-buffered gray planes and preallocated diff and mask
+buffers. OpenCV writes into them through dst= outputs and the gray planes
+are swapped by reference, so the per-frame hot loop does not allocate.
+
+An optional region of interest and exclusion rectangles restrict the work
+to the included pixels, excluded pixels are never converted, diffed or
+contoured and stay zero in every buffer.
+
+An optional StageTimer (stage_timer.py) set as `timer` splits the work into
+'convert' and 'diff' stages ('tiles' for the tile grid of TiledFrameDiff).
+'''
+import cv2
+import numpy as np
+
+
+def split_regions(shape, roi=None, exclude=()):
+    ''' split region of interest minus exclusion rectangles into disjoint pixel rectangles
+        roi and exclude rectangles are (x0, y0, x1, y1) fractions of the frame size
+        return list of (x0, y0, x1, y1) pixel rectangles, None if the whole frame is included
+    '''
+    h, w = shape[:2]
+    def to_px(rect):
+        x0, y0, x1, y1 = rect
+        return (min(max(int(round(x0 * w)), 0), w), min(max(int(round(y0 * h)), 0), h),
+                min(max(int(round(x1 * w)), 0), w), min(max(int(round(y1 * h)), 0), h))
+
+    rx0, ry0, rx1, ry1 = to_px(roi) if roi else (0, 0, w, h)
+    _ex = []
+    for rect in exclude or ():
+        x0, y0, x1, y1 = to_px(rect)
+        x0, y0, x1, y1 = max(x0, rx0), max(y0, ry0), min(x1, rx1), min(y1, ry1)
+        if x1 > x0 and y1 > y0:
+            _ex.append((x0, y0, x1, y1))
+    if (rx0, ry0, rx1, ry1) == (0, 0, w, h) and not _ex:
+        return None
+
+    # horizontal bands between exclusion edges, included x-spans inside each band
+    ys = sorted({ry0, ry1, *[e[1] for e in _ex], *[e[3] for e in _ex]})
+    regions, _open = [], {}
+    for ya, yb in zip(ys, ys[1:]):
+        _spans, x = [], rx0
+        for ex0, ex1 in sorted((e[0], e[2]) for e in _ex if e[1] <= ya and e[3] >= yb):
+            if ex0 > x: _spans.append((x, ex0))
+            x = max(x, ex1)
+        if x < rx1: _spans.append((x, rx1))
+        _next = {}
+        for span in _spans:
+            # merge with the rectangle directly above when x-span is identical
+            idx = _open.get(span, None)
+            if idx is not None and regions[idx][3] == ya:
+                regions[idx] = (span[0], regions[idx][1], span[1], yb)
+            else:
+                idx = len(regions)
+                regions.append((span[0], ya, span[1], yb))
+            _next[span] = idx
+        _open = _next
+    return regions
+
+
+class FrameDiff(object):
+    ''' gray / absdiff / threshold engine with preallocated buffers
+
+        scale: analysis scale (e.g. 0.5, 0.25), frames are area-downsampled once
+        before conversion and all pixel results (area, nonzero, mask) are in
+        analysis pixels. significant_change() takes native pixel areas.
+    '''
+    def __init__(self, threshold, code=cv2.COLOR_BGR2GRAY, roi=None, exclude=None, scale=1.0):
+        self.threshold = threshold
+        self.code = code
+        self.roi = roi
+        self.exclude = exclude or []
+        self.scale = scale
+        self.frame_shape = None
+        self.shape = None
+        self.regions = None
+        self.area = 0
+        self._rects = None
+
+        # buffers, allocated on the first frame
+        self.small = None
+        self.gray = None
+        self.prev = None
+        self.diff = None
+        self.mask = None
+        self.labels = None
+
+        self.nonzero = 0
+        self.timer = None
+
+    def _alloc(self, frame_shape):
+        ''' allocate buffers for frames of %frame_shape '''
+        self.frame_shape = tuple(frame_shape[:2])
+        H, W = self.frame_shape
+        if self.scale == 1.0:
+            self.shape = self.frame_shape
+        else:
+            self.shape = (max(1, int(round(H * self.scale))), max(1, int(round(W * self.scale))))
+        h, w = self.shape
+
+        self.regions = split_regions(self.shape, self.roi, self.exclude)
+        self.area = h * w if self.regions is None else \
+            sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in self.regions)
+
+        # (native rect, analysis rect) pairs, None when the whole frame is used as is
+        self._rects = None
+        if self.regions is not None or self.shape != self.frame_shape:
+            self._rects = []
+            for x0, y0, x1, y1 in self.regions or [(0, 0, w, h)]:
+                native = (int(round(x0 * W / w)), int(round(y0 * H / h)),
+                          int(round(x1 * W / w)), int(round(y1 * H / h)))
+                self._rects.append((native, (x0, y0, x1, y1)))
+
+        self.small = np.zeros(self.shape + tuple(frame_shape[2:]), np.uint8) \
+            if self.shape != self.frame_shape and len(frame_shape) > 2 else None
+        self.gray = np.zeros(self.shape, np.uint8)
+        self.prev = np.zeros(self.shape, np.uint8)
+        self.diff = np.zeros(self.shape, np.uint8)
+        self.mask = np.zeros(self.shape, np.uint8)
+        self.labels = np.zeros(self.shape, np.int32)
+
+    def _to_gray(self, frame, dst, small=None):
+        ''' convert %frame into gray plane %dst, area-downsampling first when sizes differ '''
+        if frame.shape[:2] != dst.shape:
+            _size = (dst.shape[1], dst.shape[0])
+            if frame.ndim == 2:
+                cv2.resize(frame, _size, dst=dst, interpolation=cv2.INTER_AREA)
+                return
+            cv2.resize(frame, _size, dst=small, interpolation=cv2.INTER_AREA)
+            frame = small
+        if frame.ndim == 2:
+            np.copyto(dst, frame)
+        else:
+            cv2.cvtColor(frame, self.code, dst=dst)
+
+    @property
+    def frame_width(self):
+        return self.shape[1] if self.shape else None
+
+    @property
+    def frame_height(self):
+        return self.shape[0] if self.shape else None
+
+    def reset(self, frame):
+        ''' seed the previous gray plane with %frame '''
+        if self.frame_shape != tuple(frame.shape[:2]):
+            self._alloc(frame.shape)
+        if self._rects is None:
+            self._to_gray(frame, self.prev)
+        else:
+            for (nx0, ny0, nx1, ny1), (x0, y0, x1, y1) in self._rects:
+                self._to_gray(frame[ny0:ny1, nx0:nx1], self.prev[y0:y1, x0:x1],
+                    self.small[y0:y1, x0:x1] if self.small is not None else None)
+        self.nonzero = 0
+
+    def compare(self, frame):
+        ''' diff %frame against the previous gray plane, return number of changed pixels
+            the previous plane is kept until advance() is called
+        '''
+        if self.frame_shape != tuple(frame.shape[:2]):
+            self.reset(frame)
+        if self._rects is None:
+            self.nonzero = self._compare_region(frame, self.gray, self.prev, self.diff, self.mask)
+            return self.nonzero
+        self.nonzero = 0
+        for (nx0, ny0, nx1, ny1), (x0, y0, x1, y1) in self._rects:
+            self.nonzero += self._compare_region(frame[ny0:ny1, nx0:nx1],
+                self.gray[y0:y1, x0:x1], self.prev[y0:y1, x0:x1],
+                self.diff[y0:y1, x0:x1], self.mask[y0:y1, x0:x1],
+                self.small[y0:y1, x0:x1] if self.small is not None else None)
+        return self.nonzero
+
+    def _compare_region(self, frame, gray, prev, diff, mask, small=None):
+        ''' gray / absdiff / threshold of one region into buffer views, return changed pixels '''
+        self._to_gray(frame, gray, small)
+        if self.timer is not None: self.timer.lap('convert')
+        cv2.absdiff(gray, prev, dst=diff)
+        cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY, dst=mask)
+        nonzero = cv2.countNonZero(mask)
+        if self.timer is not None: self.timer.lap('diff')
+        return nonzero
+
+    def advance(self):
+        ''' make the current gray plane the previous one (swap by reference) '''
+        self.prev, self.gray = self.gray, self.prev
+
+    def update(self, frame):
+        ''' compare() followed by advance(), return number of changed pixels '''
+        nonzero = self.compare(frame)
+        self.advance()
+        return nonzero
+
+    def contours(self):
+        ''' return external contours of the threshold mask '''
+        contours, _ = cv2.findContours(self.mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return contours
+
+    def bbox(self):
+        ''' bounding box (x, y, w, h) of the changed pixels '''
+        return cv2.boundingRect(self.mask)
+
+    def blob_stats(self):
+        ''' (x, y, w, h, area) rows of the connected changed regions in analysis pixels
+            a single connected-components pass over the bounding box of the changed pixels
+        '''
+        if not self.nonzero:
+            return np.zeros((0, 5), np.int32)
+        x, y, w, h = self.bbox()
+        _, _, stats, _ = cv2.connectedComponentsWithStats(
+            self.mask[y:y + h, x:x + w], labels=self.labels[:h, :w], connectivity=8)
+        stats = stats[1:]
+        stats[:, cv2.CC_STAT_LEFT] += x
+        stats[:, cv2.CC_STAT_TOP] += y
+        return stats
+
+    def blob_areas(self, stats=None):
+        ''' pixel areas of the connected changed regions
+            stats: blob_stats() of this diff if computed already
+        '''
+        return (self.blob_stats() if stats is None else stats)[:, cv2.CC_STAT_AREA]
+
+    def significant_change(self, min_area, stats=None):
+        ''' True if any changed region is larger than %min_area (native frame pixels)
+            stats: blob_stats() of this diff if computed already
+        '''
+        min_area = min_area * self.scale * self.scale
+        if self.nonzero <= min_area:
+            # no region can be larger than all changed pixels together
+            return False
+        return bool((self.blob_areas(stats) > min_area).any())
+
+
+class TiledFrameDiff(FrameDiff):
+    ''' coarse-to-fine frame difference
+
+        The analysis-size gray plane is diffed against the previous one and the
+        absolute difference is reduced to a tile grid by successive 2x2 max
+        pooling. A tile changed if any of its pixels changed by more than the
+        threshold, so a cursor moving inside a tile is never averaged away and
+        the changed pixel count is exactly the one of FrameDiff. Threshold,
+        count and the mask (and with it the region analysis, which is limited to
+        the bounding box of the mask) are only written inside the changed tiles,
+        so that work scales with the size of the change.
+
+        tile: tile size in analysis pixels (power of two)
+    '''
+    def __init__(self, threshold, tile=8, **kw):
+        FrameDiff.__init__(self, threshold, **kw)
+        self.tile = 2 ** max(1, int(round(np.log2(max(2, tile)))))
+        self.changed_tiles = 0
+        self._done = []
+
+    def _alloc(self, frame_shape):
+        ''' allocate analysis-size and tile grid buffers '''
+        FrameDiff._alloc(self, frame_shape)
+        h, w = self.shape
+        t = self.tile
+        self.grid = (-(-h // t), -(-w // t))
+        # the diff is padded to whole tiles, the padding stays zero
+        self._diff_pad = np.zeros((self.grid[0] * t, self.grid[1] * t), np.uint8)
+        self.diff = self._diff_pad[:h, :w]
+        # (row pooled, fully pooled) buffers per 2x2 level
+        self._pool = []
+        while t > 1:
+            self._pool.append((np.zeros((self.grid[0] * t // 2, self.grid[1] * t), np.uint8),
+                np.zeros((self.grid[0] * t // 2, self.grid[1] * t // 2), np.uint8)))
+            t //= 2
+        self.tiles = np.zeros(self.grid, np.uint8)
+
+    def _tile_rects(self):
+        ''' disjoint pixel rectangles covering the changed tiles (runs merged vertically) '''
+        h, w = self.shape
+        c = self.tile
+        rects, _open = [], {}
+        for ty in np.flatnonzero(self.tiles.any(axis=1)):
+            y0, y1 = int(ty * c), min(int((ty + 1) * c), h)
+            row = np.concatenate(([0], self.tiles[ty] > 0, [0])).astype(np.int8)
+            edges = np.flatnonzero(np.diff(row))
+            _next = {}
+            for tx0, tx1 in zip(edges[::2], edges[1::2]):
+                idx = _open.get((tx0, tx1), None)
+                if idx is not None and rects[idx][3] == y0:
+                    rects[idx] = rects[idx][:3] + (y1,)
+                else:
+                    idx = len(rects)
+                    rects.append((int(tx0 * c), y0, min(int(tx1 * c), w), y1))
+                _next[(tx0, tx1)] = idx
+            _open = _next
+        return rects
+
+    def _max_pool(self):
+        ''' tile maxima of the diff by successive 2x2 max pooling into the last pool level '''
+        src = self._diff_pad
+        for rows, dst in self._pool:
+            np.maximum(src[0::2], src[1::2], out=rows)
+            np.maximum(rows[:, 0::2], rows[:, 1::2], out=dst)
+            src = dst
+        return src
+
+    def reset(self, frame):
+        ''' seed the previous gray plane with %frame '''
+        FrameDiff.reset(self, frame)
+        self.mask[:] = 0
+        self.changed_tiles = 0
+        self._done = []
+
+    def compare(self, frame):
+        ''' diff the analysis-size planes, threshold and count inside the changed tiles only
+            return number of changed pixels
+        '''
+        if self.frame_shape != tuple(frame.shape[:2]):
+            self.reset(frame)
+        for x0, y0, x1, y1 in self._done:
+            self.mask[y0:y1, x0:x1] = 0
+        self._done = []
+        self.nonzero = 0
+
+        if self._rects is None:
+            self._to_gray(frame, self.gray)
+        else:
+            # pixels outside the regions stay zero in both planes
+            for (nx0, ny0, nx1, ny1), (x0, y0, x1, y1) in self._rects:
+                self._to_gray(frame[ny0:ny1, nx0:nx1], self.gray[y0:y1, x0:x1],
+                    self.small[y0:y1, x0:x1] if self.small is not None else None)
+        if self.timer is not None: self.timer.lap('convert')
+        cv2.absdiff(self.gray, self.prev, dst=self.diff)
+        cv2.threshold(self._max_pool(), self.threshold, 255, cv2.THRESH_BINARY, dst=self.tiles)
+        self.changed_tiles = cv2.countNonZero(self.tiles)
+        if self.timer is not None: self.timer.lap('tiles')
+        if not self.changed_tiles:
+            return 0
+
+        for x0, y0, x1, y1 in self._tile_rects():
+            cv2.threshold(self.diff[y0:y1, x0:x1], self.threshold, 255, cv2.THRESH_BINARY, dst=self.mask[y0:y1, x0:x1])
+            self.nonzero += cv2.countNonZero(self.mask[y0:y1, x0:x1])
+            self._done.append((x0, y0, x1, y1))
+        if self.timer is not None: self.timer.lap('diff')
+        return self.nonzero
+
+
+class BatchFrameDiff(object):
+    ''' frame difference of several same-resolution cameras in one pass
+
+        The gray planes of all cameras are stacked into contiguous (N, H, W)
+        arrays. After the per-camera conversion, absdiff, threshold, the
+        roi / exclude masking and the changed pixel count of every camera run
+        once over the whole stack (the count as a single row-sum reduce).
+
+        Each slot is attached to the FrameDiff of a camera, whose buffers are
+        rebound to views of the stack, so region analysis (bbox, blob_areas,
+        significant_change) of each camera keeps working on its own slot. The
+        threshold mask holds 1 instead of 255 for changed pixels.
+
+        slots: maximum number of cameras
+    '''
+    def __init__(self, slots):
+        self.slots = slots
+        self.engines = [None] * slots
+        self.shape = None
+        self.gray = None
+        self.prev = None
+        self.diff = None
+        self.mask = None
+        self.include = None
+        self.masked = False
+        self.counts = np.zeros((slots, 1), np.int32)
+        self.timer = None
+
+    def _alloc(self, shape):
+        ''' allocate stacked planes for analysis frames of %shape '''
+        self.shape = tuple(shape)
+        _stack = (self.slots,) + self.shape
+        self.gray = np.zeros(_stack, np.uint8)
+        self.prev = np.zeros(_stack, np.uint8)
+        self.diff = np.zeros(_stack, np.uint8)
+        self.mask = np.zeros(_stack, np.uint8)
+        self.include = np.zeros(_stack, np.uint8)
+
+    @staticmethod
+    def _flat(stack):
+        ''' (N, H, W) stack as (N * H, W) view for OpenCV '''
+        return stack.reshape(-1, stack.shape[-1])
+
+    def attach(self, slot, engine, frame):
+        ''' attach FrameDiff %engine to %slot, seeded with %frame
+            all engines must analyse frames of the same size
+        '''
+        engine.reset(frame)
+        if self.shape is None:
+            self._alloc(engine.shape)
+        elif engine.shape != self.shape:
+            raise ValueError('Analysis size {} differs from the batch size {}'.format(engine.shape, self.shape))
+        np.copyto(self.prev[slot], engine.prev)
+        self.include[slot] = 0
+        for x0, y0, x1, y1 in engine.regions or [(0, 0, self.shape[1], self.shape[0])]:
+            self.include[slot, y0:y1, x0:x1] = 255
+        # the include pass is only needed while a camera has excluded pixels
+        self.masked = self.masked or engine.regions is not None
+        engine.gray, engine.prev = self.gray[slot], self.prev[slot]
+        engine.diff, engine.mask = self.diff[slot], self.mask[slot]
+        self.engines[slot] = engine
+
+    def detach(self, slot):
+        ''' free %slot, the engine gets private copies of its planes back '''
+        engine = self.engines[slot]
+        if engine is not None:
+            engine.gray, engine.prev = engine.gray.copy(), engine.prev.copy()
+            engine.diff, engine.mask = engine.diff.copy(), engine.mask.copy()
+        self.engines[slot] = None
+
+    def update(self, frames):
+        ''' diff frames (one per slot, None for slots without a new frame) against the
+            previous planes and advance, return changed pixel counts per slot
+        '''
+        for i, (engine, frame) in enumerate(zip(self.engines, frames)):
+            if engine is None or frame is None:
+                # no new frame: the slot diffs to nothing
+                np.copyto(self.gray[i], self.prev[i])
+            elif frame.shape[:2] == engine.shape and (frame.ndim == 2 or engine.small is None):
+                engine._to_gray(frame, self.gray[i])
+            else:
+                engine._to_gray(frame, self.gray[i], engine.small)
+        if self.timer is not None: self.timer.lap('convert')
+
+        _diff = self._flat(self.diff)
+        cv2.absdiff(self._flat(self.gray), self._flat(self.prev), dst=_diff)
+        _thr = [e.threshold for e in self.engines if e is not None]
+        if _thr and all(t == _thr[0] for t in _thr):
+            cv2.threshold(_diff, _thr[0], 1, cv2.THRESH_BINARY, dst=self._flat(self.mask))
+        else:
+            for i, e in enumerate(self.engines):
+                cv2.threshold(self.diff[i], e.threshold if e is not None else 255, 1, cv2.THRESH_BINARY, dst=self.mask[i])
+        if self.masked:
+            cv2.bitwise_and(self._flat(self.mask), self._flat(self.include), dst=self._flat(self.mask))
+        cv2.reduce(self.mask.reshape(self.slots, -1), 1, cv2.REDUCE_SUM, dst=self.counts, dtype=cv2.CV_32S)
+        if self.timer is not None: self.timer.lap('diff')
+
+        self.gray, self.prev = self.prev, self.gray
+        for i, engine in enumerate(self.engines):
+            if engine is not None:
+                engine.nonzero = int(self.counts[i, 0])
+                engine.gray, engine.prev = self.gray[i], self.prev[i]
+        return self.counts[:, 0]
+
+
+class FrameFingerprint(object):
+    ''' cheap fingerprint of a frame for the static-frame fast path
+
+        The fingerprint is the row and column mean profile of the frame (two
+        cv2.reduce passes, about half the cost of FrameDiff.update). match()
+        is True when no profile value differs from the reference by more than
+        %tolerance gray levels. The reference only moves on frames that do not
+        match, i.e. frames that go through the full pipeline, so slow drift
+        is still caught.
+    '''
+    def __init__(self, tolerance=0.5):
+        self.tolerance = tolerance
+        self.frame_shape = None
+        self.ref = None
+        self.cur = None
+
+    def _alloc(self, frame_shape):
+        ''' allocate profile buffers '''
+        self.frame_shape = tuple(frame_shape)
+        _rows, _cols = frame_shape[0], int(np.prod(frame_shape[1:]))
+        self.cur = (np.zeros((_rows, 1), np.float32), np.zeros((1, _cols), np.float32))
+        self.ref = None
+        self._diff = (np.zeros((_rows, 1), np.float32), np.zeros((1, _cols), np.float32))
+
+    def _profile(self, frame, dst):
+        _view = frame.reshape(frame.shape[0], -1)
+        cv2.reduce(_view, 1, cv2.REDUCE_AVG, dst=dst[0], dtype=cv2.CV_32F)
+        cv2.reduce(_view, 0, cv2.REDUCE_AVG, dst=dst[1], dtype=cv2.CV_32F)
+
+    def match(self, frame):
+        ''' True if %frame matches the reference fingerprint within tolerance '''
+        if self.frame_shape != tuple(frame.shape):
+            self._alloc(frame.shape)
+        self._profile(frame, self.cur)
+        if self.ref is not None:
+            _match = True
+            for cur, ref, diff in zip(self.cur, self.ref, self._diff):
+                cv2.absdiff(cur, ref, dst=diff)
+                if cv2.minMaxLoc(diff)[1] > self.tolerance:
+                    _match = False
+                    break
+            if _match:
+                return True
+        self.ref, self.cur = self.cur, self.ref or tuple(np.zeros_like(p) for p in self.cur)
+        return False
+
+    def reset(self):
+        ''' forget the reference, the next frame is always analysed '''
+        self.ref = None
@@ -4,10 +4,13 @@ from argparse import ArgumentParser
 import pathlib
 import time
 
+from frame_diff import FrameDiff
+from frame_source import open_source
+from frame_cache import FrameCache
 
-def frame_difference2(filename):
-    # Open the video
-    cap = cv2.VideoCapture(filename)
+def frame_difference2(filename, gray=False, cache=None):
+    # Open the video, gray: analyse luminance only frames, cache: read decoded gray frames from this cache directory
+    cap = FrameCache(cache).open(filename) if cache else open_source(filename, gray=gray)
 
     # Determine the video's frame rate (FPS) and size for VideoWriter
     fps = cap.get(cv2.CAP_PROP_FPS)
@@ -29,7 +32,8 @@ def frame_difference2(filename):
 
     # Read the first frame
     ret, prev_frame = cap.read()
-    prev_frame_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY) if ret else None
+    engine = FrameDiff(50)
+    if ret: engine.reset(prev_frame)
 
     min_area = 5000
     current_state = 0
@@ -43,13 +47,14 @@ def frame_difference2(filename):
         if not ret:
             break  # Break the loop if there are no more frames
 
-        #finding absolute difference
-        current_frame_gray = cv2.cvtColor(current_frame, cv2.COLOR_BGR2GRAY)
-        frame_diff = cv2.absdiff(current_frame_gray, prev_frame_gray)
-        _, thresh_diff = cv2.threshold(frame_diff, 50, 255, cv2.THRESH_BINARY)
+        #finding absolute difference, previous frame only advances when nothing significant changed
+        nonzero_pixels = engine.compare(current_frame)
+
+        # draw on a BGR frame, gray frames (read-only memmap views with --cache) are converted first
+        if current_frame.ndim == 2: current_frame = cv2.cvtColor(current_frame, cv2.COLOR_GRAY2BGR)
 
         #contouring
-        contours, _ = cv2.findContours(thresh_diff, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours = engine.contours()
 
         # Process the frame
         significant_change_threshold = (frame_width * frame_height) * 0.001
@@ -62,8 +67,6 @@ def frame_difference2(filename):
                 # Draw the rectangle on the current frame to visualize the change
                 cv2.rectangle(current_frame, (x, y), (x + w, y + h), (0, 255, 0), 2)  # Green rectangle
 
-        nonzero_pixels = cv2.countNonZero(thresh_diff)
-
         # Determine state based on the frame difference
         if nonzero_pixels > significant_change_threshold and significant_change_detected:
             if current_state == 0:
@@ -71,7 +74,7 @@ def frame_difference2(filename):
             else:
                 current_state = 0
         else:
-            prev_frame_gray = current_frame_gray
+            engine.advance()
 
         if current_state == 1:
             display_text = 'State 3: Human Needed'
@@ -87,7 +90,7 @@ def frame_difference2(filename):
         #     text_color = (0, 0, 255)
 
         # Prepare the frame for display and output file
-        thresh_diff_bgr = cv2.cvtColor(thresh_diff, cv2.COLOR_GRAY2BGR)
+        thresh_diff_bgr = cv2.cvtColor(engine.mask, cv2.COLOR_GRAY2BGR)
         concatenated_frame = cv2.hconcat([current_frame, thresh_diff_bgr])
         cv2.putText(concatenated_frame, display_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, text_color, 2)
 
@@ -197,7 +200,12 @@ if __name__ == "__main__":
     #
     # args = parser.parse_args()
     # main(args)
-    frame_difference2('/Users/juneyoungseo/Documents/Panasonic/test videos/2023-12-26 10-36-47-ex2 SDU CT Tester.mp4')
+    parser = ArgumentParser()
+    parser.add_argument("source", type=str, help="video file, camera device, screenshot directory or 'synthetic'")
+    parser.add_argument("--gray", action='store_true')
+    parser.add_argument("--cache", type=str, default=None, help="decoded frame cache directory")
+    args = parser.parse_args()
+    frame_difference2(args.source, gray=args.gray, cache=args.cache)
 
 
 
@@ -0,0 +1,377 @@
+'''
+frame_source.py
+Frame sources for the detection scripts.
+
+All sources share the VideoCapture style interface (read(image), get(),
+set(), isOpened(), release()) so they can be used by CaptureThread and the
+offline scripts alike, and additionally expose the timestamp (seconds) of
+the last frame read. Backends:
+- DeviceSource: live V4L2 camera
+- FileSource: video file
+- ImageDirSource: directory of screenshots
+- RawMemmapSource: memory-mapped raw grayscale frames (.npy or headerless)
+- SyntheticSource: generated frames, no camera or file needed (tester-like
+  screens with ground truth from screen_synth.TesterScreen)
+
+open_source() picks the backend from the source string, so the same
+detection code runs live, on recordings or headless. With stride > 1 only
+every stride-th frame is delivered; skipped frames of video backends are
+only grabbed, never decoded or converted.
+
+In gray mode sources deliver single channel luminance frames with the least
+work the source allows. For V4L2 devices the pixel format is negotiated and
+- YUYV frames are read raw and only the Y plane is extracted
+- MJPEG frames are read as raw JPEG buffers and decoded straight to
+  (optionally reduced size) grayscale
+- anything else is decoded to BGR and converted
+'''
+import os
+import cv2
+import time
+import logging
+import numpy as np
+
+REDUCED_GRAYSCALE = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+IMAGE_EXT = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+def fourcc_str(value):
+    ''' decode CAP_PROP_FOURCC value to string '''
+    value = int(value)
+    return ''.join(chr((value >> 8 * i) & 0xFF) for i in range(4))
+
+
+def is_device(src):
+    ''' True if %src is a camera index or a V4L2 device path '''
+    return isinstance(src, int) or str(src).isdigit() or str(src).startswith('/dev/video')
+
+
+class FrameSource(object):
+    ''' base class of frame sources
+
+        Subclasses implement _read(image) returning the next frame (None at
+        the end) and set self.timestamp, width, height, fps and count. Live
+        sources deliver frames at their own rate, all others as fast as they
+        are read.
+    '''
+    def __init__(self, gray=False):
+        self.gray = gray
+        self.reduce = 1
+        self.stride = 1
+        self.timestamp = 0.0
+        self.index = -1
+        self.width = 0
+        self.height = 0
+        self.fps = 0.0
+        self.count = -1
+        self.opened = True
+        self.live = False
+
+    def isOpened(self):
+        return self.opened
+
+    def _read(self, image=None):
+        raise NotImplementedError
+
+    def _skip(self, n):
+        ''' skip %n frames without decoding them, False at the end of the source '''
+        self.index += n
+        return True
+
+    def read(self, image=None):
+        ''' read next frame (every stride-th frame), into %image when the backend can '''
+        if not self.opened:
+            return False, None
+        if self.stride > 1 and self.index >= 0 and not self._skip(self.stride - 1):
+            return False, None
+        frame = self._read(image)
+        if frame is None:
+            return False, None
+        self.index += 1
+        return True, frame
+
+    def seek(self, index):
+        ''' position the source so that the next read returns frame %index '''
+        self.index = index - 1
+
+    @property
+    def sample_fps(self):
+        ''' rate of the delivered frames '''
+        return self.fps / self.stride
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS: return self.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH: return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT: return self.height
+        if prop == cv2.CAP_PROP_FRAME_COUNT: return self.count
+        if prop == cv2.CAP_PROP_POS_FRAMES: return self.index + 1
+        if prop == cv2.CAP_PROP_POS_MSEC: return self.timestamp * 1000
+        return 0
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.seek(int(value))
+            return True
+        if prop == cv2.CAP_PROP_POS_MSEC and self.fps:
+            self.seek(int(round(value / 1000.0 * self.fps)))
+            return True
+        return False
+
+    def release(self):
+        self.opened = False
+
+    def __iter__(self):
+        ''' iterate over (frame, timestamp) '''
+        while True:
+            ret, frame = self.read()
+            if not ret:
+                break
+            yield frame, self.timestamp
+
+
+class VideoSource(FrameSource):
+    ''' cv2.VideoCapture backed source, base of DeviceSource and FileSource '''
+    def __init__(self, cap, gray=False):
+        FrameSource.__init__(self, gray=gray)
+        self.cap = cap
+        self.mode = 'bgr'
+        self.opened = cap.isOpened()
+        self._raw = None
+        self._update_props()
+
+    def _update_props(self):
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value)
+
+    def seek(self, index):
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        self.index = index - 1
+
+    def _stamp(self):
+        self.timestamp = time.monotonic()
+
+    def _skip(self, n):
+        for _ in range(n):
+            if not self.cap.grab():
+                return False
+            self.index += 1
+        return True
+
+    def _read(self, image=None):
+        if not self.gray:
+            ret, image = self.cap.read(image)
+            if not ret:
+                return None
+            self._stamp()
+            return image
+
+        ret, self._raw = self.cap.read(self._raw)
+        if not ret:
+            return None
+        self._stamp()
+        if self.mode == 'yuyv' and self._raw.ndim == 3 and self._raw.shape[2] == 2:
+            # Y plane is channel 0 of the interleaved YUYV buffer
+            image = cv2.extractChannel(self._raw, 0, dst=image)
+        elif self.mode == 'mjpeg' and (self._raw.ndim == 1 or self._raw.shape[0] == 1):
+            image = cv2.imdecode(self._raw, REDUCED_GRAYSCALE[self.reduce])
+        elif self._raw.ndim == 3:
+            image = cv2.cvtColor(self._raw, cv2.COLOR_BGR2GRAY, dst=image)
+        else:
+            # backend already delivers gray frames, hand over the buffer
+            image, self._raw = self._raw, None
+        return image
+
+    def release(self):
+        self.opened = False
+        self.cap.release()
+
+
+class DeviceSource(VideoSource):
+    ''' live V4L2 camera, timestamps are time.monotonic() at read
+
+        fourcc: pixel formats to negotiate in gray mode, in order of preference
+        reduce: decode MJPEG frames at 1/reduce size (1, 2, 4 or 8) in gray
+                mode, the reduction actually applied is available as %reduce
+    '''
+    def __init__(self, src, gray=False, fourcc=('YUYV', 'MJPG'), reduce=1, width=None, height=None):
+        src = int(src) if str(src).isdigit() else src
+        _cap = cv2.VideoCapture(src, cv2.CAP_V4L2)
+        if width: _cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height: _cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        VideoSource.__init__(self, _cap, gray=gray)
+        self.live = True
+
+        if gray and self.opened:
+            for fmt in fourcc:
+                self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fmt))
+                _got = fourcc_str(self.cap.get(cv2.CAP_PROP_FOURCC))
+                if _got in ('YUYV', 'YUY2'):
+                    self.mode = 'yuyv'
+                elif _got == 'MJPG':
+                    self.mode = 'mjpeg'
+                    self.reduce = reduce if reduce in REDUCED_GRAYSCALE else 1
+                else:
+                    continue
+                # deliver the raw buffers, conversion is done here
+                self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+                break
+            self._update_props()
+        logging.debug('Device {} opened in {} mode, reduce {}'.format(src, self.mode, self.reduce))
+
+
+class FileSource(VideoSource):
+    ''' video file or network stream, timestamps are the frame positions in the video '''
+    def __init__(self, path, gray=False):
+        VideoSource.__init__(self, cv2.VideoCapture(str(path)), gray=gray)
+        self.live = '://' in str(path)
+
+    def _stamp(self):
+        self.timestamp = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+
+
+class ImageDirSource(FrameSource):
+    ''' directory of screenshots read in file name order at %fps '''
+    def __init__(self, path, gray=False, fps=1.0, loop=False):
+        FrameSource.__init__(self, gray=gray)
+        self.files = sorted(
+            os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(IMAGE_EXT)
+        )
+        self.fps = fps
+        self.loop = loop
+        self.count = len(self.files)
+        self.opened = self.count > 0
+        if self.opened:
+            _first = cv2.imread(self.files[0], cv2.IMREAD_UNCHANGED)
+            self.height, self.width = _first.shape[:2]
+
+    def _read(self, image=None):
+        _idx = self.index + 1
+        if _idx >= self.count:
+            if not self.loop:
+                return None
+            _idx = _idx % self.count
+        self.timestamp = (self.index + 1) / self.fps
+        return cv2.imread(self.files[_idx], cv2.IMREAD_GRAYSCALE if self.gray else cv2.IMREAD_COLOR)
+
+
+class RawMemmapSource(FrameSource):
+    ''' memory-mapped raw grayscale frames, read() returns read-only views (zero-copy)
+
+        path: .npy file of shape (N, H, W) uint8, or headerless file of
+              frames with the given %width and %height
+    '''
+    def __init__(self, path, width=None, height=None, fps=30.0, gray=True):
+        FrameSource.__init__(self, gray=True)
+        if str(path).endswith('.npy'):
+            self.frames = np.load(path, mmap_mode='r')
+        else:
+            _size = os.path.getsize(path) // (width * height)
+            self.frames = np.memmap(path, dtype=np.uint8, mode='r', shape=(_size, height, width))
+        self.count, self.height, self.width = self.frames.shape[:3]
+        self.fps = fps
+        self.opened = self.count > 0
+        if not gray:
+            logging.debug('Raw memmap source {} only delivers gray frames'.format(path))
+
+    def _read(self, image=None):
+        _idx = self.index + 1
+        if _idx >= self.count:
+            return None
+        self.timestamp = _idx / self.fps
+        return self.frames[_idx]
+
+    def release(self):
+        self.opened = False
+        self.frames = None
+
+
+class SyntheticSource(FrameSource):
+    ''' generated frames for headless runs
+
+        generator: callable(index, image) drawing frame %index into %image
+                   (H, W, 3) uint8 and returning it, default draws a plain
+                   screen with a moving cursor and a popup every %popup_every frames
+    '''
+    def __init__(self, width=1280, height=720, fps=30.0, count=-1, gray=False, generator=None, popup_every=300):
+        FrameSource.__init__(self, gray=gray)
+        self.width, self.height = width, height
+        self.fps = fps
+        self.count = count
+        self.generator = generator if generator is not None else self._default_frame
+        self.popup_every = popup_every
+        self._bgr = np.zeros((height, width, 3), np.uint8)
+
+    def _default_frame(self, index, image):
+        image[:] = (60, 60, 60)
+        _w, _h = self.width, self.height
+        if self.popup_every and index % self.popup_every >= self.popup_every // 2:
+            cv2.rectangle(image, (_w // 4, _h // 4), (3 * _w // 4, 3 * _h // 4), (200, 120, 40), -1)
+        _x = int((index * 7) % (_w - 20))
+        _y = int((index * 3) % (_h - 20))
+        cv2.rectangle(image, (_x, _y), (_x + 12, _y + 19), (255, 255, 255), -1)
+        return image
+
+    def _read(self, image=None):
+        _idx = self.index + 1
+        if 0 <= self.count <= _idx:
+            return None
+        self.timestamp = _idx / self.fps
+        if not self.gray:
+            if image is None or image.shape != self._bgr.shape:
+                image = np.empty_like(self._bgr)
+            return self.generator(_idx, image)
+        _frame = self.generator(_idx, self._bgr)
+        return cv2.cvtColor(_frame, cv2.COLOR_BGR2GRAY, dst=image)
+
+
+def open_source(src, gray=False, reduce=1, stride=1, **kw):
+    ''' open frame source from %src
+        FrameSource instance: returned as is
+        camera index or /dev/video*: DeviceSource
+        directory: ImageDirSource
+        .npy / .raw / .gray file: RawMemmapSource (width=, height= for headerless files)
+        'synthetic' or 'synthetic:WxH': SyntheticSource
+        'tester:T' or 'tester:T:WxH': SyntheticSource of a screen_synth.TesterScreen of DET_TYPE T,
+                ending after the random popup schedule (duration=, default 600 seconds)
+        anything else: FileSource
+        gray: deliver grayscale frames
+        reduce: MJPEG decode reduction of gray device sources
+        stride: deliver every stride-th frame only
+    '''
+    if isinstance(src, FrameSource):
+        _src = src
+    elif is_device(src):
+        _src = DeviceSource(src, gray=gray, reduce=reduce, **kw)
+    elif str(src).startswith('synthetic'):
+        if ':' in str(src):
+            kw['width'], kw['height'] = (int(v) for v in str(src).split(':', 1)[1].split('x'))
+        _src = SyntheticSource(gray=gray, **kw)
+    elif str(src).startswith('tester:'):
+        from screen_synth import TesterScreen
+        _spec = str(src).split(':')
+        if len(_spec) > 2:
+            kw['width'], kw['height'] = (int(v) for v in _spec[2].split('x'))
+        _screen = TesterScreen(int(_spec[1]), **kw)
+        _src = _screen.source(_screen.duration, gray=gray)
+    elif os.path.isdir(str(src)):
+        _src = ImageDirSource(str(src), gray=gray, **kw)
+    elif str(src).endswith(('.npy', '.raw', '.gray')):
+        _src = RawMemmapSource(str(src), **kw)
+    else:
+        _src = FileSource(str(src), gray=gray)
+    _src.stride = max(1, int(stride))
+    return _src
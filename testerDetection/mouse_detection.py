@@ -1,5 +1,9 @@
 import cv2
 import numpy as np
+import pathlib
+from argparse import ArgumentParser
+
+from frame_source import open_source
 
 imageCollection = ['neg_1.jpg', 'neg_2.jpg', 'neg_3.jpg', 'neg_4.jpg', 'neg_5.jpg',
                    'neg_6.jpg', 'neg_8.jpg', 'neg_9.jpg', 'neg_10.jpg',
@@ -10,13 +14,12 @@ imageCollection = ['neg_1.jpg', 'neg_2.jpg', 'neg_3.jpg', 'neg_4.jpg', 'neg_5.jp
 imageCollectionBonus = ['t2_1.jpg', 't2_2.jpg', 't2_3.jpg', 't2_4.jpg', 't2_5.jpg', 't2_6.jpg']
 
 threshold = 0.7
-videoPath = '/Users/juneyoungseo/Documents/Panasonic/test_videos/2023-12-26 10-36-47-ex2 SDU CT Tester.mp4'
 FOLDER_PATH_BONUS = 'input/bonus/'
 dDepth = cv2.CV_8U
 method = cv2.TM_CCORR_NORMED
 thresholdUpper = 255.0
 thresholdLower = 23
-templatePath = '/Users/juneyoungseo/PycharmProjects/pythonProject1/Mouse-Cursor-Detection/input/template.png'
+templatePath = str(pathlib.Path(__file__).parent.resolve() / 'template.png')
 
 
 def GetEdgesfromImage(imageName):
@@ -27,7 +30,7 @@ def GetEdgesfromImage(imageName):
     return imageName
 
 def processVideo(videoPath, templatePath):
-    cap = cv2.VideoCapture(videoPath)
+    cap = open_source(videoPath)
     originalTemplate = cv2.imread(templatePath, 0)
     originalTemplate = GetEdgesfromImage(originalTemplate)
 
@@ -64,8 +67,13 @@ def processVideo(videoPath, templatePath):
     cap.release()
     cv2.destroyAllWindows()
 
-# Call the function with your video and template paths
-processVideo(videoPath, templatePath)
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("source", type=str, help="video file, camera device, screenshot directory or 'synthetic'")
+    parser.add_argument("--template", type=str, default=templatePath)
+    args = parser.parse_args()
+    # Call the function with your video and template paths
+    processVideo(args.source, args.template)
 
 # def video_image(filename):
 #     cap = cv2.VideoCapture(filename)
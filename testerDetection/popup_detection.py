@@ -4,12 +4,80 @@ import os
 from argparse import ArgumentParser
 import pathlib
 
+from frame_source import open_source
+
+# blue HSV ranges of the tester UI bars (first) and of the popups (second)
+BLUE_FIRST = (np.array([50, 120, 50]), np.array([140, 255, 255]))
+BLUE_SECOND = (np.array([50, 100, 0]), np.array([140, 255, 255]))
+
+
+class ScreenLayout(object):
+    ''' cached tester screen layout (crop rows below the top and above the bottom blue bar)
+
+        The layout does not change during a test run. It is detected on the
+        first frame and again every %revalidate seconds, or at once when the
+        cached bottom bar is no longer blue (full-screen change), checked on
+        the bar rows only. Keep one instance per camera.
+
+        revalidate: seconds between full layout detections
+        min_cover: fraction of the cached bar that must still be blue
+    '''
+    def __init__(self, revalidate=30.0, min_cover=0.9):
+        self.revalidate = revalidate
+        self.min_cover = min_cover
+        self.crop = None
+        self.bar = None
+        self.last_bar = None
+        self.detected_at = None
+        self.detections = 0
+
+    def detect(self, hsv):
+        ''' find the blue bars spanning the full width in %hsv, return crop rows (top_y, bottom_y) '''
+        mask_first = cv2.inRange(hsv, *BLUE_FIRST)
+        contours_first, _ = cv2.findContours(mask_first, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        top_y = 0
+        bottom_y = hsv.shape[0]
+        self.bar = None
+
+        for contour in contours_first:
+            x, y, w, h = cv2.boundingRect(contour)
+            if w > hsv.shape[1] * 0.99:
+                if y < hsv.shape[0] // 2:
+                    # top_y = max(top_y, y + h)
+                    continue
+                elif y < bottom_y:
+                    bottom_y = y
+                    self.bar = self.last_bar = (y, h)
+
+        self.crop = (top_y, bottom_y)
+        self.detections += 1
+        return self.crop
+
+    def _blue(self, hsv, bar):
+        y, h = bar
+        band = hsv[y:y + h]
+        return cv2.countNonZero(cv2.inRange(band, *BLUE_FIRST)) >= self.min_cover * band.shape[0] * band.shape[1]
+
+    def valid(self, hsv):
+        ''' True while the cached bottom bar is still blue in %hsv, or a lost bar has not come back '''
+        if self.bar is not None:
+            return self._blue(hsv, self.bar)
+        return self.last_bar is None or not self._blue(hsv, self.last_bar)
+
+    def get(self, hsv, now):
+        ''' crop rows (top_y, bottom_y) for frame %hsv at %now seconds '''
+        if self.crop is None or now - self.detected_at >= self.revalidate or not self.valid(hsv):
+            self.detect(hsv)
+            self.detected_at = now
+        return self.crop
+
 #Step 1: Obtain frame data from the test videos
 
 #Capture Video and Read Img/Frames
 def Video_Read(video_path):
     #capture video
-    cap = cv2.VideoCapture(video_path)
+    cap = open_source(video_path)
 
     #while video is opened, capture the frame
     while cap.isOpened():
@@ -27,7 +95,7 @@ def Image_Read(image_path):
 #Step 2: Mask the images captured and Check Tester Screen
 def mask(video_path):
     # image = Image_Read(image_path)
-    cap = cv2.VideoCapture(video_path)
+    cap = open_source(video_path)
 
     while cap.isOpened():
         ret, frame = cap.read()
@@ -76,7 +144,7 @@ def mask(video_path):
 
 #Step 3: Contouring popup boxes
 def detect_and_draw_popups(video_path):
-    cap = cv2.VideoCapture(video_path)
+    cap = open_source(video_path)
 
 
     while True:
@@ -120,9 +188,12 @@ def detect_and_draw_popups(video_path):
 
 
 #Step 4: Total Code
-def mask_and_detect_popups(video_path, output_dir):
+def mask_and_detect_popups(video_path, output_dir, layout=None):
+    ''' layout: ScreenLayout of the camera, a new one if not given '''
+    layout = layout if layout is not None else ScreenLayout()
+
     #capture video
-    cap = cv2.VideoCapture(video_path)
+    cap = open_source(video_path)
 
     # Get the frames per second of the video
     fps = cap.get(cv2.CAP_PROP_FPS)
@@ -147,33 +218,15 @@ def mask_and_detect_popups(video_path, output_dir):
             frame_counter += 1
             timestamp = frame_counter / fps
 
-            # First masking operation based on one blue color range
+            # single HSV conversion serves the layout check and the popup mask
             hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-            lower_blue_first = np.array([50, 120, 50])
-            upper_blue_first = np.array([140, 255, 255])
-            mask_first = cv2.inRange(hsv, lower_blue_first, upper_blue_first)
-            contours_first, _ = cv2.findContours(mask_first, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-            top_y = 0
-            bottom_y = frame.shape[0]
-
-            for contour in contours_first:
-                x, y, w, h = cv2.boundingRect(contour)
-                if w > frame.shape[1] * 0.99:
-                    if y < frame.shape[0] // 2:
-                        # top_y = max(top_y, y + h)
-                        continue
-                    else:
-                        bottom_y = min(bottom_y, y)
+            top_y, bottom_y = layout.get(hsv, timestamp)
 
             if bottom_y > top_y:
                 cropped_image = frame[top_y:bottom_y, :]
 
                 # Second masking operation for detecting popups on the cropped frame
-                hsv_cropped = cv2.cvtColor(cropped_image, cv2.COLOR_BGR2HSV)
-                lower_blue_second = np.array([50, 100, 0])
-                upper_blue_second = np.array([140, 255, 255])
-                mask_second = cv2.inRange(hsv_cropped, lower_blue_second, upper_blue_second)
+                mask_second = cv2.inRange(hsv[top_y:bottom_y, :], *BLUE_SECOND)
                 contours_second, _ = cv2.findContours(mask_second, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
                 cnts = 0
@@ -231,12 +284,13 @@ def mask_and_detect_popups(video_path, output_dir):
 
 
 if __name__ == "__main__":
-    video_path = '/Users/juneyoungseo/Documents/Panasonic/test videos/2023-12-26 10-36-47-ex2 SDU CT Tester.mp4'
-    video_path2 = '/Users/juneyoungseo/Documents/Panasonic/test videos/2023-12-29 08-08-11 SDU CT Tester.mp4'
-    output_file = '/Users/juneyoungseo/Documents/Panasonic/output'
-    # mask('/Users/juneyoungseo/Documents/Panasonic/test videos/2023-12-26 10-36-47-ex2 SDU CT Tester.mp4')
-    # detect_and_draw_popups(video_path)
-    mask_and_detect_popups(video_path2, output_file)
+    parser = ArgumentParser()
+    parser.add_argument("source", type=str, help="video file, camera device, screenshot directory or 'synthetic'")
+    parser.add_argument("output_dir", type=str)
+    args = parser.parse_args()
+    # mask(args.source)
+    # detect_and_draw_popups(args.source)
+    mask_and_detect_popups(args.source, args.output_dir)
 
 
 
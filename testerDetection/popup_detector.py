@@ -0,0 +1,105 @@
+'''
+popup_detector.py
+Colour confirmation of popups inside the changed regions of a frame.
+
+The frame difference tells where the screen changed. Only the bounding boxes
+of the large changed regions are converted to HSV and masked with the blue
+popup range of popup_detection, so the colour analysis costs in proportion
+to the changed area instead of a full-frame HSV pass per frame. A changed
+region is confirmed as a popup when its largest blue contour is big enough,
+covers most of the region and is close to a filled rectangle.
+'''
+import math
+import cv2
+
+from popup_detection import BLUE_SECOND, ScreenLayout
+
+
+class PopupDetector(object):
+    ''' blue popup check on the changed regions of a FrameDiff
+
+        blue: HSV (lower, upper) range of the popup colour
+        min_area: minimum blue contour area in native frame pixels (popup_detection contour limit)
+        min_cover: fraction of the changed region box the blue contour must cover
+        min_fill: contour area over its bounding rectangle area, 1 for a perfect rectangle
+        margin: native pixels added around each changed region
+    '''
+    def __init__(self, blue=BLUE_SECOND, min_area=10000, min_cover=0.5, min_fill=0.85, margin=4):
+        self.blue = blue
+        self.min_area = min_area
+        self.min_cover = min_cover
+        self.min_fill = min_fill
+        self.margin = margin
+        self.rect = None
+        self.checks = 0
+        self.checked_pixels = 0
+
+    def candidates(self, frame_diff, min_area, stats=None):
+        ''' native (x0, y0, x1, y1) boxes of the changed regions of %frame_diff larger than %min_area
+            native pixels, grown by the margin
+            stats: frame_diff.blob_stats() if computed already
+        '''
+        H, W = frame_diff.frame_shape
+        _sx, _sy = W / frame_diff.shape[1], H / frame_diff.shape[0]
+        _min = min_area / (_sx * _sy)
+        boxes = []
+        for x, y, w, h, area in frame_diff.blob_stats() if stats is None else stats:
+            if area <= _min:
+                continue
+            boxes.append((max(0, int(x * _sx) - self.margin), max(0, int(y * _sy) - self.margin),
+                min(W, int(math.ceil((x + w) * _sx)) + self.margin), min(H, int(math.ceil((y + h) * _sy)) + self.margin)))
+        return boxes
+
+    def confirm(self, frame, box, min_area=None):
+        ''' popup rectangle (x, y, w, h) in native pixels inside %box (x0, y0, x1, y1) of BGR %frame, None if none '''
+        min_area = self.min_area if min_area is None else min_area
+        x0, y0, x1, y1 = box
+        hsv = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, *self.blue)
+        self.checks += 1
+        self.checked_pixels += mask.size
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        best, best_area = None, 0
+        for contour in contours:
+            area = cv2.contourArea(contour)
+            if area < min_area or area < self.min_cover * mask.size or area <= best_area:
+                continue
+            x, y, w, h = cv2.boundingRect(contour)
+            if area < self.min_fill * w * h:
+                continue
+            best, best_area = (x0 + x, y0 + y, w, h), area
+        return best
+
+    def detect(self, frame, frame_diff, reduce=1, boxes=None):
+        ''' check the large changed regions of %frame_diff in BGR %frame (the frame it was updated with)
+            reduce: size reduction of %frame by the source, areas are scaled to match
+            boxes: candidates() of this frame if already known
+            return the largest confirmed popup rectangle (x, y, w, h) in %frame pixels or None
+        '''
+        self.rect = None
+        _min = self.min_area / reduce ** 2
+        for box in boxes if boxes is not None else self.candidates(frame_diff, _min):
+            rect = self.confirm(frame, box, _min)
+            if rect is not None and (self.rect is None or rect[2] * rect[3] > self.rect[2] * self.rect[3]):
+                self.rect = rect
+        return self.rect
+
+    def find(self, frame):
+        ''' full-frame search of BGR %frame (a saved popup screenshot): blue, nearly filled
+            rectangles below the popup_detection screen bars, grown by the margin
+            return list of (x, y, w, h) in %frame pixels
+        '''
+        H, W = frame.shape[:2]
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        top_y, bottom_y = ScreenLayout().detect(hsv)
+        contours, _ = cv2.findContours(cv2.inRange(hsv[top_y:bottom_y], *self.blue), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        rects = []
+        for contour in contours:
+            area = cv2.contourArea(contour)
+            x, y, w, h = cv2.boundingRect(contour)
+            # full-width contours are the tester screen bars
+            if area < self.min_area or w > W * 0.99 or area < self.min_fill * w * h:
+                continue
+            x0, y0 = max(0, x - self.margin), max(0, top_y + y - self.margin)
+            rects.append((x0, y0, min(W, x + w + self.margin) - x0, min(H, top_y + y + h + self.margin) - y0))
+        return rects
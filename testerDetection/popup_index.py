@@ -0,0 +1,163 @@
+'''
+popup_index.py
+Signature index of the popups seen on a tester type.
+
+Tester UIs show the same few dialogs over and over. Each popup is stored as
+a 64-bit difference hash (dHash of the 9x8 area-reduced gray region), its
+mean color and its bounding box as fractions of the frame size, with a label. A candidate region
+is hashed (one resize of the region, no HSV or contour pass) and matched by
+Hamming distance, mean color, box size and box overlap, so a known dialog is recognised at once.
+The 9x8 hash of flat dialogs in the same UI palette differs by a few bits only, the
+box has to agree closely as well.
+
+There is one index file per tester type. It holds at most `capacity`
+entries, the least recently matched ones are evicted first. Changes only mark
+the index dirty, the owner writes it with save() outside the frame loop.
+'''
+import os
+import cv2
+import json
+import time
+import logging
+import numpy as np
+from collections import OrderedDict
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'testerDetection', 'popups')
+
+
+def index_file(det_type, path=DEFAULT_DIR):
+    ''' index file of tester type %det_type '''
+    return os.path.join(path, 'type{}.json'.format(det_type))
+
+
+def signature(image):
+    ''' (64-bit difference hash, mean color) of gray or BGR %image
+        the centre crop divisible by the 9x8 grid is reduced, an integer area reduction is much
+        faster than a fractional one and drops a few edge pixels only
+    '''
+    H, W = image.shape[:2]
+    _fx, _fy = max(1, W // 9), max(1, H // 8)
+    _x, _y = max(0, (W - 9 * _fx) // 2), max(0, (H - 8 * _fy) // 2)
+    _small = cv2.resize(image[_y:_y + 8 * _fy, _x:_x + 9 * _fx], (9, 8), interpolation=cv2.INTER_AREA)
+    # the hash of a nearly flat dialog has few bits set, the mean color tells it from the background
+    _mean = [int(round(m)) for m in _small.reshape(-1, _small.shape[2] if _small.ndim == 3 else 1).mean(axis=0)]
+    if _small.ndim == 3:
+        _small = cv2.cvtColor(_small, cv2.COLOR_BGR2GRAY)
+    return int.from_bytes(np.packbits(_small[:, 1:] > _small[:, :-1]).tobytes(), 'big'), _mean
+
+
+def overlap(a, b):
+    ''' intersection over union of boxes (x, y, w, h) '''
+    _w = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    _h = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if _w <= 0 or _h <= 0:
+        return 0.0
+    _i = _w * _h
+    return _i / (a[2] * a[3] + b[2] * b[3] - _i)
+
+
+class PopupIndex(object):
+    ''' LRU index of popup signatures, persisted as JSON
+
+        file: index file, see index_file(), None to keep the index in memory only
+        capacity: maximum number of popups kept
+        max_distance: maximum Hamming distance of a matching signature
+        max_color: maximum difference of a mean color channel of a match
+        min_overlap: minimum box overlap (intersection over union) of a match
+        max_size: maximum relative difference of the box width and height of a match
+    '''
+    def __init__(self, file=None, capacity=64, max_distance=6, max_color=24, min_overlap=0.8, max_size=0.05):
+        self.file = file
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self.max_color = max_color
+        self.min_overlap = min_overlap
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.next_id = 1
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        ''' read the index file, an unreadable file starts an empty index '''
+        if self.file is None:
+            return
+        try:
+            with open(self.file, 'rt') as f:
+                _data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.next_id = _data.get('next-id', 1)
+        _entries = sorted(_data.get('popups', []), key=lambda e: e['last-seen'])
+        self.entries = OrderedDict((e['label'], e) for e in _entries[-self.capacity:])
+        logging.debug('Loaded {} popup signatures from {}'.format(len(self.entries), self.file))
+
+    def save(self):
+        ''' write the index file (atomic replace) '''
+        self.dirty = False
+        if self.file is None:
+            return
+        os.makedirs(os.path.dirname(self.file) or '.', exist_ok=True)
+        _tmp = '{}.{}.tmp'.format(self.file, os.getpid())
+        with open(_tmp, 'wt') as f:
+            json.dump({'next-id': self.next_id, 'popups': list(self.entries.values())}, f, indent=2)
+        os.replace(_tmp, self.file)
+
+    @staticmethod
+    def _box(shape, rect):
+        ''' pixel rect (x, y, w, h) as fractions of frame %shape '''
+        H, W = shape[:2]
+        return [round(rect[0] / W, 4), round(rect[1] / H, 4), round(rect[2] / W, 4), round(rect[3] / H, 4)]
+
+    def _same_size(self, a, b):
+        ''' True if boxes (x, y, w, h) %a and %b agree in width and height within max_size '''
+        return abs(a[2] - b[2]) <= self.max_size * max(a[2], b[2]) and abs(a[3] - b[3]) <= self.max_size * max(a[3], b[3])
+
+    def lookup(self, frame, rect):
+        ''' entry of the known popup in pixel rect (x, y, w, h) of %frame, None if unknown '''
+        x, y, w, h = rect
+        _hash, _color = signature(frame[y:y + h, x:x + w])
+        _box = self._box(frame.shape, rect)
+        best, best_dist = None, self.max_distance + 1
+        for entry in self.entries.values():
+            _dist = bin(_hash ^ entry['hash']).count('1')
+            if _dist < best_dist and len(_color) == len(entry['color']) and \
+                    max(abs(a - b) for a, b in zip(_color, entry['color'])) <= self.max_color and \
+                    self._same_size(_box, entry['box']) and overlap(_box, entry['box']) >= self.min_overlap:
+                best, best_dist = entry, _dist
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        best['hits'] += 1
+        best['last-seen'] = time.time()
+        self.entries.move_to_end(best['label'])
+        self.dirty = True
+        return best
+
+    def add(self, frame, rect, label=None):
+        ''' store the popup in pixel rect (x, y, w, h) of %frame, return its entry, see save()
+            label: popup name, numbered 'popup-N' if not given
+        '''
+        x, y, w, h = rect
+        if label is None:
+            label = 'popup-{}'.format(self.next_id)
+            self.next_id += 1
+        _hash, _color = signature(frame[y:y + h, x:x + w])
+        entry = {
+            'label': label,
+            'hash': _hash,
+            'color': _color,
+            'box': self._box(frame.shape, rect),
+            'hits': 0,
+            'last-seen': time.time(),
+        }
+        self.entries.pop(label, None)
+        self.entries[label] = entry
+        while len(self.entries) > self.capacity:
+            _label, _ = self.entries.popitem(last=False)
+            logging.debug('Evicted popup {} from signature index'.format(_label))
+        self.dirty = True
+        return entry
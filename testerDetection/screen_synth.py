@@ -0,0 +1,288 @@
+'''
+screen_synth.py
+Synthetic tester screens with ground-truth events.
+
+TesterScreen renders tester-like screens for the three DET_TYPE UI types:
+blue title / status bars in the HSV range popup_detection looks for, a
+scrolling log panel, popups at configurable position, size and colour, and a
+mouse cursor. Popups are dismissed either with the mouse (the cursor moves
+to the OK button first) or with the keyboard (no cursor motion at all).
+
+Frames only depend on the frame index, so sources can seek and segments
+can be rendered in parallel. A screen is used as generator of a
+SyntheticSource (see source()) or written to a video file, and labels()
+returns the ground truth: popup shown / dismissed, the interaction and the
+alerts the detection is expected to raise.
+'''
+import cv2
+import logging
+import numpy as np
+
+from frame_source import SyntheticSource
+
+# BGR colours inside the blue HSV ranges of popup_detection
+BAR_BGR = (180, 90, 20)
+
+# layout of the three DET_TYPE UI types, rects as (x, y, w, h) fractions of the screen
+# popup colours are blue and differ from the background in luminance by more than the DET_TYPE threshold
+UI_LAYOUTS = [
+    {'background': (205, 205, 205), 'text': (40, 40, 40), 'title': 'TESTER A', 'popup': ((140, 40, 0), (100, 25, 0)),
+     'bars': [(0.0, 0.0, 1.0, 0.06), (0.0, 0.95, 1.0, 0.05)],
+     'panels': [(0.02, 0.09, 0.28, 0.83)], 'log': (0.33, 0.09, 0.65, 0.83)},
+    {'background': (15, 15, 15), 'text': (210, 210, 210), 'title': 'TESTER B', 'popup': ((255, 200, 120), (220, 150, 60)),
+     'bars': [(0.0, 0.94, 1.0, 0.06)],
+     'panels': [(0.02, 0.03, 0.96, 0.40)], 'log': (0.02, 0.46, 0.96, 0.45)},
+    {'background': (250, 250, 250), 'text': (20, 20, 20), 'title': 'TESTER C', 'popup': ((200, 120, 40), (150, 70, 10)),
+     'bars': [(0.0, 0.0, 1.0, 0.08)],
+     'panels': [(0.0, 0.08, 0.15, 0.92)], 'log': (0.70, 0.12, 0.28, 0.84)},
+]
+
+# arrow cursor outline in pixels at cursor scale 1, tip at (0, 0)
+CURSOR_SHAPE = np.array([(0, 0), (0, 17), (4, 13), (7, 19), (10, 18), (7, 12), (12, 12)], np.int32)
+
+LOG_MESSAGES = ['measure vdd', 'load pattern', 'check continuity', 'leakage test', 'functional test',
+                'read trim', 'write otp', 'scan chain', 'verify', 'bin result']
+
+
+class Popup(object):
+    ''' popup shown from %start to %end seconds
+
+        rect: (x, y, w, h) fractions of the screen
+        colour: BGR fill colour, None for the blue popup colour of the UI layout
+        dismiss: 'keyboard' (closes without cursor motion) or 'mouse'
+                 (cursor moves onto the OK button during the last %move seconds)
+    '''
+    def __init__(self, start, end, rect=(0.3, 0.3, 0.4, 0.3), colour=None, dismiss='keyboard', title='Warning', move=1.5):
+        self.start = start
+        self.end = end
+        self.rect = rect
+        self.colour = colour
+        self.dismiss = dismiss
+        self.title = title
+        self.move = move
+
+    def shown(self, t):
+        return self.start <= t < self.end
+
+
+def content_area(det_type):
+    ''' (x, y, w, h) fractions of the screen between the top and bottom bars of UI type %det_type '''
+    _bars = UI_LAYOUTS[det_type]['bars']
+    _top = max([y + h for x, y, w, h in _bars if y < 0.5], default=0.0)
+    _bottom = min([y for x, y, w, h in _bars if y >= 0.5], default=1.0)
+    return (0.0, _top, 1.0, _bottom - _top)
+
+
+def random_popups(duration, det_type=2, seed=0, min_gap=10.0, max_gap=40.0, min_len=5.0, max_len=60.0, mouse=0.5,
+        margin=0.04):
+    ''' random popup schedule over %duration seconds inside the content area of %det_type
+        mouse: fraction of popups dismissed with the mouse
+        margin: minimum distance of a popup to the content area border, fraction of the screen
+    '''
+    cx, cy, cw, ch = content_area(det_type)
+    rng = np.random.default_rng(seed)
+    popups, t = [], float(rng.uniform(min_gap / 2, max_gap / 2))
+    while t < duration:
+        _len = float(rng.uniform(min_len, max_len))
+        _w, _h = float(rng.uniform(0.2, 0.45)), float(rng.uniform(0.15, 0.35))
+        _x = float(rng.uniform(cx + margin, cx + cw - margin - _w))
+        _y = float(rng.uniform(cy + margin, cy + ch - margin - _h))
+        popups.append(Popup(round(t, 3), round(t + _len, 3), rect=(_x, _y, _w, _h),
+            dismiss='mouse' if rng.random() < mouse else 'keyboard',
+            title=['Warning', 'Error', 'Confirm', 'Retest'][int(rng.integers(4))]))
+        t += _len + float(rng.uniform(min_gap, max_gap))
+    return popups
+
+
+class TesterScreen(object):
+    ''' renders tester screens, callable as SyntheticSource generator
+
+        det_type: UI layout (index of DET_TYPE)
+        popups: list of Popup, random schedule of %duration seconds if None
+        duration: length of the scenario in seconds
+        log_rate: new log lines per second, 0 for a static log
+        wander: seconds between cursor moves while no popup is shown, 0 for a still cursor
+        cursor_scale: cursor size factor
+    '''
+    def __init__(self, det_type=2, width=1280, height=720, fps=30.0, popups=None, duration=600.0,
+            log_rate=0.5, wander=4.0, cursor_scale=1.0, seed=0):
+        self.det_type = det_type
+        self.layout = UI_LAYOUTS[det_type]
+        self.width, self.height = width, height
+        self.fps = fps
+        self.duration = duration
+        self.popups = popups if popups is not None else random_popups(duration, det_type, seed)
+        self.popups.sort(key=lambda p: p.start)
+        self.log_rate = log_rate
+        self.cursor_scale = cursor_scale
+        self.seed = seed
+        self.font_scale = height / 1000.0
+        self.line_height = max(8, int(round(26 * self.font_scale)))
+        self.cursor_path = self._cursor_path(wander)
+        self._base = self._render_base()
+        self._log = (None, None)
+
+    def _px(self, rect):
+        ''' fraction rect to pixel (x0, y0, x1, y1) '''
+        x, y, w, h = rect
+        return (int(round(x * self.width)), int(round(y * self.height)),
+                int(round((x + w) * self.width)), int(round((y + h) * self.height)))
+
+    def _button(self, popup):
+        ''' pixel rect of the OK button of %popup '''
+        x0, y0, x1, y1 = self._px(popup.rect)
+        _bw, _bh = max(10, (x1 - x0) // 5), max(6, (y1 - y0) // 6)
+        return (x1 - _bw - _bh // 2, y1 - _bh - _bh // 2, x1 - _bh // 2, y1 - _bh // 2)
+
+    def _render_base(self):
+        ''' static part of the screen: background, bars and panels '''
+        image = np.empty((self.height, self.width, 3), np.uint8)
+        image[:] = self.layout['background']
+        for bar in self.layout['bars']:
+            x0, y0, x1, y1 = self._px(bar)
+            cv2.rectangle(image, (x0, y0), (x1 - 1, y1 - 1), BAR_BGR, -1)
+        x0, y0, x1, y1 = self._px(self.layout['bars'][0])
+        cv2.putText(image, self.layout['title'], (x0 + self.line_height, (y0 + y1 + self.line_height // 2) // 2),
+            cv2.FONT_HERSHEY_SIMPLEX, self.font_scale, (255, 255, 255), max(1, int(2 * self.font_scale)), cv2.LINE_AA)
+        for i, panel in enumerate(self.layout['panels']):
+            x0, y0, x1, y1 = self._px(panel)
+            cv2.rectangle(image, (x0, y0), (x1 - 1, y1 - 1), self.layout['text'], 1)
+            for j in range(max(0, (y1 - y0) // (2 * self.line_height) - 1)):
+                cv2.putText(image, 'PARAM {:02d}  {:7.3f}'.format(j, ((i + 1) * 17.3 * (j + 1)) % 100),
+                    (x0 + 6, y0 + (2 * j + 2) * self.line_height), cv2.FONT_HERSHEY_PLAIN,
+                    self.font_scale * 1.2, self.layout['text'], 1)
+        return image
+
+    def _cursor_path(self, wander):
+        ''' cursor waypoints (time, x, y): wandering between popups, still while a popup is
+            shown, moving onto the OK button before a mouse dismissal
+        '''
+        rng = np.random.default_rng(self.seed + 1)
+        x0, y0, x1, y1 = self._px((0.1, 0.15, 0.8, 0.7))
+        path = [(0.0, (x0 + x1) / 2, (y0 + y1) / 2)]
+        t = 0.0
+        for popup in self.popups + [None]:
+            # after the last popup keep wandering for a minute, then the screen is still
+            _until = popup.start if popup is not None else (self.popups[-1].end if self.popups else 0.0) + 60.0
+            if wander:
+                while t + wander < _until - 1.0:
+                    t += wander
+                    path.append((t - wander / 2, path[-1][1], path[-1][2]))
+                    path.append((t, float(rng.uniform(x0, x1)), float(rng.uniform(y0, y1))))
+            if popup is None:
+                break
+            if popup.dismiss == 'mouse':
+                bx0, by0, bx1, by1 = self._button(popup)
+                path.append((popup.end - popup.move, path[-1][1], path[-1][2]))
+                path.append((popup.end, (bx0 + bx1) / 2, (by0 + by1) / 2))
+            t = max(t, popup.end)
+        return np.asarray(path, np.float64)
+
+    def cursor(self, t):
+        ''' cursor position (x, y) at %t seconds '''
+        _p = self.cursor_path
+        return (float(np.interp(t, _p[:, 0], _p[:, 1])), float(np.interp(t, _p[:, 0], _p[:, 2])))
+
+    def _log_panel(self, t):
+        ''' log panel image at %t seconds, re-rendered only when a line was added '''
+        _lines = int(t * self.log_rate) if self.log_rate else 0
+        if self._log[0] == _lines:
+            return self._log[1]
+        x0, y0, x1, y1 = self._px(self.layout['log'])
+        panel = self._base[y0:y1, x0:x1].copy()
+        _rows = max(1, (y1 - y0) // self.line_height - 1)
+        for r, n in enumerate(range(max(0, _lines - _rows), _lines)):
+            _sec = int(n / self.log_rate)
+            cv2.putText(panel, '{:02d}:{:02d}:{:02d} #{:05d} {} ... {}'.format(
+                    _sec // 3600, _sec // 60 % 60, _sec % 60, n, LOG_MESSAGES[n % len(LOG_MESSAGES)],
+                    'FAIL' if n % 13 == 7 else 'PASS'),
+                (4, (r + 1) * self.line_height), cv2.FONT_HERSHEY_PLAIN, self.font_scale * 1.2, self.layout['text'], 1)
+        self._log = (_lines, panel)
+        return panel
+
+    def _draw_popup(self, image, popup):
+        x0, y0, x1, y1 = self._px(popup.rect)
+        _fill, _title = self.layout['popup'] if popup.colour is None else (popup.colour, popup.colour)
+        cv2.rectangle(image, (x0, y0), (x1 - 1, y1 - 1), _fill, -1)
+        _th = max(self.line_height, (y1 - y0) // 6)
+        cv2.rectangle(image, (x0, y0), (x1 - 1, y0 + _th), _title, -1)
+        cv2.putText(image, popup.title, (x0 + 8, y0 + _th - _th // 4), cv2.FONT_HERSHEY_SIMPLEX,
+            self.font_scale, (255, 255, 255), max(1, int(2 * self.font_scale)), cv2.LINE_AA)
+        cv2.putText(image, 'Operator action required', (x0 + 8, y0 + 2 * _th + self.line_height // 2),
+            cv2.FONT_HERSHEY_PLAIN, self.font_scale * 1.4, (255, 255, 255), 1)
+        bx0, by0, bx1, by1 = self._button(popup)
+        cv2.rectangle(image, (bx0, by0), (bx1, by1), (240, 240, 240), -1)
+        cv2.putText(image, 'OK', (bx0 + (bx1 - bx0) // 3, by1 - (by1 - by0) // 4), cv2.FONT_HERSHEY_PLAIN,
+            self.font_scale * 1.4, (20, 20, 20), 1)
+
+    def _draw_cursor(self, image, x, y):
+        _pts = (CURSOR_SHAPE * self.cursor_scale * self.height / 720.0).astype(np.int32) + (int(x), int(y))
+        cv2.fillPoly(image, [_pts], (255, 255, 255))
+        cv2.polylines(image, [_pts], True, (0, 0, 0), 1)
+
+    def render(self, t, image=None):
+        ''' screen at %t seconds into %image (H, W, 3) uint8 '''
+        if image is None or image.shape != self._base.shape:
+            image = np.empty_like(self._base)
+        np.copyto(image, self._base)
+        x0, y0, x1, y1 = self._px(self.layout['log'])
+        image[y0:y1, x0:x1] = self._log_panel(t)
+        for popup in self.popups:
+            if popup.start > t:
+                break
+            if popup.shown(t):
+                self._draw_popup(image, popup)
+        self._draw_cursor(image, *self.cursor(t))
+        return image
+
+    def __call__(self, index, image):
+        return self.render(index / self.fps, image)
+
+    def source(self, duration=None, gray=False):
+        ''' SyntheticSource streaming this screen, endless if %duration is None '''
+        _count = int(round(duration * self.fps)) if duration is not None else -1
+        return SyntheticSource(width=self.width, height=self.height, fps=self.fps, count=_count,
+            gray=gray, generator=self)
+
+    def labels(self, duration, frame_threshold=30):
+        ''' ground-truth events within %duration seconds, sorted by time
+            popup: popup shown (with pixel bbox), interaction: cursor starts moving onto the
+            popup, dismiss: popup closed, alert: popup left unattended for %frame_threshold seconds
+        '''
+        events = []
+        for popup in self.popups:
+            if popup.start >= duration:
+                break
+            x0, y0, x1, y1 = self._px(popup.rect)
+            events.append({'time': popup.start, 'event': 'popup', 'bbox': [x0, y0, x1 - x0, y1 - y0], 'title': popup.title})
+            _attended = popup.end - popup.move if popup.dismiss == 'mouse' else popup.end
+            if min(_attended, duration) - popup.start > frame_threshold:
+                events.append({'time': popup.start + frame_threshold, 'event': 'alert'})
+            if popup.dismiss == 'mouse' and _attended < duration:
+                events.append({'time': _attended, 'event': 'interaction'})
+            if popup.end < duration:
+                events.append({'time': popup.end, 'event': 'dismiss', 'by': popup.dismiss})
+        return sorted(events, key=lambda e: e['time'])
+
+    def alert_times(self, duration, frame_threshold=30):
+        ''' expected alert times, the label format of algo-sweep '''
+        return [e['time'] for e in self.labels(duration, frame_threshold) if e['event'] == 'alert']
+
+    def write(self, path, duration, fourcc=None):
+        ''' render %duration seconds to video file %path, return number of frames '''
+        if fourcc is None:
+            fourcc = 'mp4v' if str(path).lower().endswith('.mp4') else 'MJPG'
+        writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*fourcc), self.fps, (self.width, self.height))
+        if not writer.isOpened():
+            logging.error('Cannot open video writer for {}'.format(path))
+            return 0
+        _src, frames = self.source(duration), 0
+        while True:
+            ret, frame = _src.read()
+            if not ret:
+                break
+            writer.write(frame)
+            frames += 1
+        writer.release()
+        logging.debug('Wrote {} frames of tester type {} to {}'.format(frames, self.det_type, path))
+        return frames
@@ -0,0 +1,98 @@
+'''
+stage_timer.py
+Low-overhead per-stage timing of the detection loops.
+
+A StageTimer times every sample-th frame only. A timed frame is split into
+stages by lap() calls, each lap charges the time since the previous one to
+its stage. The last `window` timed frames are kept in a ring, summary()
+reports percentiles and a histogram per stage together with the process CPU
+time. Frames that are not sampled cost one counter increment and a None
+check per lap.
+'''
+import time
+import numpy as np
+
+# histogram bucket edges in ms
+BUCKETS_MS = [0.0, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, np.inf]
+
+
+class StageTimer(object):
+    ''' rolling per-stage timing with sampling
+
+        stages: stage names in pipeline order
+        sample: time every sample-th frame, 0 to disable timing
+        window: number of timed frames kept for the summary
+    '''
+    def __init__(self, stages, sample=10, window=512):
+        self.stages = list(stages)
+        self.sample = sample
+        self.window = window
+        self._idx = {s: i for i, s in enumerate(self.stages)}
+        self.samples = np.zeros((len(self.stages), window), np.float64)
+        self.timed = 0
+        self.frames = 0
+        self._acc = np.zeros(len(self.stages), np.float64)
+        self._t = None
+        self._mark = (time.monotonic(), time.process_time())
+
+    def begin(self):
+        ''' start a frame, returns True if it is timed '''
+        self.frames += 1
+        if not self.sample or self.frames % self.sample:
+            self._t = None
+            return False
+        self._acc[:] = 0.0
+        self._t = time.perf_counter()
+        return True
+
+    def lap(self, stage):
+        ''' charge the time since the last lap to %stage, unknown stages are not timed '''
+        if self._t is None:
+            return
+        _now = time.perf_counter()
+        _i = self._idx.get(stage, None)
+        if _i is not None:
+            self._acc[_i] += _now - self._t
+        self._t = _now
+
+    def end(self):
+        ''' finish a timed frame and add it to the ring '''
+        if self._t is None:
+            return
+        self.samples[:, self.timed % self.window] = self._acc
+        self.timed += 1
+        self._t = None
+
+    def summary(self, mark=False):
+        ''' per-stage ms percentiles and histogram over the window, CPU load since the last mark
+            mark: start a new CPU load interval (periodic publisher)
+        '''
+        _n = min(self.timed, self.window)
+        _ms = self.samples[:, :_n] * 1000.0
+        stages = {}
+        for i, s in enumerate(self.stages):
+            if not _n:
+                break
+            _t = _ms[i]
+            stages[s] = {
+                'mean': round(float(_t.mean()), 4),
+                'p50': round(float(np.percentile(_t, 50)), 4),
+                'p90': round(float(np.percentile(_t, 90)), 4),
+                'p99': round(float(np.percentile(_t, 99)), 4),
+                'max': round(float(_t.max()), 4),
+                'hist': np.histogram(_t, BUCKETS_MS)[0].tolist(),
+            }
+        _wall, _cpu = time.monotonic(), time.process_time()
+        _load = (_cpu - self._mark[1]) / (_wall - self._mark[0]) if _wall > self._mark[0] else 0.0
+        if mark:
+            self._mark = (_wall, _cpu)
+        return {
+            'frames': self.frames,
+            'timed-frames': self.timed,
+            'sample': self.sample,
+            'total-ms': round(float(_ms.sum(axis=0).mean()), 4) if _n else 0.0,
+            'stages': stages,
+            'buckets-ms': BUCKETS_MS[1:-1],
+            'cpu-seconds': round(_cpu, 3),
+            'cpu-load': round(_load, 3),
+        }
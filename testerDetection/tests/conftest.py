@@ -0,0 +1,27 @@
+'''
+conftest.py
+Shared setup of the detection tests: module paths and replay arguments.
+'''
+import sys
+import pathlib
+import argparse
+import importlib
+
+scriptPath = pathlib.Path(__file__).parent.parent.resolve()
+sys.path.append(str(scriptPath))
+sys.path.append(str(scriptPath / 'common'))
+
+
+def replay_args(**kw):
+    ''' algo-replay arguments with the command line defaults, overridden by %kw '''
+    args = argparse.Namespace(id='test', det_type=2, start_sec=0.0, scale=1.0, tile=0, static_tol=0.5,
+        gray_capture=False, stride=1, timing_sample=0, cursor=False, popup_color=False, popup_index=None,
+        ack=-1.0, test_screen=False)
+    for k, v in kw.items():
+        setattr(args, k, v)
+    return args
+
+
+def replay(source, **kw):
+    ''' replay report of frame source %source, see algo-replay.replay '''
+    return importlib.import_module('algo-replay').replay(source, replay_args(**kw))
@@ -0,0 +1,66 @@
+'''
+test_cursor.py
+Cursor based interaction detection on synthetic tester screens.
+'''
+import pytest
+
+from conftest import replay
+import screen_synth
+from frame_diff import FrameDiff
+from cursor_detector import CursorDetector, CursorTracker
+
+DURATION = 200.0
+# cursor tip in template.png
+TEMPLATE_TIP = (4, 4)
+
+
+def alert_times(report):
+    return [e['time'] for e in report['events'] if e['stage'] == 'alert']
+
+
+@pytest.mark.parametrize('det_type', [1])
+def test_cursor_mode_keeps_alerts(det_type):
+    ''' --cursor finds the same alerts as the pixel count path and the ground truth '''
+    screen = screen_synth.TesterScreen(det_type, 1280, 720)
+    expected = screen.alert_times(DURATION, frame_threshold=30)
+    plain = alert_times(replay(screen.source(DURATION), det_type=det_type, ack=5.0))
+    cursor = alert_times(replay(screen.source(DURATION), det_type=det_type, ack=5.0, cursor=True))
+    assert cursor == plain
+    assert len(cursor) == len(expected)
+    assert all(abs(a - e) < 0.2 for a, e in zip(cursor, expected))
+
+
+@pytest.mark.parametrize('det_type', [0, 1, 2])
+def test_cursor_localisation(det_type):
+    ''' the tracker follows the wandering cursor of the screen within a few pixels '''
+    screen = screen_synth.TesterScreen(det_type, 1280, 720, popups=[])
+    # first waypoint pair: still until 2 s, moving until 4 s, still until 6 s
+    _t0, _t1, _t2 = screen.cursor_path[1:4, 0]
+    tracker = CursorTracker(CursorDetector())
+    diff = FrameDiff(100)
+    diff.reset(screen.render(_t0))
+    for k in range(1, int((_t2 - _t0) * screen.fps)):
+        t = _t0 + k / screen.fps
+        nonzero = diff.update(screen.render(t))
+        if nonzero:
+            tracker.update(diff.prev, t, diff.bbox(), diff.mask)
+        else:
+            tracker.still(t)
+        if t < _t1:
+            assert tracker.locked and tracker.moved
+            x, y, w, h, scale, _ = tracker.match
+            cx, cy = screen.cursor(t)
+            assert abs(x + TEMPLATE_TIP[0] * scale - cx) <= 3 and abs(y + TEMPLATE_TIP[1] * scale - cy) <= 3
+        elif t > _t1 + 1.0 / screen.fps:
+            assert not tracker.moved
+
+
+def test_cursor_dismissal_is_interaction():
+    ''' moving the cursor onto the OK button resets the popup before its alert '''
+    popup = screen_synth.Popup(6.0, 20.0, dismiss='mouse')
+    screen = screen_synth.TesterScreen(1, 1280, 720, popups=[popup], duration=40.0)
+    events = replay(screen.source(40.0), det_type=1, cursor=True)['events']
+    stages = [(e['time'], e['stage']) for e in events if e['stage'] in ('popUp', 'alert-reset', 'alert')]
+    assert stages[0][1] == 'popUp' and abs(stages[0][0] - popup.start) < 0.1
+    assert stages[1][1] == 'alert-reset' and popup.end - popup.move <= stages[1][0] < popup.end
+    assert 'alert' not in [s for _, s in stages]
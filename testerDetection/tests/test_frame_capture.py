@@ -0,0 +1,34 @@
+'''
+test_frame_capture.py
+Capture thread pacing of recorded and generated sources.
+'''
+import time
+
+from frame_capture import CaptureThread
+from frame_source import SyntheticSource
+
+
+def _capture_seconds(cap):
+    ''' wall time the capture thread takes to read %cap to the end '''
+    _start = time.monotonic()
+    capture = CaptureThread(cap).start()
+    capture.th.join(10)
+    _elapsed = time.monotonic() - _start
+    capture.release()
+    return _elapsed, capture.captured
+
+
+def test_synthetic_source_is_paced_to_its_fps():
+    ''' 20 frames at 40 fps take half a second, like a camera would deliver them '''
+    _elapsed, _frames = _capture_seconds(SyntheticSource(64, 48, fps=40.0, count=20))
+    assert _frames == 20
+    assert 19 / 40.0 - 0.02 <= _elapsed < 19 / 40.0 + 0.5
+
+
+def test_live_source_is_not_paced():
+    ''' a live source delivers at its own rate, the thread reads it as fast as it can '''
+    cap = SyntheticSource(64, 48, fps=1.0, count=20)
+    cap.live = True
+    _elapsed, _frames = _capture_seconds(cap)
+    assert _frames == 20
+    assert _elapsed < 1.0
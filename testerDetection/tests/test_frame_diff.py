@@ -0,0 +1,37 @@
+'''
+test_frame_diff.py
+Frame difference engines on synthetic tester screens.
+'''
+import pytest
+
+import screen_synth
+from frame_diff import FrameDiff, TiledFrameDiff
+
+SCALES = [1.0, 0.5, 0.25]
+TILES = [4, 8, 16]
+
+
+@pytest.mark.parametrize('det_type', [0, 1, 2])
+def test_tiled_diff_equals_full_diff(det_type):
+    ''' same changed pixel count, mask and region result as FrameDiff at every scale x tile combination,
+        over wandering cursor, log lines and the first popup of the screen
+    '''
+    screen = screen_synth.TesterScreen(det_type, 1280, 720)
+    _threshold = [150, 150, 100][det_type]
+    engines = [(FrameDiff(_threshold * s, scale=s), [TiledFrameDiff(_threshold * s, tile=t, scale=s) for t in TILES])
+        for s in SCALES]
+    src = screen.source(16.0)
+    _, frame = src.read()
+    for full, tiled in engines:
+        for e in [full] + tiled:
+            e.reset(frame)
+    while True:
+        ret, frame = src.read()
+        if not ret:
+            break
+        for full, tiled in engines:
+            nonzero = full.update(frame)
+            for e in tiled:
+                assert e.update(frame) == nonzero, (src.timestamp, full.scale, e.tile)
+                assert (e.mask == full.mask).all()
+                assert e.significant_change(1000) == full.significant_change(1000)
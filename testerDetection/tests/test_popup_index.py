@@ -0,0 +1,44 @@
+'''
+test_popup_index.py
+Popup signature index on synthetic tester screens.
+'''
+import pytest
+
+import screen_synth
+from popup_detector import PopupDetector
+from popup_index import PopupIndex
+
+W, H = 1280, 720
+
+
+def popup_frame(det_type, rect, title):
+    ''' screen of UI type %det_type showing one popup at pixel %rect (x, y, w, h) '''
+    x, y, w, h = rect
+    popup = screen_synth.Popup(0.0, 10.0, rect=(x / W, y / H, w / W, h / H), title=title)
+    return screen_synth.TesterScreen(det_type, W, H, popups=[popup]).render(1.0)
+
+
+@pytest.mark.parametrize('det_type', [0, 1, 2])
+def test_different_dialogs_get_different_labels(det_type):
+    ''' two dialogs of the same palette and overlapping boxes are told apart, each is found again '''
+    detector, index = PopupDetector(), PopupIndex()
+    labels = []
+    for rect, title in [((513, 155, 299, 212), 'Confirm'), ((490, 186, 439, 154), 'Retest')]:
+        frame = popup_frame(det_type, rect, title)
+        rects = detector.find(frame)
+        assert len(rects) == 1
+        assert index.lookup(frame, rects[0]) is None
+        labels.append((frame, rects[0], index.add(frame, rects[0])['label']))
+    assert labels[0][2] != labels[1][2]
+    for frame, rect, label in labels:
+        assert index.lookup(frame, rect)['label'] == label
+
+
+def test_add_defers_the_file_write(tmp_path):
+    ''' learning a popup only marks the index dirty, save() writes it '''
+    frame = popup_frame(1, (513, 155, 299, 212), 'Confirm')
+    index = PopupIndex(str(tmp_path / 'type1.json'))
+    index.add(frame, PopupDetector().find(frame)[0])
+    assert index.dirty and not (tmp_path / 'type1.json').exists()
+    index.save()
+    assert not index.dirty and len(PopupIndex(str(tmp_path / 'type1.json')).entries) == 1